@@ -2,12 +2,12 @@
 Extract clips of youtube videos where a word is pronounced
 """
 import argparse
-from concurrent.futures.thread import ThreadPoolExecutor
+import os
 from copy import deepcopy
 
-from commands.catch import process, build
+from commands.catch import process, build, pipeline
 from commands.catch.config import CatchConfig
-from utils import config, logger, youtube, saved_data
+from utils import config, logger, youtube, saved_data, downloads_cache, encoding, timestamps_dataset, transcripts, clips
 
 
 def run(args):
@@ -25,21 +25,60 @@ def run(args):
 
     max_videos_amount = min(conf.max_videos_amount, len(videos))
 
+    # The final video can be built along the videos processing, consuming them in order
+    overlapped_build = None
+    if conf.do_generate_final_video and conf.do_overlap_build:
+        if conf.build_mode in ["stream", "hls"] and not conf.do_incremental_build:
+            overlapped_build = build.OverlappedBuild(conf, videos)
+            overlapped_build.start()
+        else:
+            logger.info("Overlapped build needs the stream or hls build mode without incremental build, build later")
+    on_video_done = overlapped_build.video_done if overlapped_build is not None else None
+
     if conf.max_data_thread_workers <= 1:
         for i in range(max_videos_amount):
             process.video(conf, videos, i)
+            if on_video_done is not None:
+                on_video_done(i)
     else:
-        with ThreadPoolExecutor(max_workers=conf.max_data_thread_workers) as pool:
-            for i in range(max_videos_amount):
-                # We need to copy the configuration to edit the logging prefix
-                # locally to a thread to be able to use it
-                pool.submit(process.video, deepcopy(conf), videos, i)
+        pipeline.run(conf, videos, on_video_done)
+    # Data of every processed video is saved, whatever happens during the build
+    saved_data.flush(conf)
+    if conf.do_output_data:
+        timestamps_dataset.write(conf, videos[:max_videos_amount])
+    if conf.do_save_transcripts:
+        transcripts.update_index(conf.transcripts_folder)
+
+    if conf.do_cache_downloads:
+        cache = downloads_cache.get(conf.download_folder, conf.downloads_cache_max_size * 1024 * 1024)
+        logger.info(f"Downloads cache: {cache.hits} hits, {cache.misses} misses")
 
-    if conf.do_generate_final_video:
+    if overlapped_build is not None:
+        video_file_path = overlapped_build.finish()
+        if video_file_path is not None:
+            logger.info(f"Final video: {video_file_path}", prefix=">>> ")
+        elif overlapped_build.error is not None:
+            logger.info("Build final video again after the overlapped build failure")
+            overlapped_build = None
+
+    if conf.do_generate_final_video and overlapped_build is None:
         video_file_path = build.final_video(conf, videos)
         if video_file_path is not None:
             logger.info(f"Final video: {video_file_path}", prefix=">>> ")
 
+    # Every word gets its own video out of the same clips, built in its own folders
+    if conf.do_generate_words_videos:
+        for name in conf.words_to_extract:
+            word_conf = deepcopy(conf)
+            word_conf.word_to_extract = name
+            word_conf.build_folder = os.path.join(conf.build_folder, name)
+            word_conf.data_folder = os.path.join(conf.data_folder, "words", name)
+            video_file_path = build.final_video(word_conf, clips.for_target(videos, name))
+            if video_file_path is not None:
+                logger.info(f"Final video of {name}: {video_file_path}", prefix=">>> ")
+
+    encoding.log_stats()
+
 
 def parse(prog, args):
     parser = argparse.ArgumentParser(prog=prog, description=__doc__)
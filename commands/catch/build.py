@@ -1,173 +1,957 @@
+import math
+import multiprocessing
 import os
+import queue
+import threading
+import time
 import uuid
-from collections import deque
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from copy import copy
+from itertools import chain, islice
 
+import numpy as np
+from moviepy.audio.io.ffmpeg_audiowriter import FFMPEG_AudioWriter
 from moviepy.video.compositing.CompositeVideoClip import CompositeVideoClip
 from moviepy.video.compositing.concatenate import concatenate_videoclips
 from moviepy.video.io.VideoFileClip import VideoFileClip
 
-from utils import logger, editor, saved_data, clips
+from utils import logger, editor, clips, ffmpeg, clips_cache, saved_data, encoding, journal
 
 
-def final_video(conf, videos):
-    logger.info("Build final video")
+def _close_clip(video_clip):
+    # MoviePy does not automatically close the CompositeVideoClip clips,
+    # causing issues with a "too many file descriptors" error
+    if isinstance(video_clip, CompositeVideoClip):
+        for c in video_clip.clips:
+            c.close()
+        if video_clip.bg is not None:
+            video_clip.bg.close()
+    video_clip.close()
 
-    # Ensure build folder exists
-    os.makedirs(conf.build_folder, exist_ok=True)
 
-    # Define some useful variables
-    max_videos_amount = min(conf.max_videos_amount, len(videos))
-    videos = videos[:max_videos_amount]
+def _final_name(conf):
+    """
+    Name of the final video, after the word to extract, or the names of the words to extract
+    """
+    return f"{conf.channel_name}_{conf.word_to_extract or '_'.join(conf.words_to_extract)}"
 
-    threshold = conf.max_open_files
-    total_clips_count = sum(1 for _ in clips.list_for(videos, conf.filter_videos_ids, conf.filter_out_videos_ids))
 
-    conf.logger_prefix = "> "
+def _remove_temporary_files(files_paths):
+    for file_path in files_paths:
+        try:
+            logger.info(f"Remove temporary clip '{os.path.basename(file_path)}'")
+            os.remove(file_path)
+        except OSError as e:
+            logger.error(f"Unable to remove clip: {e}")
 
-    if total_clips_count == 0:
-        logger.info("No clips to build")
-        return None
 
-    logger.debug(f"{total_clips_count} clips to build")
+"""
+Stream build
+
+Clips are opened one at a time, their frames and audio samples being written
+straight to a single video encoder and a single audio encoder, and closed before
+the next one is opened, so that the memory and files used do not depend on the
+amount of clips. Both streams are put together once every clip is written.
+"""
+
+
+def _stream_clip(conf, video_clip, video_writer, audio_writer):
+    """
+    Write the frames and samples of the clip, returning the amount of frames written
+    """
+    width, height = map(int, conf.resolution.split("x"))
+    audio_rate = conf.clip_audio_rate
+
+    # Clips of another size are centered, as a composed concatenation would
+    frames_clip = video_clip
+    if tuple(video_clip.size) != (width, height):
+        frames_clip = video_clip.on_color(size=(width, height), color=(0, 0, 0), pos="center")
+
+    frames_count = 0
+    for frame in frames_clip.iter_frames(fps=conf.clip_fps, dtype="uint8"):
+        video_writer.write_frame(frame)
+        frames_count += 1
+
+    # The audio of every clip lasts exactly as long as its frames, so that both streams stay in sync
+    samples_count = round(frames_count / conf.clip_fps * audio_rate)
+    if video_clip.audio is None:
+        samples = np.zeros((samples_count, 2), dtype="int16")
+    else:
+        tt = np.minimum(np.arange(samples_count) / audio_rate, video_clip.audio.duration - 1 / audio_rate)
+        samples = video_clip.audio.to_soundarray(tt=tt, fps=audio_rate, quantize=True, nbytes=2)
+        if samples.ndim == 1:
+            samples = np.column_stack([samples, samples])
+    audio_writer.write_frames(samples)
+
+    return frames_count
+
+
+def _open_clip(conf, clip_infos, total_words_count):
+    video, clip, pos, counter = clip_infos
+    video_id = video["id"]["videoId"]
+    clips_count_log = str(len(video.get("data", {}).get("clips", [])))
+    pos_log = str(pos).rjust(len(clips_count_log))
+    total_log = "" if total_words_count is None else f"/{total_words_count}"
+    counter_log = str(counter).rjust(len(total_log) - 1)
+    logger.info(f"Build clip {pos_log}/{clips_count_log} of {video_id}", prefix=f"[{counter_log}{total_log}] >> ")
+
+    # Totals would change with every new clip of an incremental build, so they are not displayed
+    overlay_total = None if conf.do_incremental_build else total_words_count
+
+    video_clip = VideoFileClip(clip)
+    if conf.do_text_overlay:
+        video_clip = editor.add_info_overlay(video_clip, conf.resolution, video, pos, counter, overlay_total)
+    return video_clip
+
 
-    video_clips_queue = deque(
-        saved_data.read(
-            conf,
-            os.path.join("build", "video_clips_queue"),
-            lambda: [
-                clip_info for clip_info in clips.list_for(videos, conf.filter_videos_ids, conf.filter_out_videos_ids)
-            ],
+def _rendition_path(file_path, resolution):
+    return f"{file_path[:-4]}_{resolution}.mp4"
+
+
+class _StreamWriter:
+    """
+    Video and audio encoders the clips are streamed to, the frames being
+    composed once at the main resolution then scaled for every other rendition
+    """
+
+    def __init__(self, conf, stream_file_path, resolutions=None, audio_writer=None):
+        self.conf = conf
+        width, height = map(int, conf.resolution.split("x"))
+        profile = conf.encoding_profiles[conf.final_encoding_profile]
+        stream_file_base_path, _ = os.path.splitext(stream_file_path)
+        video_file_path = f"{stream_file_base_path}_video.mp4"
+
+        self.stream_file_path = stream_file_path
+        self.audio_file_path = encoding.temp_audiofile(f"{stream_file_base_path}_audio.mp4", profile)
+        if audio_writer is not None:
+            self.audio_file_path = audio_writer.file_path
+        self.renditions = [(video_file_path, stream_file_path, width, height)]
+        for resolution in resolutions or []:
+            rendition_width, rendition_height = map(int, resolution.split("x"))
+            self.renditions.append(
+                (
+                    _rendition_path(video_file_path, resolution),
+                    _rendition_path(stream_file_path, resolution),
+                    rendition_width,
+                    rendition_height,
+                )
+            )
+
+        self.video_writer = ffmpeg.RenditionsWriter(
+            [(video_path, w, h) for video_path, _, w, h in self.renditions],
+            (width, height),
+            conf.clip_fps,
+            profile=profile,
+            threads=conf.max_video_write_thread_workers,
         )
+        self.audio_writer = audio_writer or FFMPEG_AudioWriter(
+            self.audio_file_path,
+            conf.clip_audio_rate,
+            codec=profile.get("audio_codec", "aac"),
+            bitrate=profile.get("audio_bitrate", "192k"),
+        )
+        self.encode_start = time.time()
+        self.frames_count = 0
+        self.closed = False
+
+    def write(self, video_clip):
+        try:
+            self.frames_count += _stream_clip(self.conf, video_clip, self.video_writer, self.audio_writer)
+        finally:
+            _close_clip(video_clip)
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        try:
+            self.video_writer.close()
+        finally:
+            self.audio_writer.close()
+
+    def mux(self, ts_offset=None, audio_offset=None):
+        """
+        Put together the video and audio streams of every rendition
+        """
+        self.close()
+        try:
+            streams_paths = [stream_path for _, stream_path, _, _ in self.renditions]
+            with encoding.measure(self.conf.final_encoding_profile, streams_paths, start=self.encode_start):
+                for video_path, stream_path, _, _ in self.renditions:
+                    ffmpeg.mux(video_path, self.audio_file_path, stream_path, ts_offset, audio_offset)
+        finally:
+            _remove_temporary_files([video_path for video_path, _, _, _ in self.renditions] + [self.audio_file_path])
+
+
+def _build_by_stream(conf, clips_infos, total_words_count):
+    # Renditions can not be appended to the final video of an incremental build
+    resolutions = [] if conf.do_incremental_build else conf.output_renditions
+    writer = _StreamWriter(conf, os.path.join(conf.build_folder, "stream.mp4"), resolutions)
+
+    try:
+        for clip_infos in clips_infos:
+            writer.write(_open_clip(conf, clip_infos, total_words_count))
+    finally:
+        writer.close()
+
+    logger.info("Put together video and audio streams")
+    writer.mux()
+
+    return writer.stream_file_path
+
+
+def _build_incremental(conf, clips_infos, total_words_count, final_clip_file_path):
+    """
+    Append the clips that are not in the final video yet to its end,
+    only rebuilding it all when the clips it contains changed
+    """
+    built_data_path = os.path.join("build", "incremental")
+    clips_files = [clip for _, clip, _, _ in clips_infos]
+
+    profile = conf.encoding_profiles[conf.final_encoding_profile]
+
+    built_clips_files = []
+    if os.path.exists(final_clip_file_path):
+        built_data = saved_data.read(conf, built_data_path, lambda: {"clips": []}, write=False)
+        built_clips_files = built_data["clips"]
+        # New clips can only be stream copied after the built ones if they are encoded the same way
+        if built_data.get("encoding", None) != profile:
+            logger.info("Encoding profile changed, rebuild the whole video")
+            built_clips_files = []
+
+    # New clips can only be appended if they come after every clip already built
+    if clips_files[: len(built_clips_files)] != built_clips_files:
+        logger.info("Built clips changed, rebuild the whole video")
+        built_clips_files = []
+
+    new_clips_infos = clips_infos[len(built_clips_files) :]
+    if len(new_clips_infos) == 0:
+        logger.info("Final video is up to date")
+        return final_clip_file_path
+
+    logger.info(f"Append {len(new_clips_infos)} clips to the {len(built_clips_files)} already built")
+    stream_file_path = _build_by_stream(conf, new_clips_infos, total_words_count)
+
+    if len(built_clips_files) == 0:
+        os.replace(stream_file_path, final_clip_file_path)
+    else:
+        # Every part is written with the same settings, so they can be stream copied after each other
+        temp_clip_file_path = final_clip_file_path.replace(".mp4", ".tmp.mp4")
+        try:
+            ffmpeg.concat([final_clip_file_path, stream_file_path], temp_clip_file_path)
+            os.replace(temp_clip_file_path, final_clip_file_path)
+        finally:
+            _remove_temporary_files([stream_file_path])
+
+    saved_data.write(conf, built_data_path, lambda: {"clips": clips_files, "encoding": profile})
+    return final_clip_file_path
+
+
+"""
+HLS build
+
+The final video is written as segments of about hls_segment_duration seconds,
+cut between clips, and listed by a playlist updated as soon as a segment is
+written, so that the video can be played while it is still being built. The
+clips of every written segment are appended to a journal, so that an
+interrupted build resumes after the last segment still there as it was written.
+
+Players decode the audio of the segments as a single stream, so it is encoded
+the way a single encoder would: every encoder starting its stream with a frame
+of priming, the samples of a segment are encoded after the last frame of the
+previous segment, and both first frames are dropped. The audio of a segment is
+made of whole AAC frames, the samples left being moved to the next segment.
+"""
+
+
+class _SamplesWriter:
+    """
+    Keep the audio samples written to it, to be encoded to its file later on
+    """
+
+    def __init__(self, file_path):
+        self.file_path = file_path
+        self.samples = []
+
+    def write_frames(self, samples):
+        self.samples.append(samples)
+
+    def close(self):
+        pass
+
+
+class _HlsAudio:
+    """
+    Encoder of the audio of the HLS segments, one after the other
+    """
+
+    def __init__(self, conf, encoded_samples_count, written_samples_count):
+        self.conf = conf
+        self.encoded_samples_count = encoded_samples_count
+        # Samples of the last encoded frame, and the ones written but not encoded yet
+        # (those of a resumed build are not available anymore, so are replaced by silence)
+        self.previous_frame = np.zeros((ffmpeg.aac_frame_samples, 2), dtype="int16")
+        self.pending_samples = np.zeros((max(0, written_samples_count - encoded_samples_count), 2), dtype="int16")
+
+    def encode(self, samples_writer, is_last):
+        """
+        Encode the samples of a segment, returning the amount of samples
+        encoded and the time (in seconds) they start at
+        """
+        frame_samples = ffmpeg.aac_frame_samples
+        samples = np.concatenate([self.pending_samples, *samples_writer.samples])
+        # The encoder pads the last frame of the last segment
+        frames_count = math.ceil(len(samples) / frame_samples) if is_last else len(samples) // frame_samples
+        encoded_samples = samples[: frames_count * frame_samples]
+        self.pending_samples = samples[len(encoded_samples) :]
+
+        profile = self.conf.encoding_profiles[self.conf.final_encoding_profile]
+        audio_writer = FFMPEG_AudioWriter(
+            samples_writer.file_path,
+            self.conf.clip_audio_rate,
+            codec="aac",
+            bitrate=profile.get("audio_bitrate", "192k"),
+        )
+        try:
+            audio_writer.write_frames(np.concatenate([self.previous_frame, encoded_samples]))
+        finally:
+            audio_writer.close()
+        # Drop the priming frame and the one of the previous segment
+        ffmpeg.keep_adts_frames(samples_writer.file_path, 2, frames_count)
+
+        start = self.encoded_samples_count / self.conf.clip_audio_rate
+        self.encoded_samples_count += frames_count * frame_samples
+        self.previous_frame = np.concatenate([self.previous_frame, encoded_samples])[-frame_samples:]
+        return frames_count * frame_samples, start
+
+
+def _write_hls_playlist(playlist_path, segments, target_duration, is_ended):
+    lines = [
+        "#EXTM3U",
+        "#EXT-X-VERSION:3",
+        f"#EXT-X-TARGETDURATION:{target_duration}",
+        "#EXT-X-MEDIA-SEQUENCE:0",
+        "#EXT-X-PLAYLIST-TYPE:EVENT",
+    ]
+    for segment in segments:
+        lines += [f"#EXTINF:{segment['duration']:.3f},", segment["file"]]
+    if is_ended:
+        lines.append("#EXT-X-ENDLIST")
+
+    # Players may read the playlist at any time, so it is replaced at once
+    temp_playlist_path = f"{playlist_path}.tmp"
+    with open(temp_playlist_path, "w", encoding="utf8") as f:
+        f.write("\n".join(lines) + "\n")
+    os.replace(temp_playlist_path, playlist_path)
+
+
+def _build_hls(conf, clips_infos, total_words_count):
+    hls_folder = os.path.join(conf.build_folder, "hls")
+    playlist_path = os.path.join(hls_folder, f"{_final_name(conf)}.m3u8")
+    segments_journal = journal.Journal(os.path.join(hls_folder, "segments.journal"), conf.build_journal_sync_interval)
+    with segments_journal:
+        playlist_path = _write_hls_segments(conf, clips_infos, total_words_count, segments_journal, playlist_path)
+    # The playlist is ended, the next build starts over
+    segments_journal.remove()
+    return playlist_path
+
+
+def _written_segments(hls_folder, segments):
+    """
+    Segments the journal records as written, up to the first one which is not there as it was written
+    """
+    written_segments = []
+    for segment in segments:
+        segment_path = os.path.join(hls_folder, segment["file"])
+        if not os.path.exists(segment_path) or os.path.getsize(segment_path) != segment.get("size", None):
+            logger.info(f"Segment '{segment['file']}' is missing or incomplete, write it again")
+            break
+        written_segments.append(segment)
+    return written_segments
+
+
+def _write_hls_segments(conf, clips_infos, total_words_count, segments_journal, playlist_path):
+    hls_folder = os.path.dirname(playlist_path)
+
+    # The target duration of the playlist can not change once it is played, so segments,
+    # which are cut between clips, are cut before the clip that would make them longer
+    target_duration = math.ceil(conf.hls_segment_duration + conf.max_length)
+    target_frames_count = target_duration * conf.clip_fps
+
+    # Written segments are only kept if they were encoded the same way
+    # (the journal starting with the encoding parameters, followed by one record per segment)
+    encoding_params = {
+        "encoding": conf.encoding_profiles[conf.final_encoding_profile],
+        "resolution": conf.resolution,
+        "audio_rate": conf.clip_audio_rate,
+        "target_duration": target_duration,
+    }
+    records = segments_journal.records
+    segments = []
+    if len(records) > 0 and records[0] == {"params": encoding_params}:
+        segments = _written_segments(hls_folder, [record["segment"] for record in records[1:]])
+
+    # and if they hold the first clips to build
+    built_clips_files = [clip for segment in segments for clip in segment["clips"]]
+    clips_infos = iter(clips_infos)
+    built_clips_infos = list(islice(clips_infos, len(built_clips_files)))
+    if [clip for _, clip, _, _ in built_clips_infos] != built_clips_files:
+        logger.info("Built clips changed, rebuild every segment")
+        segments = []
+        clips_infos = chain(built_clips_infos, clips_infos)
+    elif len(segments) > 0:
+        logger.info(f"Resume after {len(segments)} written segments")
+
+    # The journal only lists the segments which are kept, the next ones being appended after them
+    kept_records = [{"params": encoding_params}, *({"segment": segment} for segment in segments)]
+    if segments_journal.records != kept_records:
+        segments_journal.reset()
+        for record in kept_records:
+            segments_journal.append(record)
+
+    segment_frames_count = round(conf.hls_segment_duration * conf.clip_fps)
+    writer = None
+    segment_clips_files = []
+    hls_audio = _HlsAudio(
+        conf,
+        sum(segment["audio_samples"] for segment in segments),
+        round(sum(segment["duration"] for segment in segments) * conf.clip_audio_rate),
     )
-    temp_clips_queue = deque(saved_data.read(conf, os.path.join("build", "temp_clips_queue"), lambda: []))
-    temp_clips_files_counter = saved_data.read(conf, os.path.join("build", "temp_clips_files_counter"), lambda: 1)
-
-    # While there are clips to concatenate
-    while len(video_clips_queue) > 0 or len(temp_clips_queue) > 2:
-        video_clips = []
-        is_line_ended = False
-        do_concatenate_videos_clips = len(video_clips_queue) > 0
-
-        if do_concatenate_videos_clips:
-            # Create the group of videos to be concatenated
-            clips_group = []
-            while len(video_clips_queue) > 0 and len(clips_group) < threshold:
-                clips_group.append(video_clips_queue.popleft())
-
-            for i, (video, clip, pos, counter) in enumerate(clips_group):
-                # Build video clip
-                video_id = video["id"]["videoId"]
-                clips_count_log = str(len(video.get("data", {}).get("clips", [])))
-                pos_log = str(pos).rjust(len(clips_count_log))
-                counter_log = str(counter).rjust(len(str(total_clips_count)))
-                i_log = str(i + 1).rjust(len(str(threshold)))
-                logger.info(
-                    f"Build clip {pos_log}/{clips_count_log} of {video_id}",
-                    prefix=f"[{counter_log}/{total_clips_count}|{i_log}/{threshold}] >> ",
-                )
-                video_clip = VideoFileClip(clip)
-                if conf.do_text_overlay:
-                    video_clip = editor.add_info_overlay(
-                        video_clip, conf.resolution, video, pos, counter, total_clips_count
-                    )
 
-                # Add video clip to list
-                video_clips.append(video_clip)
+    def write_segment(is_last):
+        logger.info(f"Write segment '{os.path.basename(writer.stream_file_path)}'")
+        writer.close()
+        audio_samples_count, audio_start = hls_audio.encode(writer.audio_writer, is_last)
+        # Timestamps of every segment follow the ones of the previous segments
+        video_start = sum(segment["duration"] for segment in segments)
+        writer.mux(ts_offset=video_start, audio_offset=audio_start - video_start)
+        segment = {
+            "file": os.path.basename(writer.stream_file_path),
+            "clips": segment_clips_files,
+            "duration": writer.frames_count / conf.clip_fps,
+            "audio_samples": audio_samples_count,
+            "size": os.path.getsize(writer.stream_file_path),
+        }
+        segments_journal.append({"segment": segment})
+        segments.append(segment)
+        _write_hls_playlist(playlist_path, segments, target_duration, is_ended=False)
 
-            # Check if we have a line of ordered temporary clips
-            is_line_ended = len(video_clips_queue) == 0
-        else:
-            # Create the group of temporary clips videos to be concatenated
-            clips_group = []
-            while len(temp_clips_queue) > 0 and len(clips_group) < threshold:
-                temp_clip = temp_clips_queue.popleft()
-                # Prevent clips de-ordering
-                if temp_clip is None:
-                    if len(clips_group) == 1:
-                        # Nothing to change or build really, just push pack the video file
-                        temp_clips_queue.append(clips_group[0])
-                        temp_clips_queue.append(None)
-                        clips_group = []
-                    else:
-                        # We need to build the last temporary clip then insert a None
-                        # to mark the end of the ordered temporary clips
-                        is_line_ended = True
-                    break
-
-                clips_group.append(temp_clip)
-
-            # Add video clips to list
-            total_log = str(len(clips_group))
-            for i, clip in enumerate(clips_group):
-                pos_log = str(i + 1).rjust(len(total_log))
-                logger.info(f"Load temporary clip '{os.path.basename(clip)}'", prefix=f"[{pos_log}/{total_log}] >> ")
-                video_clips.append(VideoFileClip(clip))
-
-        if len(video_clips) > 0:
-            logger.info("Concatenate clips into a temporary clip")
-            temp_clip = concatenate_videoclips(video_clips, method="compose")
-
-            temp_clip_video_file_subpath = f"t{threshold}_c{temp_clips_files_counter}.mp4"
-            temp_clip_video_file_path = os.path.join(conf.build_folder, temp_clip_video_file_subpath)
-            temp_clip_audio_file_path = temp_clip_video_file_path.replace(".mp4", ".mp3")
-            if os.path.exists(temp_clip_video_file_path) and not os.path.exists(temp_clip_audio_file_path):
-                logger.info(f"Use existing temporary clip '{temp_clip_video_file_subpath}'")
+    for clip_infos in clips_infos:
+        video_clip = _open_clip(conf, clip_infos, total_words_count)
+        try:
+            clip_frames_count = round(video_clip.duration * conf.clip_fps)
+            if clip_frames_count > target_frames_count:
+                logger.error(f"Clip '{clip_infos[1]}' is longer than the target duration of the playlist")
+            if writer is not None and writer.frames_count + clip_frames_count > target_frames_count:
+                write_segment(is_last=False)
+                writer = None
+
+            if writer is None:
+                segment_path = os.path.join(hls_folder, f"segment_{len(segments):05d}.ts")
+                audio_writer = _SamplesWriter(segment_path.replace(".ts", ".aac"))
+                writer = _StreamWriter(conf, segment_path, audio_writer=audio_writer)
+                segment_clips_files = []
+        except BaseException:
+            _close_clip(video_clip)
+            raise
+
+        try:
+            writer.write(video_clip)
+        except BaseException:
+            writer.close()
+            raise
+        segment_clips_files.append(clip_infos[1])
+
+        if writer.frames_count >= segment_frames_count:
+            write_segment(is_last=False)
+            writer = None
+
+    if writer is not None:
+        write_segment(is_last=True)
+
+    _write_hls_playlist(playlist_path, segments, target_duration, is_ended=True)
+    return playlist_path
+
+
+"""
+Merges build
+
+The clips are concatenated by groups into temporary clips, which are then
+concatenated by groups into other temporary clips, until only one is left:
+
+    level 2             t
+                ________|________
+    level 1     t       t       t
+              __|__   __|__   __|__
+    clips     c c c   c c c   c c c
+
+Nodes of a same level do not depend on each other, so they are rendered
+concurrently. Every node is named after its inputs, and appended to a journal
+once rendered, so that the nodes rendered before an interruption are found back
+and reused.
+"""
+
+
+def _merges_tree(conf, videos, total_words_count):
+    """
+    List the levels of the tree, every node being a dict with the path of
+    its temporary clip and its inputs (clip infos or temporary clips paths)
+    """
+    threshold = conf.max_open_files
+    inputs = list(clips.list_for(videos, conf.filter_videos_ids, conf.filter_out_videos_ids))
+    levels = []
+
+    while len(levels) == 0 or len(inputs) > 1:
+        level = []
+        # The root is encoded for the final video, the other nodes only to be encoded again
+        profile_name = conf.final_encoding_profile if len(inputs) <= threshold else conf.intermediate_encoding_profile
+        for i in range(0, len(inputs), threshold):
+            group = inputs[i : i + threshold]
+            if len(levels) == 0:
+                # Nodes drawing the overlay are only reused if it shows the same text
+                overlays = [None] * len(group)
+                if conf.do_text_overlay:
+                    overlays = [
+                        _overlay_params(conf, video, pos, counter, total_words_count)
+                        for video, _, pos, counter in group
+                    ]
+                params = {
+                    "clips": [(clip, pos, counter) for _, clip, pos, counter in group],
+                    "overlays": overlays,
+                    "resolution": conf.resolution,
+                }
             else:
-                logger.info(f"Save temporary clip '{temp_clip_video_file_subpath}'")
-                temp_clip.write_videofile(
-                    temp_clip_video_file_path,
-                    temp_audiofile=temp_clip_audio_file_path,
-                    bitrate="20000k",
-                    audio_bitrate="2000k",
-                    threads=conf.max_video_write_thread_workers,
+                params = {"clips": group}
+            params["encoding"] = conf.encoding_profiles[profile_name]
+            node_file_subpath = f"t{threshold}_l{len(levels) + 1}_{clips_cache.key(params)}.mp4"
+            node_path = os.path.join(conf.build_folder, node_file_subpath)
+            level.append({"path": node_path, "inputs": group, "profile": profile_name})
+
+        levels.append(level)
+        inputs = [node["path"] for node in level]
+
+    return levels
+
+
+def _rendered_nodes(nodes_journal, build_folder):
+    """
+    Paths of the nodes the journal records as rendered, which are still there as they were written
+    """
+    rendered = set()
+    for record in nodes_journal.records:
+        node_path = os.path.join(build_folder, record["node"])
+        if os.path.exists(node_path) and os.path.getsize(node_path) == record["size"]:
+            rendered.add(node_path)
+    return rendered
+
+
+def _pending_nodes(levels, rendered):
+    """
+    Paths of the nodes left to render, the inputs of the already rendered nodes not being needed anymore
+    """
+    pending = set()
+    needed = {levels[-1][0]["path"]}
+    for level in reversed(levels):
+        for node in level:
+            if node["path"] in needed and node["path"] not in rendered:
+                pending.add(node["path"])
+                needed.update(node_input for node_input in node["inputs"] if isinstance(node_input, str))
+    return pending
+
+
+def _render_node(conf, node, level, total_words_count):
+    video_clips = []
+    total_log = str(len(node["inputs"]))
+    for i, node_input in enumerate(node["inputs"]):
+        i_log = str(i + 1).rjust(len(total_log))
+
+        if level == 1:
+            # Build video clip
+            video, clip, pos, counter = node_input
+            video_id = video["id"]["videoId"]
+            clips_count_log = str(len(video.get("data", {}).get("clips", [])))
+            pos_log = str(pos).rjust(len(clips_count_log))
+            counter_log = str(counter).rjust(len(str(total_words_count)))
+            logger.info(
+                f"Build clip {pos_log}/{clips_count_log} of {video_id}",
+                prefix=f"[{counter_log}/{total_words_count}|{i_log}/{total_log}] >> ",
+            )
+            video_clip = VideoFileClip(clip)
+            if conf.do_text_overlay:
+                video_clip = editor.add_info_overlay(
+                    video_clip, conf.resolution, video, pos, counter, total_words_count
                 )
+        else:
+            logger.info(f"Load temporary clip '{os.path.basename(node_input)}'", prefix=f"[{i_log}/{total_log}] >> ")
+            video_clip = VideoFileClip(node_input)
+
+        video_clips.append(video_clip)
+
+    # Normalized clips all share the same size, no need to compose them
+    temp_clip = concatenate_videoclips(video_clips, method="chain" if conf.do_normalize_clips else "compose")
 
-            temp_clips_files_counter += 1
+    # Write to a temporary file first, so that an interrupted write is not mistaken for a complete clip
+    logger.info(f"Save temporary clip '{os.path.basename(node['path'])}'")
+    profile = conf.encoding_profiles[node["profile"]]
+    temp_clip_video_file_path = node["path"].replace(".mp4", ".tmp.mp4")
+    with encoding.measure(node["profile"], [temp_clip_video_file_path]):
+        temp_clip.write_videofile(
+            temp_clip_video_file_path,
+            temp_audiofile=encoding.temp_audiofile(node["path"], profile),
+            threads=conf.max_video_write_thread_workers,
+            **encoding.moviepy_params(profile),
+        )
+    os.replace(temp_clip_video_file_path, node["path"])
+
+    # Close videos clips file descriptors
+    for video_clip in video_clips:
+        _close_clip(video_clip)
+
+    return encoding.pop_stats()
 
-            # Add temporary clip to list
-            temp_clips_queue.append(temp_clip_video_file_path)
 
-            # Ensure we are marking the build loop to prevent de-ordering
-            if is_line_ended:
-                temp_clips_queue.append(None)
+def _build_by_merges(conf, videos, total_words_count):
+    levels = _merges_tree(conf, videos, total_words_count)
+    nodes_journal = journal.Journal(os.path.join(conf.build_folder, "merges.journal"), conf.build_journal_sync_interval)
+    pending = _pending_nodes(levels, _rendered_nodes(nodes_journal, conf.build_folder))
 
-            # Close videos clips file descriptors
-            for video_clip in video_clips:
-                # MoviePy does not automatically close the CompositeVideoClip clips,
-                # causing issues with a "too many file descriptors" error
-                if isinstance(video_clip, CompositeVideoClip):
-                    for c in video_clip.clips:
-                        c.close()
-                    if video_clip.bg is not None:
-                        video_clip.bg.close()
-                video_clip.close()
+    # Processes are spawned rather than forked, as MoviePy readers run their own subprocesses
+    with nodes_journal, ProcessPoolExecutor(
+        max_workers=conf.max_build_process_workers,
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=logger.setup,
+        initargs=(logger.is_verbose(),),
+    ) as pool:
+        for level, nodes in enumerate(levels, start=1):
+            level_pending = [node for node in nodes if node["path"] in pending]
+            logger.info(f"Render {len(level_pending)}/{len(nodes)} temporary clips of level {level}/{len(levels)}")
+
+            futures = [pool.submit(_render_node, conf, node, level, total_words_count) for node in level_pending]
+            for node, future in zip(level_pending, futures):
+                encoding.merge_stats(future.result())
+                nodes_journal.append({"node": os.path.basename(node["path"]), "size": os.path.getsize(node["path"])})
 
             # Cleanup temporary clips
             # (remove clips that got concatenated into another clip and are no longer needed)
-            if not do_concatenate_videos_clips and conf.do_cleanup_temporary_clips:
-                for video_clip in video_clips:
-                    try:
-                        logger.info(f"Remove temporary clip '{os.path.basename(video_clip.filename)}'")
-                        os.remove(video_clip.filename)
-                    except OSError as e:
-                        logger.error(f"Unable to remove clip: {e}")
-
-            # Save what happened in case something goes wrong to prevent having to start all over
-            saved_data.write(conf, os.path.join("build", "video_clips_queue"), lambda: list(video_clips_queue))
-            saved_data.write(conf, os.path.join("build", "temp_clips_queue"), lambda: list(temp_clips_queue))
-            saved_data.write(conf, os.path.join("build", "temp_clips_files_counter"), lambda: temp_clips_files_counter)
-
-    # Move final clip to desired result location
-    last_temp_clip_file_path = temp_clips_queue[0] or temp_clips_queue[1]
-    final_clip_file_path = os.path.join(conf.build_folder, f"{conf.channel_name}_{conf.word_to_extract}.mp4")
+            if level > 1 and conf.do_cleanup_temporary_clips:
+                _remove_temporary_files(
+                    node_input for node in nodes for node_input in node["inputs"] if os.path.exists(node_input)
+                )
+
+    # The last node is moved to the final video, none of the rendered ones is needed anymore
+    nodes_journal.remove()
+    return levels[-1][0]["path"]
+
+
+"""
+Concat build
+"""
+
+
+def _overlay_params(conf, video, pos, counter, total_words_count):
+    """
+    Everything the info overlay of a clip is drawn from
+    """
+    positions = clips.timestamps_positions(video, pos)
+    timestamps = video.get("data", {}).get("timestamps", [])
+    return {
+        "video_id": video["id"]["videoId"],
+        "title": video["snippet"]["title"],
+        "published_at": video["snippet"]["publishedAt"],
+        "timestamps": [list(timestamps[position - 1]) for position in positions],
+        "positions": positions,
+        "counter": counter,
+        "total": total_words_count,
+        "resolution": conf.resolution,
+    }
+
+
+def _write_overlay_clip(conf, clip, clip_file_path, video, pos, counter, total_words_count):
+    video_clip = VideoFileClip(clip)
+    overlay_clip = editor.add_info_overlay(video_clip, conf.resolution, video, pos, counter, total_words_count)
+
+    # Write to a temporary file first, so that an interrupted write is not mistaken for a complete clip
+    temp_clip_file_path = clip_file_path.replace(".mp4", ".tmp.mp4")
+    # The clips end up as is in the final video
+    profile = conf.encoding_profiles[conf.final_encoding_profile]
+    with encoding.measure(conf.final_encoding_profile, [temp_clip_file_path]):
+        overlay_clip.write_videofile(
+            temp_clip_file_path,
+            temp_audiofile=encoding.temp_audiofile(clip_file_path, profile),
+            threads=conf.max_video_write_thread_workers,
+            **encoding.moviepy_params(profile),
+        )
+    os.replace(temp_clip_file_path, clip_file_path)
+
+    _close_clip(overlay_clip)
+
+
+def _build_by_concat(conf, videos, total_words_count):
+    """
+    Encode every clip at most once, then stream copy them all into the final video
+    """
+    concat_folder = os.path.join(conf.build_folder, "concat")
+    os.makedirs(concat_folder, exist_ok=True)
+    temp_files_paths = []
+
+    # Render the overlays, each clip being written once and kept in case the build is interrupted
+    inputs = []
+    for video, clip, pos, counter in clips.list_for(videos, conf.filter_videos_ids, conf.filter_out_videos_ids):
+        if not conf.do_text_overlay:
+            inputs.append(clip)
+            continue
+
+        video_id = video["id"]["videoId"]
+        clips_count_log = str(len(video.get("data", {}).get("clips", [])))
+        pos_log = str(pos).rjust(len(clips_count_log))
+        counter_log = str(counter).rjust(len(str(total_words_count)))
+        prefix = f"[{counter_log}/{total_words_count}] >> "
+
+        # Named after everything it is made of, so that a clip written by another build is never reused
+        overlay_params = {
+            "clip": clip,
+            "overlay": _overlay_params(conf, video, pos, counter, total_words_count),
+            "encoding": conf.encoding_profiles[conf.final_encoding_profile],
+        }
+        overlay_clip_file_path = os.path.join(concat_folder, f"o_{clips_cache.key(overlay_params)}.mp4")
+        if os.path.exists(overlay_clip_file_path):
+            logger.info(f"Use existing clip {pos_log}/{clips_count_log} of {video_id}", prefix=prefix)
+        else:
+            logger.info(f"Build clip {pos_log}/{clips_count_log} of {video_id}", prefix=prefix)
+            _write_overlay_clip(conf, clip, overlay_clip_file_path, video, pos, counter, total_words_count)
+
+        inputs.append(overlay_clip_file_path)
+        temp_files_paths.append(overlay_clip_file_path)
+
+    # Stream copy needs every clip to share the same format, so the ones
+    # not matching the most common format are re-encoded to match it
+    manifests = {}
+    infos = [clips_cache.probe(file_path, manifests) for file_path in inputs]
+    signatures = [ffmpeg.signature(file_infos) for file_infos in infos]
+    reference_signature = Counter(signatures).most_common(1)[0][0]
+    reference_infos = infos[signatures.index(reference_signature)]
+
+    for i, file_signature in enumerate(signatures):
+        if file_signature == reference_signature:
+            continue
+        conform_params = {
+            "clip": inputs[i],
+            "signature": reference_signature,
+            "encoding": conf.encoding_profiles[conf.final_encoding_profile],
+        }
+        conformed_clip_file_path = os.path.join(concat_folder, f"n_{clips_cache.key(conform_params)}.mp4")
+        if not os.path.exists(conformed_clip_file_path):
+            logger.info(f"Re-encode clip '{os.path.basename(inputs[i])}' to match the other clips")
+            temp_clip_file_path = conformed_clip_file_path.replace(".mp4", ".tmp.mp4")
+            with encoding.measure(conf.final_encoding_profile, [temp_clip_file_path]):
+                ffmpeg.conform(
+                    inputs[i],
+                    temp_clip_file_path,
+                    reference_infos,
+                    profile=conf.encoding_profiles[conf.final_encoding_profile],
+                    threads=conf.max_video_write_thread_workers,
+                )
+            os.replace(temp_clip_file_path, conformed_clip_file_path)
+        inputs[i] = conformed_clip_file_path
+        temp_files_paths.append(conformed_clip_file_path)
+
+    logger.info(f"Concatenate {len(inputs)} clips")
+    concat_file_path = os.path.join(concat_folder, "concat.mp4")
+    ffmpeg.concat(inputs, concat_file_path)
+
+    if conf.do_cleanup_temporary_clips:
+        _remove_temporary_files(temp_files_paths)
+
+    return concat_file_path
+
+
+"""
+Overlapped build
+"""
+
+
+class OverlappedBuild:
+    """
+    Stream build running along the videos processing, fed with every video
+    as soon as it and all the videos before it are done, so that the final
+    video is ready shortly after the last video is processed
+    """
+
+    def __init__(self, conf, videos):
+        self.conf = copy(conf)
+        self.conf.logger_prefix = "> "
+        self.videos = videos[: min(conf.max_videos_amount, len(videos))]
+        self.done = set()
+        self.next_video = 0
+        self.videos_queue = queue.Queue()
+        self.lock = threading.Lock()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.video_file_path = None
+        self.error = None
+
+    def _clips_infos(self):
+        counter = 0
+        while True:
+            video = self.videos_queue.get()
+            if video is None:
+                return
+            # Counters continue from one video to the next
+            video_counter = 0
+            for _, clip, pos, video_counter in clips.list_for(
+                [video], self.conf.filter_videos_ids, self.conf.filter_out_videos_ids
+            ):
+                yield video, clip, pos, counter + video_counter
+            counter += video_counter
+
+    def _run(self):
+        try:
+            clips_infos = self._clips_infos()
+            first_clip_infos = next(clips_infos, None)
+            if first_clip_infos is None:
+                return
+            # The total is only known once every video is done
+            if self.conf.build_mode == "hls":
+                self.video_file_path = _build_hls(self.conf, chain([first_clip_infos], clips_infos), None)
+            else:
+                stream_file_path = _build_by_stream(self.conf, chain([first_clip_infos], clips_infos), None)
+                self.video_file_path = move_to_final(self.conf, stream_file_path)
+        except Exception as e:
+            logger.error(f"Overlapped build failed: {e}")
+            self.error = e
+
+    def start(self):
+        os.makedirs(self.conf.build_folder, exist_ok=True)
+        logger.info("Build final video along the videos processing")
+        self.thread.start()
+
+    def video_done(self, i):
+        with self.lock:
+            self.done.add(i)
+            while self.next_video in self.done and self.next_video < len(self.videos):
+                self.videos_queue.put(self.videos[self.next_video])
+                self.next_video += 1
+
+    def finish(self):
+        """
+        Wait for the build to end, returning the path of the built video or None if it failed
+        """
+        with self.lock:
+            # Videos that were not reported can not be waited for anymore
+            for video in self.videos[self.next_video :]:
+                self.videos_queue.put(video)
+            self.next_video = len(self.videos)
+            self.videos_queue.put(None)
+        self.thread.join()
+
+        if self.error is not None:
+            return None
+        if self.video_file_path is None:
+            logger.info("No clips to build")
+        return self.video_file_path
+
+
+"""
+Final video
+"""
+
+
+def _write_renditions(conf, video_file_path):
+    """
+    Write the other renditions of a built video out of it
+    """
+    profile_name = conf.final_encoding_profile
+    renditions = [
+        (_rendition_path(video_file_path, resolution), *map(int, resolution.split("x")))
+        for resolution in conf.output_renditions
+    ]
+    logger.info(f"Write {len(renditions)} other renditions of the final video")
+    with encoding.measure(profile_name, [rendition_path for rendition_path, _, _ in renditions]):
+        ffmpeg.renditions(
+            video_file_path,
+            renditions,
+            conf.clip_fps,
+            profile=conf.encoding_profiles[profile_name],
+            threads=conf.max_video_write_thread_workers,
+        )
+
+
+def move_to_final(conf, temp_clip_file_path):
+    """
+    Move the built video (and its other renditions) to the desired result location, without overriding a previous one
+    """
+    final_clip_file_path = os.path.join(conf.build_folder, f"{_final_name(conf)}.mp4")
 
     while os.path.exists(final_clip_file_path):
         final_clip_file_path = f"{final_clip_file_path[:-4]}_{str(uuid.uuid4())[:6]}.mp4"
 
     try:
-        os.rename(last_temp_clip_file_path, final_clip_file_path)
+        os.rename(temp_clip_file_path, final_clip_file_path)
+        for resolution in conf.output_renditions:
+            rendition_file_path = _rendition_path(temp_clip_file_path, resolution)
+            if os.path.exists(rendition_file_path):
+                os.rename(rendition_file_path, _rendition_path(final_clip_file_path, resolution))
     except OSError as e:
         logger.error(f"Unable to rename temporary clip: {e}")
         return None
 
     return final_clip_file_path
+
+
+def final_video(conf, videos):
+    if conf.build_mode not in ["stream", "merges", "concat", "hls"]:
+        raise ValueError(f"Unknown build mode '{conf.build_mode}'")
+
+    # Without an overlay to draw, normalized clips are stream copied as they are
+    # rather than having every one of their frames decoded and encoded again
+    build_mode = conf.build_mode
+    if build_mode in ["stream", "merges"] and not conf.do_text_overlay and conf.do_normalize_clips:
+        build_mode = "concat"
+
+    logger.info("Build final video")
+
+    # Ensure build folder exists
+    os.makedirs(conf.build_folder, exist_ok=True)
+
+    # Define some useful variables
+    max_videos_amount = min(conf.max_videos_amount, len(videos))
+    videos = videos[:max_videos_amount]
+
+    clips_infos = list(clips.list_for(videos, conf.filter_videos_ids, conf.filter_out_videos_ids))
+    total_clips_count = len(clips_infos)
+    # Clips can cover multiple timestamps, so counters are based on the amount of words
+    total_words_count = clips_infos[-1][3] if total_clips_count > 0 else 0
+
+    conf.logger_prefix = "> "
+
+    if total_clips_count == 0:
+        logger.info("No clips to build")
+        return None
+
+    logger.debug(f"{total_clips_count} clips to build ({total_words_count} words)")
+    if build_mode != conf.build_mode:
+        logger.info(f"No overlay to draw, build by concat instead of {conf.build_mode}")
+
+    final_clip_file_path = os.path.join(conf.build_folder, f"{_final_name(conf)}.mp4")
+
+    # Renditions can not be appended to, nor be listed by the playlist
+    if len(conf.output_renditions) > 0 and (conf.do_incremental_build or build_mode == "hls"):
+        logger.error("Other renditions are not written by incremental and hls builds")
+
+    if conf.do_incremental_build:
+        return _build_incremental(conf, clips_infos, total_words_count, final_clip_file_path)
+    if build_mode == "hls":
+        return _build_hls(conf, clips_infos, total_words_count)
+
+    if build_mode == "concat":
+        last_temp_clip_file_path = _build_by_concat(conf, videos, total_words_count)
+    elif build_mode == "merges":
+        last_temp_clip_file_path = _build_by_merges(conf, videos, total_words_count)
+    elif build_mode == "stream":
+        last_temp_clip_file_path = _build_by_stream(conf, clips_infos, total_words_count)
+
+    # The stream build writes the other renditions along the video, the other builds out of it
+    if build_mode != "stream" and len(conf.output_renditions) > 0:
+        _write_renditions(conf, last_temp_clip_file_path)
+
+    return move_to_final(conf, last_temp_clip_file_path)
@@ -1,8 +1,43 @@
+import ast
 import os
 
 from commands.config import AllConfig
 from utils.convert import str_to_bool
 
+# Default encoding profiles, which can be replaced or completed with the configuration
+_encoding_profiles = {
+    # Fast and near lossless, with keyframes at every frame, for files that are encoded again later
+    "intermediate": {
+        "codec": "libx264",
+        "crf": 10,
+        "preset": "ultrafast",
+        "pix_fmt": "yuv420p",
+        "keyframe_interval": 1,
+        "audio_codec": "aac",
+        "audio_bitrate": "320k",
+    },
+    # Slow but efficient, for the files that are kept
+    "final": {
+        "codec": "libx264",
+        "crf": 20,
+        "preset": "slow",
+        "pix_fmt": "yuv420p",
+        "keyframe_interval": 60,
+        "audio_codec": "aac",
+        "audio_bitrate": "192k",
+    },
+    # As fast as possible, at the expense of quality, for previews
+    "preview": {
+        "codec": "libx264",
+        "crf": 30,
+        "preset": "ultrafast",
+        "pix_fmt": "yuv420p",
+        "keyframe_interval": 20,
+        "audio_codec": "aac",
+        "audio_bitrate": "64k",
+    },
+}
+
 
 class CatchConfig(AllConfig):
     def __init__(self, **kwargs):
@@ -17,30 +52,92 @@ class CatchConfig(AllConfig):
         """
         # Final resolution of the video (smaller and bigger clips will be resized)
         self.resolution = kwargs.get("resolution", "1920x1080")
+        # Words to extract in a single run, by name (replaces the word to extract)
+        # example: {"hello": "hello", "numbers": "(one|two|three)$"}
+        self.words_to_extract = dict(ast.literal_eval(kwargs.get("words_to_extract", "{}")))
+        if len(self.words_to_extract) == 0:
+            self.words_to_extract = {self.word_to_extract: self.word_to_extract}
 
         """
         Youtube
         """
         # Your Youtube API key (https://developers.google.com/youtube/registering_an_application)
         self.api_key = kwargs.get("api_key", "")
+        # Maximum age of the saved information of a video, reused between downloads (in hours, 0 to disable)
+        # (the urls of the video streams it contains expire after a few hours)
+        self.video_info_max_age = float(kwargs.get("video_info_max_age", 5))
+        # Maximum frame rate of the downloaded video streams (higher ones are only used if nothing else exists)
+        self.video_format_max_fps = float(kwargs.get("video_format_max_fps", 30))
+        # Preferred codecs of the downloaded video streams, by order of preference
+        # example: ["avc1", "vp9"]
+        self.video_format_codecs = list(ast.literal_eval(kwargs.get("video_format_codecs", '["avc1"]')))
 
         """
         Folders
         """
         # The sub-folder used for downloading files
         self.download_folder = kwargs.get("download_folder", os.path.join(self.output_folder, "download"))
+        # The sub-folder used for the cut clips
+        self.clips_folder = kwargs.get("clips_folder", os.path.join(self.output_folder, "clips"))
         # The sub-folder used for the final video build
         self.build_folder = kwargs.get("build_folder", os.path.join(self.output_folder, "build"))
 
         """
         Clips settings
         """
+        # Padding around the clips of the downloaded parts of the video (in seconds)
+        self.partial_download_padding = float(kwargs.get("partial_download_padding", 2.0))
         # Maximum length of a clip (in seconds)
         self.max_length = float(kwargs.get("max_length", 1.5))
         # Shift of the start timestamp of a clip (in seconds)
         self.start_shift = float(kwargs.get("start_shift", -0.25))
         # Shift of the end timestamp of a clip (in seconds)
         self.end_shift = float(kwargs.get("end_shift", 0.75))
+        # Gap under which the windows of two timestamps are merged into a single clip (in seconds)
+        self.clip_merge_gap = float(kwargs.get("clip_merge_gap", 0.0))
+        # Frame rate of the clips (only used when normalizing clips)
+        self.clip_fps = float(kwargs.get("clip_fps", 30))
+        # Audio sample rate of the clips (only used when normalizing clips)
+        self.clip_audio_rate = int(kwargs.get("clip_audio_rate", 44100))
+        # Method used to cut the clips out of the source video
+        # - "reencode": decode and re-encode the whole clip with MoviePy
+        # - "smartcut": stream copy the complete GOPs and only re-encode the edges with ffmpeg
+        #   (re-encoding the whole clip when the edges can not match the profile and format of the source)
+        # - "batch": decode the source once with ffmpeg and write every clip from that single pass
+        self.clip_cut_mode = kwargs.get("clip_cut_mode", "reencode")
+
+        """
+        Build settings
+        """
+        # Method used to build the final video
+        # - "stream": open the clips one at a time and write their frames straight to a single encoder
+        # - "merges": concatenate the clips by groups with MoviePy, then the groups until only one is left
+        # - "concat": encode every clip once (with its overlay) and stream copy them all with ffmpeg
+        # - "hls": stream the clips into HLS segments listed by a playlist, playable while being built
+        # The stream, merges and hls builds decode every frame of the clips in Python, so without an overlay
+        # to draw and with normalized clips, the stream and merges builds are done by concat instead
+        self.build_mode = kwargs.get("build_mode", "merges")
+        # Other resolutions the final video is also written in, sharing the decoding and composition of the clips
+        # with the "stream" build mode, or decoding the final video once with the "merges" and "concat" ones
+        # (not used with the "hls" build mode, nor with incremental build)
+        # example: ["1280x720", "854x480"]
+        self.output_renditions = list(ast.literal_eval(kwargs.get("output_renditions", "[]")))
+        # Duration of the HLS segments, which are cut between clips so can be up to max_length longer (in seconds)
+        self.hls_segment_duration = float(kwargs.get("hls_segment_duration", 6.0))
+
+        """
+        Encoding
+        """
+        # Encoding profiles, by name, replacing or completing the default "intermediate", "final" and "preview" ones
+        # keys: codec, crf or bitrate, preset, pix_fmt, keyframe_interval (in frames), audio_codec, audio_bitrate
+        # example: {"small": {"codec": "libx264", "crf": 28, "preset": "fast", "audio_bitrate": "128k"}}
+        self.encoding_profiles = {**_encoding_profiles, **ast.literal_eval(kwargs.get("encoding_profiles", "{}"))}
+        # Name of the profile used to write the clips
+        self.clips_encoding_profile = kwargs.get("clips_encoding_profile", "intermediate")
+        # Name of the profile used to write the temporary clips of the build
+        self.intermediate_encoding_profile = kwargs.get("intermediate_encoding_profile", "intermediate")
+        # Name of the profile used to write the final video
+        self.final_encoding_profile = kwargs.get("final_encoding_profile", "final")
 
         """
         Switches
@@ -51,19 +148,51 @@ class CatchConfig(AllConfig):
         self.do_text_overlay = str_to_bool(kwargs.get("do_text_overlay", "True"))
         # Should the downloaded files be deleted?
         self.do_cleanup_downloads = str_to_bool(kwargs.get("do_cleanup_downloads", "True"))
+        # Should the smallest video stream at least as big as the resolution be downloaded?
+        # (else, the best video stream is downloaded)
+        self.do_select_video_format = str_to_bool(kwargs.get("do_select_video_format", "True"))
+        # Should only the parts of the videos around the timestamps be downloaded?
+        self.do_partial_download = str_to_bool(kwargs.get("do_partial_download", "False"))
+        # Should duplicated timestamps be dropped and overlapping ones merged into a single clip?
+        self.do_coalesce_timestamps = str_to_bool(kwargs.get("do_coalesce_timestamps", "True"))
+        # Should the clips be scaled to the resolution, frame rate and audio rate when cut?
+        # (this lets the build skip any per frame resizing)
+        self.do_normalize_clips = str_to_bool(kwargs.get("do_normalize_clips", "True"))
         # Should the temporary clips files be deleted?
         self.do_cleanup_temporary_clips = str_to_bool(kwargs.get("do_cleanup_temporary_clips", "True"))
+        # Should every word of the subtitles be saved, so that other words can be extracted without downloading them?
+        self.do_save_transcripts = str_to_bool(kwargs.get("do_save_transcripts", "True"))
+        # Should the subtitles be downloaded even if the transcript of the video was saved?
+        self.do_override_transcripts = str_to_bool(kwargs.get("do_override_transcripts", "False"))
         # Should the video datas be computed even if they already exists?
         self.do_override_video_data = str_to_bool(kwargs.get("do_override_video_data", "False"))
         # Should the clips be generated even if they already exists?
         self.do_override_clips = str_to_bool(kwargs.get("do_override_clips", "False"))
+        # Should the checksum of existing clips be verified before reusing them? (else, only their size is)
+        self.do_verify_clips_checksum = str_to_bool(kwargs.get("do_verify_clips_checksum", "False"))
         # Should the clips be generated?
         self.do_generate_clips = str_to_bool(kwargs.get("do_generate_clips", "True"))
         # Should the final video be generated?
         self.do_generate_final_video = str_to_bool(kwargs.get("do_generate_final_video", "True"))
+        # Should a final video also be generated for every word to extract, in a sub-folder of the build folder?
+        self.do_generate_words_videos = str_to_bool(kwargs.get("do_generate_words_videos", "False"))
+        # Should the new clips be appended to the existing final video instead of building a new one?
+        # (always uses the "stream" build mode, and relies on the outputted data to know what was built)
+        self.do_incremental_build = str_to_bool(kwargs.get("do_incremental_build", "False"))
+        # Should the final video be built while the videos are being processed?
+        # (only with the "stream" or "hls" build modes and without incremental build, the total counter being unknown)
+        self.do_overlap_build = str_to_bool(kwargs.get("do_overlap_build", "False"))
         # Should the videos list data be updated?
         self.do_update_video_data = str_to_bool(kwargs.get("do_update_video_data", "False"))
 
+        """
+        Downloads cache
+        """
+        # Should the downloaded files be kept in a cache of limited size? (replaces do_cleanup_downloads)
+        self.do_cache_downloads = str_to_bool(kwargs.get("do_cache_downloads", "False"))
+        # Maximum size of the downloads cache (in megabytes), the least recently used files being removed first
+        self.downloads_cache_max_size = int(kwargs.get("downloads_cache_max_size", 20000))
+
         """
         Filters
         """
@@ -73,11 +202,27 @@ class CatchConfig(AllConfig):
         """
         Thresholds
         """
-        # Maximum amount of threads to use when retrieving video data and cutting clips
+        # Maximum amount of threads to use when downloading subtitles and videos
+        # (above 1, videos go through a pipeline of download threads and processing processes)
         self.max_data_thread_workers = int(kwargs.get("max_data_thread_workers", 1))
+        # Maximum amount of processes to use when extracting timestamps and cutting clips
+        self.max_cpu_process_workers = int(kwargs.get("max_cpu_process_workers", os.cpu_count() or 1))
+        # Maximum amount of downloaded videos waiting to be cut
+        self.max_pending_downloads = max(1, int(kwargs.get("max_pending_downloads", 4)))
+        # Maximum amount of videos waiting for each stage of the pipeline
+        self.max_stage_queue_size = max(1, int(kwargs.get("max_stage_queue_size", 8)))
+        # Maximum amount of processes to use when rendering the temporary clips of the final video
+        # (every one of them opening up to max_open_files clips, each with its own ffmpeg readers)
+        self.max_build_process_workers = int(kwargs.get("max_build_process_workers", min(4, os.cpu_count() or 1)))
         # Maximum amount of threads to use when wrinting a video clip to disk
         self.max_video_write_thread_workers = int(kwargs.get("max_video_write_thread_workers", 1))
         # Maximum number of files to open at once
-        # This is useful when building the last clip as MoviePy creates a file
-        # directory for every clip we open, so we have to do them by batches
+        # This is useful when building the last clip with the "merges" build mode as MoviePy
+        # creates a file directory for every clip we open, so we have to do them by batches
         self.max_open_files = int(kwargs.get("max_open_files", 60))
+        # Maximum number of clips written at once from a single decode of the source
+        # (only used with the "batch" clip cut mode, as every clip holds its own encoder)
+        self.max_batch_clips_count = int(kwargs.get("max_batch_clips_count", 50))
+        # Amount of records appended to a build journal before syncing them to the disk
+        # (on a crash, the records not synced yet are lost and their step is done again)
+        self.build_journal_sync_interval = max(1, int(kwargs.get("build_journal_sync_interval", 10)))
@@ -1,27 +1,41 @@
 import os
+from io import StringIO
 
 from moviepy.video.io.VideoFileClip import VideoFileClip
 from regex import regex
 
-from utils import logger, youtube, subtitles
+from utils import logger, youtube, subtitles, ffmpeg, clips_cache, downloads_cache, encoding, transcripts
 from utils.convert import str_to_sec
 
+
+def _downloads_cache(conf):
+    if not conf.do_cache_downloads:
+        return None
+    return downloads_cache.get(conf.download_folder, conf.downloads_cache_max_size * 1024 * 1024)
+
+
 """
 Video data
 """
 
 
-def _extract_timestamps(video_id, content, word_to_extract):
-    logger.info(f"Extract timestamps where the word {word_to_extract} is pronounced", prefix=f"{video_id} >> ")
+def _extract_timestamps(video_id, video_tokens, words_to_extract):
+    """
+    Extract the timestamps where any of the words is pronounced, along with
+    the positions (starting at 1) of the timestamps of every word, by name
+    """
+    words_log = ", ".join(words_to_extract.values())
+    logger.info(f"Extract timestamps where the words {words_log} are pronounced", prefix=f"{video_id} >> ")
+
+    matches = transcripts.Matcher(words_to_extract).match(video_tokens)
+    # A token matching many words is only extracted once
+    matched_indexes = sorted({i for indexes in matches.values() for i in indexes})
+    res = [video_tokens[i] for i in matched_indexes]
+    positions = {index: position for position, index in enumerate(matched_indexes, start=1)}
+    targets = {name: [positions[i] for i in indexes] for name, indexes in matches.items()}
 
-    pattern = r"<(\d{2}:\d{2}:\d{2}.\d{3})>([^<]+)<(\d{2}:\d{2}:\d{2}.\d{3})>"
-    res = [
-        (start, word.lower().strip(), end)
-        for start, word, end in regex.findall(pattern, content, overlapped=True)
-        if regex.match(word_to_extract, word.lower().strip())
-    ]
     logger.debug(f"Extracted {len(res)} words")
-    return res
+    return res, targets
 
 
 def _extract_time(video_id, content):
@@ -36,13 +50,31 @@ def _extract_time(video_id, content):
     return res
 
 
-def video_data(conf, video_id):
-    logger.info("Extract video data", prefix=conf.logger_prefix)
-    # Download subtitles
-    with youtube.download(video_id, conf.download_folder, video=False, cleanup=conf.do_cleanup_downloads) as dl:
+def subtitles_content(conf, video_id):
+    """
+    Download the subtitles of a video, returning its data and the subtitles content
+    (or its data only, with its timestamps, when they could be found in its saved transcript)
+    """
+    # Every word of the video is in its transcript, no need to download the subtitles again
+    if conf.do_save_transcripts and not conf.do_override_transcripts:
+        transcript = transcripts.load(conf.transcripts_folder, video_id)
+        if transcript is not None:
+            logger.info("Load saved transcript", prefix=conf.logger_prefix)
+            video_tokens, time = transcript
+            timestamps, targets = _extract_timestamps(video_id, video_tokens, conf.words_to_extract)
+            return {"id": video_id, "timestamps": timestamps, "targets": targets, "time": time}, None
+
+    with youtube.download(
+        video_id,
+        conf.download_folder,
+        video=False,
+        cleanup=conf.do_cleanup_downloads,
+        cache=_downloads_cache(conf),
+        info_max_age=conf.video_info_max_age * 3600,
+    ) as dl:
         if dl is None:
             logger.error("Unable to download subtitles", prefix=conf.logger_prefix)
-            return None
+            return None, None
 
         data = {
             "id": video_id,
@@ -52,16 +84,40 @@ def video_data(conf, video_id):
 
         if not dl["subtitles_file"]["exists"]:
             logger.error("No subtitles found", prefix=conf.logger_prefix)
-            return data
+            return data, None
 
-        # Extract data
         with open(dl["subtitles_file"]["path"], "r") as f:
-            content = subtitles.clean_vtt(f)
-            return {
-                **data,
-                "timestamps": _extract_timestamps(video_id, content, conf.word_to_extract),
-                "time": _extract_time(video_id, content),
-            }
+            return data, f.read()
+
+
+def subtitles_data(conf, video_id, content):
+    """
+    Extract the data of a video from its subtitles content
+    (only CPU bound, so that it can be run in another process)
+    """
+    content = subtitles.clean_vtt(StringIO(content))
+    video_tokens = transcripts.tokens(content)
+    time = _extract_time(video_id, content)
+
+    # Keep every word, so that other words can be extracted without downloading the subtitles again
+    if conf.do_save_transcripts:
+        transcripts.save(conf.transcripts_folder, video_id, video_tokens, time)
+
+    timestamps, targets = _extract_timestamps(video_id, video_tokens, conf.words_to_extract)
+    return {
+        "timestamps": timestamps,
+        "targets": targets,
+        "time": time,
+    }
+
+
+def video_data(conf, video_id):
+    logger.info("Extract video data", prefix=conf.logger_prefix)
+    data, content = subtitles_content(conf, video_id)
+    if data is None or content is None:
+        return data
+
+    return {**data, **subtitles_data(conf, video_id, content)}
 
 
 """
@@ -69,63 +125,264 @@ Video clips
 """
 
 
-def video_clips(conf, video_id, video_data):
+def _clip_windows(conf, timestamps):
+    windows = []
+    for i, (start, word, end) in enumerate(timestamps):
+        # Get absolute start and end
+        video_start = str_to_sec(start) + conf.start_shift
+        video_end = str_to_sec(end) + conf.end_shift
+        # Prevent clip from being too long
+        if video_end - video_start > conf.max_length:
+            video_end = video_start + conf.max_length
+        windows.append((video_start, video_end, word, [i + 1]))
+    return windows
+
+
+def _coalesce_windows(conf, timestamps, windows):
+    """
+    Merge the windows of duplicated timestamps and the windows that overlap
+    or are close enough, keeping track of the timestamps positions they cover
+    """
+    coalesced = []
+    # Index of the coalesced window every timestamp is in
+    timestamps_windows = {}
+    for video_start, video_end, word, positions in sorted(windows):
+        timestamp = tuple(timestamps[positions[0] - 1])
+        if timestamp in timestamps_windows:
+            # The duplicate is cut once, but its position is still covered by the clip
+            i = timestamps_windows[timestamp]
+            window_start, window_end, window_word, window_positions = coalesced[i]
+            coalesced[i] = (window_start, window_end, window_word, sorted(set(window_positions + positions)))
+            continue
+
+        if len(coalesced) > 0 and video_start <= coalesced[-1][1] + conf.clip_merge_gap:
+            last_start, last_end, last_word, last_positions = coalesced[-1]
+            coalesced[-1] = (last_start, max(last_end, video_end), last_word, sorted(set(last_positions + positions)))
+        else:
+            coalesced.append((video_start, video_end, word, positions))
+        timestamps_windows[timestamp] = len(coalesced) - 1
+
+    logger.debug(f"Coalesced {len(windows)} timestamps into {len(coalesced)} clips")
+    return coalesced
+
+
+def clip_windows(conf, video_data):
+    """
+    List the (start, end, word, timestamps positions) windows of the clips to cut
+    """
+    timestamps = video_data.get("timestamps", [])
+    windows = _clip_windows(conf, timestamps)
+    if conf.do_coalesce_timestamps:
+        windows = _coalesce_windows(conf, timestamps, windows)
+    return windows
+
+
+def video_download(conf, video_id, windows):
+    return youtube.download(
+        video_id,
+        conf.download_folder,
+        subtitles=False,
+        cleanup=conf.do_cleanup_downloads,
+        windows=[(start, end) for start, end, _, _ in windows] if conf.do_partial_download else None,
+        padding=conf.partial_download_padding,
+        resolution=conf.resolution if conf.do_select_video_format else None,
+        max_fps=conf.video_format_max_fps,
+        codecs=conf.video_format_codecs,
+        cache=_downloads_cache(conf),
+        info_max_age=conf.video_info_max_age * 3600,
+    )
+
+
+def _normalization(conf):
+    if not conf.do_normalize_clips:
+        return None
+    return ffmpeg.normalization(conf.resolution, conf.clip_fps, conf.clip_audio_rate)
+
+
+def _clip_params(conf, video_id, video_start, video_end):
+    """
+    Every parameter used to cut a clip, which it is named after
+    """
+    return {
+        "video_id": video_id,
+        "start": round(video_start, 3),
+        "end": round(video_end, 3),
+        "start_shift": conf.start_shift,
+        "end_shift": conf.end_shift,
+        "max_length": conf.max_length,
+        # Clips cut from a video downloaded for another resolution are not the same
+        "source_resolution": conf.resolution if conf.do_select_video_format else None,
+        "normalize": _normalization(conf),
+        "cut_mode": conf.clip_cut_mode,
+        "encoding": conf.encoding_profiles[conf.clips_encoding_profile],
+    }
+
+
+def clips_paths(conf, video_id, windows):
+    """
+    Paths of the clips of the windows
+    """
+    clips_folder = os.path.join(conf.clips_folder, video_id)
+    return [
+        clips_cache.path(clips_folder, clips_cache.key(_clip_params(conf, video_id, video_start, video_end)))
+        for video_start, video_end, _, _ in windows
+    ]
+
+
+def cached_clips(conf, video_id, windows):
+    """
+    Paths of the clips of the windows if every one of them is in the cache, None otherwise
+    """
+    if conf.do_override_clips:
+        return None
+
+    clips_folder = os.path.join(conf.clips_folder, video_id)
+    manifest = clips_cache.load(clips_folder)
+    clips = clips_paths(conf, video_id, windows)
+    for clip_path in clips:
+        clip_key = os.path.splitext(os.path.basename(clip_path))[0]
+        if not clips_cache.is_valid(manifest, clips_folder, clip_key, conf.do_verify_clips_checksum):
+            return None
+    return clips
+
+
+def cut_clips(conf, video_id, video_file_path, windows):
+    """
+    Cut the clips of the windows out of the downloaded video file
+    (only working with local files, so that it can be run in another process)
+    """
+    if conf.clip_cut_mode not in ["reencode", "smartcut", "batch"]:
+        raise ValueError(f"Unknown clip cut mode '{conf.clip_cut_mode}'")
+
+    clips = []
+    profile = conf.encoding_profiles[conf.clips_encoding_profile]
+    normalize = _normalization(conf)
+
+    # Clips are named after the parameters used to cut them,
+    # so changing any of them does not reuse stale clips
+    clips_subfolder = os.path.join(os.path.basename(conf.clips_folder), video_id)
+    clips_folder = os.path.join(conf.clips_folder, video_id)
+    os.makedirs(clips_folder, exist_ok=True)
+    manifest = clips_cache.load(clips_folder)
+
+    video_clip = VideoFileClip(video_file_path) if conf.clip_cut_mode == "reencode" else None
+    batch_windows = []
+    try:
+        for i, (video_start, video_end, word, _) in enumerate(windows):
+            clip_pos = str(i + 1).rjust(len(str(len(windows))))
+            logger.info(f"Extract video clip ({clip_pos}/{len(windows)})", prefix=conf.logger_prefix)
+
+            # Create destination
+            clip_params = _clip_params(conf, video_id, video_start, video_end)
+            clip_key = clips_cache.key(clip_params)
+            subclip_video_file_subpath = os.path.join(clips_subfolder, f"{clip_key}.mp4")
+            subclip_video_file_path = clips_cache.path(clips_folder, clip_key)
+
+            # Save clip (overriding clips means not reusing any of them)
+            is_cached = not conf.do_override_clips and clips_cache.is_valid(
+                manifest, clips_folder, clip_key, conf.do_verify_clips_checksum
+            )
+            if is_cached:
+                logger.info(f"Use existing video clip '{subclip_video_file_subpath}' ({word})")
+            elif video_clip is not None:
+                logger.info(f"Save video clip '{subclip_video_file_subpath}' ({word})")
+                subclip = video_clip.subclip(video_start, video_end)
+                normalize_params = {}
+                ffmpeg_params = []
+                if normalize is not None:
+                    # Let ffmpeg scale the frames while encoding them
+                    normalize_params = {"fps": normalize["fps"], "audio_fps": normalize["audio_rate"]}
+                    ffmpeg_params = ["-vf", ffmpeg.video_filters(normalize)]
+                with encoding.measure(conf.clips_encoding_profile, [subclip_video_file_path]):
+                    subclip.write_videofile(
+                        subclip_video_file_path,
+                        temp_audiofile=encoding.temp_audiofile(subclip_video_file_path, profile),
+                        threads=conf.max_video_write_thread_workers,
+                        **encoding.moviepy_params(profile, ffmpeg_params),
+                        **normalize_params,
+                    )
+                clips_cache.add(manifest, clips_folder, clip_key, clip_params)
+            elif conf.clip_cut_mode == "batch":
+                logger.info(f"Queue video clip '{subclip_video_file_subpath}' ({word})")
+                # Identical clips are only written once
+                if clip_key not in [window[3] for window in batch_windows]:
+                    batch_windows.append((video_start, video_end, subclip_video_file_path, clip_key, clip_params))
+            elif conf.clip_cut_mode == "smartcut":
+                logger.info(f"Smart cut video clip '{subclip_video_file_subpath}' ({word})")
+                with encoding.measure(conf.clips_encoding_profile, [subclip_video_file_path]):
+                    ffmpeg.smart_cut(
+                        video_file_path,
+                        subclip_video_file_path,
+                        video_start,
+                        video_end,
+                        profile=profile,
+                        threads=conf.max_video_write_thread_workers,
+                        normalize=normalize,
+                    )
+                clips_cache.add(manifest, clips_folder, clip_key, clip_params)
+
+            clips.append(subclip_video_file_path)
+
+        # Cut queued clips by groups of windows sorted by time,
+        # each group decoding the source once from its first to its last window
+        batch_windows.sort(key=lambda window: window[:2])
+        for i in range(0, len(batch_windows), conf.max_batch_clips_count):
+            batch_group = batch_windows[i : i + conf.max_batch_clips_count]
+            logger.info(f"Save {len(batch_group)} queued video clips", prefix=conf.logger_prefix)
+            batch_paths = [path for _, _, path, _, _ in batch_group]
+            with encoding.measure(conf.clips_encoding_profile, batch_paths):
+                ffmpeg.cut_many(
+                    video_file_path,
+                    [(video_start, video_end, path) for video_start, video_end, path, _, _ in batch_group],
+                    profile=profile,
+                    threads=conf.max_video_write_thread_workers,
+                    normalize=normalize,
+                )
+            for _, _, _, clip_key, clip_params in batch_group:
+                clips_cache.add(manifest, clips_folder, clip_key, clip_params)
+    finally:
+        if video_clip is not None:
+            video_clip.close()
+        # Only completely written clips are in the manifest
+        clips_cache.save(clips_folder, manifest)
+
+    return clips
+
+
+def video_clips(conf, video_id, video_data, windows=None):
     logger.info("Extract video clips", prefix=conf.logger_prefix)
 
+    if windows is None:
+        windows = clip_windows(conf, video_data)
+
     # Check if there is something to extract
-    if len(video_data.get("timestamps", [])) == 0:
+    if len(windows) == 0:
         logger.info("No timestamps to extract", prefix=conf.logger_prefix)
         return []
 
-    # Download video
-    with youtube.download(video_id, conf.download_folder, subtitles=False, cleanup=conf.do_cleanup_downloads) as dl:
-        clips = []
+    # No need to download the video when every clip is already cut
+    clips = cached_clips(conf, video_id, windows)
+    if clips is not None:
+        logger.info("Use existing video clips", prefix=conf.logger_prefix)
+        video_data["clips_timestamps"] = [positions for _, _, _, positions in windows]
+        return clips
 
+    # Download video
+    with video_download(conf, video_id, windows) as dl:
         if dl is None:
             logger.error("Unable to download video", prefix=conf.logger_prefix)
             return None
 
+        # Keep track of the downloaded file and its format
+        video_data["video_file"] = dl["video_file"]
+
         if not dl["video_file"]["exists"]:
             logger.error("No video file found")
-            return clips
-
-        video_clip = VideoFileClip(dl["video_file"]["path"])
-        try:
-            timestamps = video_data.get("timestamps", [])
-            for i, (start, word, end) in enumerate(timestamps):
-                clip_pos = str(i + 1).rjust(len(str(len(timestamps))))
-                logger.info(f"Extract video clip ({clip_pos}/{len(timestamps)})", prefix=conf.logger_prefix)
-
-                # Get absolute start and end
-                video_start = str_to_sec(start) + conf.start_shift
-                video_end = str_to_sec(end) + conf.end_shift
-                # Prevent clip from being too long
-                if video_end - video_start > conf.max_length:
-                    video_end = video_start + conf.max_length
-                # Extract clip
-                subclip = video_clip.subclip(video_start, video_end)
+            return []
 
-                # Create destination
-                subclip_video_file_subpath = os.path.join("clips", video_id, f"{clip_pos}_{word}.mp4")
-                subclip_video_file_path = os.path.join(conf.output_folder, subclip_video_file_subpath)
-                subclip_audio_file_path = subclip_video_file_path.replace(".mp4", ".mp3")
-                os.makedirs(os.path.dirname(subclip_video_file_path), exist_ok=True)
-
-                # Save clip
-                if os.path.exists(subclip_video_file_path) and not os.path.exists(subclip_audio_file_path):
-                    logger.info(f"Use existing video clip '{subclip_video_file_subpath}'")
-                else:
-                    logger.info(f"Save video clip '{subclip_video_file_subpath}'")
-                    subclip.write_videofile(
-                        subclip_video_file_path,
-                        temp_audiofile=subclip_audio_file_path,
-                        bitrate="20000k",
-                        audio_bitrate="2000k",
-                        threads=conf.max_video_write_thread_workers,
-                    )
+        clips = cut_clips(conf, video_id, dl["video_file"]["path"], windows)
 
-                clips.append(subclip_video_file_path)
-        finally:
-            video_clip.close()
+    # Keep track of the timestamps covered by each clip
+    video_data["clips_timestamps"] = [positions for _, _, _, positions in windows]
 
-        return clips
+    return clips
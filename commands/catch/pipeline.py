@@ -0,0 +1,284 @@
+import multiprocessing
+import sys
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from copy import deepcopy
+
+from commands.catch import extract, process
+from utils import logger, saved_data, encoding
+
+"""
+Staged processing of the videos
+
+    subtitles  ->  timestamps  ->  video  ->  clips
+    (threads)     (processes)   (threads)  (processes)
+
+Every stage has its own queue of videos waiting for it, and a stage only
+starts working on a video if the queue of the next stage is not full, so
+that a slow stage holds back the previous ones. Downloaded videos waiting
+to be cut are also limited, so that downloads can not outrun the disk.
+"""
+
+_stages = ["subtitles", "timestamps", "video", "clips"]
+
+
+def _fetch_video(conf, video_id, windows):
+    download = extract.video_download(conf, video_id, windows)
+    try:
+        return download, download.__enter__()
+    except BaseException:
+        # Release the download as a with statement would, the error never reaching the pipeline state
+        download.__exit__(*sys.exc_info())
+        raise
+
+
+def _cut_clips(conf, video_id, video_file_path, windows):
+    # Encoding statistics of the worker process are sent back along the clips
+    return extract.cut_clips(conf, video_id, video_file_path, windows), encoding.pop_stats()
+
+
+class _Pipeline:
+    def __init__(self, conf, videos, on_video_done=None):
+        self.conf = conf
+        self.videos = videos
+        self.on_video_done = on_video_done
+        self.max_videos_amount = min(conf.max_videos_amount, len(videos))
+        self.next_video = 0
+
+        self.queues = {stage: deque() for stage in _stages}
+        self.running = {}
+        self.running_count = {stage: 0 for stage in _stages}
+        self.pending_downloads = 0
+
+        self.done_count = 0
+        self.errors = []
+
+        self.io_pool = ThreadPoolExecutor(max_workers=conf.max_data_thread_workers)
+        # Processes are spawned rather than forked, as forking while threads are running is unsafe
+        self.cpu_pool = ProcessPoolExecutor(
+            max_workers=conf.max_cpu_process_workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=logger.setup,
+            initargs=(logger.is_verbose(),),
+        )
+        self.pools = {
+            "subtitles": (self.io_pool, conf.max_data_thread_workers),
+            "timestamps": (self.cpu_pool, conf.max_cpu_process_workers),
+            "video": (self.io_pool, conf.max_data_thread_workers),
+            "clips": (self.cpu_pool, conf.max_cpu_process_workers),
+        }
+
+    """
+    Scheduling
+    """
+
+    def _can_start(self, stage):
+        _, max_workers = self.pools[stage]
+        if len(self.queues[stage]) == 0 or self.running_count[stage] >= max_workers:
+            return False
+        if stage == "video" and self.pending_downloads >= self.conf.max_pending_downloads:
+            return False
+        next_stage_pos = _stages.index(stage) + 1
+        if next_stage_pos < len(_stages):
+            return len(self.queues[_stages[next_stage_pos]]) < self.conf.max_stage_queue_size
+        return True
+
+    def _submit(self, stage, state):
+        pool, _ = self.pools[stage]
+        conf, video_id = state["conf"], state["video_id"]
+
+        if stage == "subtitles":
+            logger.info("Extract video data", prefix=conf.logger_prefix)
+            future = pool.submit(extract.subtitles_content, conf, video_id)
+        elif stage == "timestamps":
+            future = pool.submit(extract.subtitles_data, conf, video_id, state.pop("content"))
+        elif stage == "video":
+            logger.info("Extract video clips", prefix=conf.logger_prefix)
+            self.pending_downloads += 1
+            future = pool.submit(_fetch_video, conf, video_id, state["windows"])
+        else:
+            future = pool.submit(_cut_clips, conf, video_id, state["video_file_path"], state["windows"])
+
+        self.running[future] = (stage, state)
+        self.running_count[stage] += 1
+
+    def _schedule(self):
+        while True:
+            # Start with the last stages, to drain the pipeline before filling it
+            for stage in reversed(_stages):
+                while self._can_start(stage):
+                    self._submit(stage, self.queues[stage].popleft())
+
+            # Feed the pipeline with a new video, only if no stage is full
+            if self.next_video >= self.max_videos_amount:
+                break
+            if any(len(queue) >= self.conf.max_stage_queue_size for queue in self.queues.values()):
+                break
+            self._start(self.next_video)
+            self.next_video += 1
+
+    """
+    Videos state
+    """
+
+    def _start(self, i):
+        # We need to copy the configuration to edit the logging prefix locally to a video
+        conf = deepcopy(self.conf)
+        video_id = process.prepare(conf, self.videos, i)
+        if video_id is None:
+            return self._notify_done(i)
+
+        logger.info("Retrieve video data", prefix=conf.logger_prefix)
+        state = {"i": i, "conf": conf, "video_id": video_id, "download": None}
+        video_data = saved_data.read(conf, process.saved_data_path(video_id), lambda: None, write=False)
+
+        if process.needs_data(conf, video_data):
+            self.queues["subtitles"].append(state)
+        else:
+            self._data_loaded(state, video_data)
+
+    def _save(self, state):
+        saved_data.write(state["conf"], process.saved_data_path(state["video_id"]), lambda: state["data"])
+
+    def _data_loaded(self, state, video_data):
+        conf = state["conf"]
+        state["data"] = video_data
+
+        timestamps_count = len(video_data.get("timestamps", []))
+        logger.debug(f"Loaded {timestamps_count} timestamps", prefix=conf.logger_prefix)
+
+        if not process.needs_clips(conf, video_data):
+            return self._finish(state)
+
+        if timestamps_count == 0:
+            logger.info("No timestamps to extract", prefix=conf.logger_prefix)
+            video_data["clips"] = []
+            self._save(state)
+            return self._finish(state)
+
+        state["windows"] = extract.clip_windows(conf, video_data)
+
+        # No need to download the video when every clip is already cut
+        clips = extract.cached_clips(conf, state["video_id"], state["windows"])
+        if clips is not None:
+            logger.info("Use existing video clips", prefix=conf.logger_prefix)
+            video_data["clips"] = clips
+            video_data["clips_timestamps"] = [positions for _, _, _, positions in state["windows"]]
+            self._save(state)
+            return self._finish(state)
+
+        self.queues["video"].append(state)
+
+    def _release_download(self, state):
+        if state["download"] is not None:
+            state["download"].__exit__(None, None, None)
+            state["download"] = None
+        self.pending_downloads -= 1
+
+    def _notify_done(self, i):
+        if self.on_video_done is not None:
+            self.on_video_done(i)
+
+    def _finish(self, state):
+        self.done_count += 1
+        if "data" in state:
+            process.finish(state["conf"], self.videos, state["i"], state["data"])
+        self._notify_done(state["i"])
+
+    def _on_done(self, stage, state, result):
+        conf = state["conf"]
+
+        if stage == "subtitles":
+            video_data, content = result
+            if video_data is None:
+                logger.info("Unable to load video data", prefix=conf.logger_prefix)
+                return self._finish(state)
+            state["data"] = video_data
+            if content is None:
+                self._save(state)
+                return self._data_loaded(state, video_data)
+            state["content"] = content
+            self.queues["timestamps"].append(state)
+
+        elif stage == "timestamps":
+            state["data"] = {**state["data"], **result}
+            self._save(state)
+            self._data_loaded(state, state["data"])
+
+        elif stage == "video":
+            state["download"], dl = result
+            if dl is None:
+                logger.error("Unable to download video", prefix=conf.logger_prefix)
+                self._release_download(state)
+                self._save(state)
+                return self._finish(state)
+
+            # Keep track of the downloaded file and its format
+            state["data"]["video_file"] = dl["video_file"]
+
+            if not dl["video_file"]["exists"]:
+                logger.error("No video file found", prefix=conf.logger_prefix)
+                self._release_download(state)
+                state["data"]["clips"] = []
+                self._save(state)
+                return self._finish(state)
+
+            state["video_file_path"] = dl["video_file"]["path"]
+            self.queues["clips"].append(state)
+
+        else:
+            self._release_download(state)
+            state["data"]["clips"], stats = result
+            encoding.merge_stats(stats)
+            # Keep track of the timestamps covered by each clip
+            state["data"]["clips_timestamps"] = [positions for _, _, _, positions in state["windows"]]
+            self._save(state)
+            self._finish(state)
+
+    def _on_error(self, stage, state, error):
+        conf = state["conf"]
+        logger.error(f"Error during {stage} stage: {error}", prefix=conf.logger_prefix)
+        self.errors.append((state["video_id"], stage, error))
+        if stage in ["video", "clips"]:
+            self._release_download(state)
+        self._finish(state)
+
+    """
+    Run
+    """
+
+    def run(self):
+        try:
+            self._schedule()
+            while len(self.running) > 0:
+                done, _ = wait(self.running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    stage, state = self.running.pop(future)
+                    self.running_count[stage] -= 1
+                    try:
+                        result = future.result()
+                    except Exception as e:
+                        self._on_error(stage, state, e)
+                    else:
+                        self._on_done(stage, state, result)
+                self._schedule()
+        finally:
+            self.io_pool.shutdown()
+            self.cpu_pool.shutdown()
+
+        return self.errors
+
+
+def run(conf, videos, on_video_done=None):
+    """
+    Process the videos through the stages, returning the (video id, stage, error) that happened,
+    on_video_done being called with the index of every video once it is done
+    """
+    pipeline = _Pipeline(conf, videos, on_video_done)
+    errors = pipeline.run()
+
+    logger.info(f"Processed {pipeline.done_count} videos ({len(errors)} errors)")
+    for video_id, stage, error in errors:
+        logger.error(f"{video_id} failed during {stage} stage: {error}")
+
+    return errors
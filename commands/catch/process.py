@@ -4,28 +4,78 @@ from commands.catch import extract
 from utils import logger, saved_data
 
 
-def video(conf, videos, i):
+def prepare(conf, videos, i):
+    """
+    Check the video is not filtered and set the logging prefix,
+    returning the video id or None if the video should be ignored
+    """
     video_id = videos[i]["id"]["videoId"]
 
     if len(conf.filter_videos_ids) > 0 and (video_id not in conf.filter_videos_ids):
         logger.info("Ignored", prefix=conf.logger_prefix)
-        return
+        return None
     if len(conf.filter_out_videos_ids) > 0 and (video_id in conf.filter_out_videos_ids):
         logger.info("Filtered out", prefix=conf.logger_prefix)
-        return
+        return None
 
     max_videos_amount = min(conf.max_videos_amount, len(videos))
-    videos = videos[:max_videos_amount]
 
     pos_log = str(i + 1).rjust(len(str(max_videos_amount)))
     # This might be an abuse as the conf is not the context but it works
     conf.logger_prefix = f"({pos_log}/{max_videos_amount}) {video_id} >> "
 
+    return video_id
+
+
+def saved_data_path(video_id):
+    return os.path.join("videos", video_id)
+
+
+def needs_data(conf, video_data):
+    """
+    Check the video data has to be computed, the data of other words to extract being outdated
+    """
+    if conf.do_override_video_data or video_data is None:
+        return True
+    # Data saved before targets were recorded is still valid, unless a video is built for every target
+    if "targets" not in video_data and len(conf.words_to_extract) == 1 and not conf.do_generate_words_videos:
+        return False
+    return set(video_data.get("targets", {})) != set(conf.words_to_extract)
+
+
+def needs_clips(conf, video_data):
+    """
+    Check the clips of the video have to be extracted, the saved ones having been cut with other parameters
+    (the clips cache being looked up for every one of them, only the missing ones are cut again)
+    """
+    if not conf.do_generate_clips:
+        return False
+    if conf.do_override_clips or video_data.get("clips", None) is None:
+        return True
+    windows = extract.clip_windows(conf, video_data)
+    return video_data["clips"] != extract.clips_paths(conf, video_data["id"], windows)
+
+
+def finish(conf, videos, i, video_data):
+    clips_len = len(video_data.get("clips", []))
+    if clips_len == 0:
+        logger.info("No clips to load", prefix=conf.logger_prefix)
+    else:
+        logger.info(f"Loaded {clips_len} clips", prefix=conf.logger_prefix)
+
+    videos[i]["data"] = video_data
+
+
+def video(conf, videos, i):
+    video_id = prepare(conf, videos, i)
+    if video_id is None:
+        return
+
     logger.info("Retrieve video data", prefix=conf.logger_prefix)
-    video_saved_data_path = os.path.join("videos", video_id)
+    video_saved_data_path = saved_data_path(video_id)
     video_data = saved_data.read(conf, video_saved_data_path, lambda: None, write=False)
 
-    if conf.do_override_video_data or video_data is None:
+    if needs_data(conf, video_data):
         video_data = extract.video_data(conf, video_id)
         if video_data is None:
             logger.info("Unable to load video data", prefix=conf.logger_prefix)
@@ -35,16 +85,10 @@ def video(conf, videos, i):
     timestamps_count = len(video_data.get("timestamps", []))
     logger.debug(f"Loaded {timestamps_count} timestamps", prefix=conf.logger_prefix)
 
-    if conf.do_generate_clips and (conf.do_override_clips or video_data.get("clips", None) is None):
+    if needs_clips(conf, video_data):
         clips = extract.video_clips(conf, video_id, video_data)
         if clips is not None:
             video_data["clips"] = clips
         saved_data.write(conf, video_saved_data_path, lambda: video_data)
 
-    clips_len = len(video_data.get("clips", []))
-    if clips_len == 0:
-        logger.info("No clips to load", prefix=conf.logger_prefix)
-    else:
-        logger.info(f"Loaded {clips_len} clips", prefix=conf.logger_prefix)
-
-    videos[i]["data"] = video_data
+    finish(conf, videos, i, video_data)
@@ -9,7 +9,7 @@ import os
 import pkgutil
 
 from commands.chart.config import ChartConfig
-from utils import config, logger, saved_data
+from utils import config, logger, timestamps_dataset
 
 
 def run(args):
@@ -18,7 +18,7 @@ def run(args):
     conf.logger_prefix = "> "
 
     # Load videos and their data
-    videos = saved_data.read_videos(conf)
+    videos = timestamps_dataset.read_videos(conf)
 
     # Apply video filters
     if len(conf.filter_videos_ids) > 0:
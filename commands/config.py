@@ -23,6 +23,18 @@ class AllConfig:
         self.output_folder = kwargs.get("output_folder", "")
         # The sub-folder used for persistent data storage (timestamps, lists, ...)
         self.data_folder = kwargs.get("data_folder", os.path.join(self.output_folder, "data"))
+        # The sub-folder used for the transcripts of every word of the videos (can be shared by different words)
+        self.transcripts_folder = kwargs.get("transcripts_folder", os.path.join(self.output_folder, "transcripts"))
+
+        """
+        Data storage
+        """
+        # How the persistent data is stored in the data folder, either:
+        # - "yaml": one YAML file per value, entirely rewritten on every update
+        # - "sqlite": a single SQLite database, the YAML files already there being imported when it is created
+        self.data_backend = kwargs.get("data_backend", "yaml")
+        # Amount of values written to the SQLite database before committing them all at once
+        self.data_batch_size = int(kwargs.get("data_batch_size", 20))
 
         """
         Filters
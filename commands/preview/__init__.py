@@ -0,0 +1,86 @@
+"""
+Build a fast low resolution preview of the final video
+"""
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+from copy import deepcopy
+
+from commands.catch import build, extract, process
+from commands.preview.config import PreviewConfig
+from utils import config, logger, saved_data, encoding
+
+
+def _sample_windows(conf, videos):
+    """
+    List the windows of the clips to preview of every video, only keeping the
+    first clips of every video, then one clip every few of the remaining ones
+    """
+    videos_windows = []
+    clip_index = 0
+
+    for video in videos:
+        windows = extract.clip_windows(conf, video.get("data", {}))
+        if conf.preview_max_clips_per_video > 0:
+            windows = windows[: conf.preview_max_clips_per_video]
+
+        sampled_windows = []
+        for window in windows:
+            if clip_index % conf.preview_clips_step == 0:
+                sampled_windows.append(window)
+            clip_index += 1
+        videos_windows.append(sampled_windows)
+
+    return videos_windows
+
+
+def _preview_video(conf, videos, i, windows):
+    # Work on a copy, so that the data of the catch command is left untouched
+    # (and its clips never end up in the preview)
+    video_data = deepcopy(videos[i].get("data", {}))
+    video_data["clips"] = []
+
+    video_id = process.prepare(conf, videos, i)
+    if video_id is not None and len(windows) > 0:
+        video_data["clips"] = extract.video_clips(conf, video_id, video_data, windows) or []
+
+    return {**videos[i], "data": video_data}
+
+
+def run(args):
+    catch_args = config.read_args(args.config, "catch")
+    preview_args = config.read_args(args.config, "preview")
+    conf = PreviewConfig(**{**catch_args, **PreviewConfig.defaults, **preview_args})
+    conf.logger_prefix = "> "
+
+    # Load videos and their data, as extracted by the catch command
+    logger.info("Load video's data")
+    videos = saved_data.read_videos(conf)
+    videos_windows = _sample_windows(conf, videos)
+
+    clips_count = sum(len(windows) for windows in videos_windows)
+    logger.info(f"Preview {clips_count} clips of {len(videos)} videos")
+
+    # We need to copy the configuration to edit the logging prefix locally to a video
+    with ThreadPoolExecutor(max_workers=max(1, conf.max_data_thread_workers)) as pool:
+        futures = [
+            pool.submit(_preview_video, deepcopy(conf), videos, i, windows) for i, windows in enumerate(videos_windows)
+        ]
+        preview_videos = [future.result() for future in futures]
+
+    video_file_path = build.final_video(conf, preview_videos)
+    if video_file_path is not None:
+        logger.info(f"Preview video: {video_file_path}", prefix=">>> ")
+
+    encoding.log_stats()
+
+
+def parse(prog, args):
+    parser = argparse.ArgumentParser(prog=prog, description=__doc__)
+    parser.add_argument(
+        "-c",
+        "--config",
+        metavar="FILE",
+        default="config.ini",
+        help="ini configuration file",
+    )
+    return parser.parse_args(args)
@@ -0,0 +1,51 @@
+import os
+
+from commands.catch.config import CatchConfig
+
+
+class PreviewConfig(CatchConfig):
+    # Settings making the preview fast, overriding the catch ones unless set in the preview section
+    defaults = {
+        "resolution": "640x360",
+        "clip_fps": "10",
+        "clip_audio_rate": "22050",
+        "clip_cut_mode": "batch",
+        "build_mode": "stream",
+        "clips_encoding_profile": "preview",
+        "final_encoding_profile": "preview",
+        "do_incremental_build": "False",
+        "do_overlap_build": "False",
+        "output_renditions": "[]",
+    }
+
+    def __init__(self, **kwargs):
+        """
+        Initialize the configuration.
+        :param kwargs: dictionary of key value to set
+        """
+        output_folder = kwargs.get("output_folder", "")
+        preview_folder = kwargs.get("preview_folder", os.path.join(output_folder, "preview"))
+
+        # The preview shares the downloads cache of the catch command (its files being named after the resolution
+        # they were selected for), but never writes to its clips, build and data
+        kwargs = {
+            **kwargs,
+            "clips_folder": os.path.join(preview_folder, "clips"),
+            "build_folder": os.path.join(preview_folder, "build"),
+            "do_output_data": "False",
+        }
+        super().__init__(**kwargs)
+
+        """
+        Folders
+        """
+        # The sub-folder used for the clips and builds of the preview
+        self.preview_folder = preview_folder
+
+        """
+        Sampling
+        """
+        # Maximum amount of clips of every video (0 for all of them)
+        self.preview_max_clips_per_video = int(kwargs.get("preview_max_clips_per_video", 0))
+        # Only keep one clip every this amount of clips (1 for all of them)
+        self.preview_clips_step = max(1, int(kwargs.get("preview_clips_step", 1)))
@@ -0,0 +1,65 @@
+"""
+Search a word in the transcripts saved by the catch command
+"""
+import argparse
+
+from commands.search.config import SearchConfig
+from utils import config, logger, saved_data, transcripts
+
+
+def run(args):
+    # Load configuration
+    conf = config.read(args.config, "search", SearchConfig)
+    conf.logger_prefix = "> "
+    word = args.word or conf.word_to_extract
+
+    # Only search the videos of the channel, when they are known
+    videos = saved_data.read(conf, "videos", lambda: None, write=False)
+    videos_ids = None
+    if videos is not None:
+        videos_ids = [video["id"]["videoId"] for video in videos[: conf.max_videos_amount]]
+
+    # Transcripts saved by an interrupted catch are not indexed yet
+    transcripts.update_index(conf.transcripts_folder)
+    logger.info(f"Search the word {word}")
+    results = transcripts.search(conf.transcripts_folder, word, videos_ids)
+
+    # Apply video filters
+    if len(conf.filter_videos_ids) > 0:
+        results = {
+            video_id: timestamps for video_id, timestamps in results.items() if video_id in conf.filter_videos_ids
+        }
+
+    # Display results
+    titles = {video["id"]["videoId"]: video["snippet"]["title"] for video in videos or []}
+    timestamps_count = sum(len(timestamps) for timestamps in results.values())
+    words_count = {}
+    for timestamps in results.values():
+        for _, matched_word, _ in timestamps:
+            words_count[matched_word] = words_count.get(matched_word, 0) + 1
+
+    logger.info(f"Found {timestamps_count} times in {len(results)} videos", prefix=f"{word} >> ")
+    for matched_word, amount in sorted(words_count.items(), key=lambda item: item[1], reverse=True):
+        logger.info(f"{matched_word}: {amount} times", prefix=f"{word} >> ")
+    videos_results = sorted(results.items(), key=lambda item: len(item[1]), reverse=True)
+    for video_id, timestamps in videos_results[: conf.search_max_videos_display_count]:
+        logger.info(f"{len(timestamps)} times in '{titles.get(video_id, video_id)}'", prefix=f"{word} >> ")
+
+
+def parse(prog, args):
+    parser = argparse.ArgumentParser(prog=prog, description=__doc__)
+    parser.add_argument(
+        "-c",
+        "--config",
+        metavar="FILE",
+        default="config.ini",
+        help="ini configuration file",
+    )
+    parser.add_argument(
+        "-w",
+        "--word",
+        metavar="REGEX",
+        default=None,
+        help="word to search (default: the word to extract of the configuration)",
+    )
+    return parser.parse_args(args)
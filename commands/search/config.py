@@ -0,0 +1,16 @@
+from commands.config import AllConfig
+
+
+class SearchConfig(AllConfig):
+    def __init__(self, **kwargs):
+        """
+        Initialize the configuration.
+        :param kwargs: dictionary of key value to set
+        """
+        super().__init__(**kwargs)
+
+        """
+        Options
+        """
+        # Maximum number of videos to display, the ones where the word is pronounced the most first
+        self.search_max_videos_display_count = int(kwargs.get("search_max_videos_display_count", 10))
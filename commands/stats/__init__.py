@@ -5,7 +5,7 @@ import argparse
 import re
 
 from commands.stats.config import StatsConfig
-from utils import config, saved_data, logger, clips, convert
+from utils import config, timestamps_dataset, logger, clips, convert
 
 
 def run(args):
@@ -15,7 +15,7 @@ def run(args):
 
     # Load videos and their data
     logger.info("Load video's data")
-    videos = saved_data.read_videos(conf)
+    videos = timestamps_dataset.read_videos(conf)
 
     # Compute statistics
     logger.info("Compute statistics")
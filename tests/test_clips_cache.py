@@ -0,0 +1,59 @@
+import importlib.util
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+
+@unittest.skipIf(importlib.util.find_spec("moviepy") is None, "moviepy is not installed")
+class ClipsCacheTest(unittest.TestCase):
+    def setUp(self):
+        from utils import clips_cache
+
+        self.clips_cache = clips_cache
+        self.folder = tempfile.TemporaryDirectory()
+        self.clip_key = self.clips_cache.key({"video_id": "a", "start": 1.0, "end": 2.5})
+        self.clip_path = self.clips_cache.path(self.folder.name, self.clip_key)
+        with open(self.clip_path, "wb") as f:
+            f.write(b"\0" * 100)
+        self.infos = {"duration": 1.5, "video_codec": "h264", "width": 1920, "height": 1080}
+        self.manifest = {self.clip_key: {"size": 100, "checksum": self.clips_cache._checksum(self.clip_path)}}
+
+    def tearDown(self):
+        self.folder.cleanup()
+
+    def test_key(self):
+        self.assertEqual(
+            self.clips_cache.key({"start": 1.0, "end": 2.5}), self.clips_cache.key({"end": 2.5, "start": 1.0})
+        )
+        self.assertNotEqual(self.clips_cache.key({"start": 1.0}), self.clips_cache.key({"start": 1.5}))
+
+    def test_is_valid(self):
+        self.assertTrue(self.clips_cache.is_valid(self.manifest, self.folder.name, self.clip_key, verify_checksum=True))
+        self.assertFalse(self.clips_cache.is_valid({}, self.folder.name, self.clip_key))
+
+        with open(self.clip_path, "ab") as f:
+            f.write(b"\0")
+        self.assertFalse(self.clips_cache.is_valid(self.manifest, self.folder.name, self.clip_key))
+
+    def test_probe_from_manifest(self):
+        self.manifest[self.clip_key]["infos"] = self.infos
+        self.clips_cache.save(self.folder.name, self.manifest)
+
+        manifests = {}
+        with mock.patch("utils.ffmpeg.probe") as probe:
+            self.assertEqual(self.clips_cache.probe(self.clip_path, manifests), self.infos)
+            self.assertEqual(self.clips_cache.probe(self.clip_path, manifests), self.infos)
+        probe.assert_not_called()
+        self.assertEqual(list(manifests), [self.folder.name])
+
+    def test_probe_without_infos(self):
+        self.clips_cache.save(self.folder.name, self.manifest)
+
+        with mock.patch("utils.ffmpeg.probe", return_value=self.infos) as probe:
+            self.assertEqual(self.clips_cache.probe(self.clip_path), self.infos)
+        probe.assert_called_once_with(self.clip_path)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,56 @@
+import importlib.util
+import unittest
+from types import SimpleNamespace
+
+
+@unittest.skipIf(importlib.util.find_spec("moviepy") is None, "moviepy is not installed")
+class CoalesceWindowsTest(unittest.TestCase):
+    def setUp(self):
+        from commands.catch import extract
+
+        self.extract = extract
+        self.conf = SimpleNamespace(start_shift=-0.25, end_shift=0.75, max_length=10.0, clip_merge_gap=0.0)
+
+    def _coalesce(self, timestamps):
+        windows = self.extract._clip_windows(self.conf, timestamps)
+        return self.extract._coalesce_windows(self.conf, timestamps, windows)
+
+    def test_duplicates_and_overlaps(self):
+        timestamps = [
+            ("00:00:01.000", "hello", "00:00:01.500"),
+            ("00:00:01.000", "hello", "00:00:01.500"),
+            ("00:00:01.500", "world", "00:00:02.000"),
+            ("00:00:10.000", "far", "00:00:10.500"),
+        ]
+
+        self.assertEqual(
+            self._coalesce(timestamps),
+            [(0.75, 2.75, "hello", [1, 2, 3]), (9.75, 11.25, "far", [4])],
+        )
+
+    def test_positions_sorted(self):
+        # The window of the second timestamp starts first, the positions still end up in order
+        timestamps = [
+            ("00:00:05.000", "hello", "00:00:05.500"),
+            ("00:00:04.500", "world", "00:00:05.000"),
+            ("00:00:04.500", "world", "00:00:05.000"),
+        ]
+
+        self.assertEqual(self._coalesce(timestamps), [(4.25, 6.25, "world", [1, 2, 3])])
+
+    def test_merge_gap(self):
+        self.conf.clip_merge_gap = 1.0
+        timestamps = [
+            ("00:00:01.000", "hello", "00:00:01.500"),
+            ("00:00:03.000", "world", "00:00:03.500"),
+            ("00:00:06.000", "far", "00:00:06.500"),
+        ]
+
+        self.assertEqual(
+            self._coalesce(timestamps),
+            [(0.75, 4.25, "hello", [1, 2]), (5.75, 7.25, "far", [3])],
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,70 @@
+import os
+import tempfile
+import unittest
+
+from utils import journal
+
+
+class JournalTest(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+        self.file_path = os.path.join(self.folder.name, "build", "test.journal")
+
+    def tearDown(self):
+        self.folder.cleanup()
+
+    def test_append_and_reopen(self):
+        with journal.Journal(self.file_path, sync_interval=2) as log:
+            log.append({"node": "a", "size": 1})
+            log.append({"node": "b", "size": 2})
+            log.append({"node": "c", "size": 3})
+            self.assertEqual(len(log.records), 3)
+
+        with journal.Journal(self.file_path) as log:
+            self.assertEqual([record["node"] for record in log.records], ["a", "b", "c"])
+
+    def test_interrupted_record(self):
+        with journal.Journal(self.file_path) as log:
+            log.append({"node": "a"})
+            log.append({"node": "b"})
+        with open(self.file_path, "ab") as f:
+            f.write(b'{"node": "c"')
+
+        with journal.Journal(self.file_path) as log:
+            self.assertEqual(log.records, [{"node": "a"}, {"node": "b"}])
+            log.append({"node": "d"})
+
+        # The interrupted record was dropped, not prepended to the next one
+        with journal.Journal(self.file_path) as log:
+            self.assertEqual(log.records, [{"node": "a"}, {"node": "b"}, {"node": "d"}])
+
+    def test_corrupted_record(self):
+        with open(os.path.join(self.folder.name, "test.journal"), "wb") as f:
+            f.write(b'{"node": "a"}\nnot json\n{"node": "c"}\n')
+
+        with journal.Journal(os.path.join(self.folder.name, "test.journal")) as log:
+            self.assertEqual(log.records, [{"node": "a"}])
+
+    def test_reset(self):
+        with journal.Journal(self.file_path) as log:
+            log.append({"node": "a"})
+            log.reset()
+            log.append({"node": "b"})
+
+        with journal.Journal(self.file_path) as log:
+            self.assertEqual(log.records, [{"node": "b"}])
+
+    def test_remove(self):
+        log = journal.Journal(self.file_path)
+        log.append({"node": "a"})
+
+        log.remove()
+
+        self.assertFalse(os.path.exists(self.file_path))
+        self.assertEqual(log.records, [])
+        with journal.Journal(self.file_path) as log:
+            self.assertEqual(log.records, [])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,188 @@
+import os
+import re
+import shutil
+import struct
+import subprocess
+import tempfile
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from utils import mp4
+
+_sample_size = 100 * 1024
+_fragment_size = 50 * 1024
+
+
+def _box(box_type, *payloads):
+    payload = b"".join(payloads)
+    return struct.pack(">I4s", 8 + len(payload), box_type) + payload
+
+
+def _full_box(box_type, *payloads):
+    return _box(box_type, b"\0\0\0\0", *payloads)
+
+
+def _moov(samples_offsets, samples_count, syncs, fragmented=False):
+    if fragmented:
+        stbl = _box(b"stbl")
+    else:
+        stbl = _box(
+            b"stbl",
+            _full_box(b"stts", struct.pack(">III", 1, samples_count, 1000)),
+            _full_box(b"stsz", struct.pack(">II", _sample_size, samples_count)),
+            _full_box(
+                b"stco", struct.pack(">I", len(samples_offsets)), *(struct.pack(">I", o) for o in samples_offsets)
+            ),
+            _full_box(b"stsc", struct.pack(">IIII", 1, 1, 1, 1)),
+            _full_box(b"stss", struct.pack(">I", len(syncs)), *(struct.pack(">I", s + 1) for s in syncs)),
+        )
+    mdia = _box(
+        b"mdia",
+        _full_box(b"mdhd", struct.pack(">IIIII", 0, 0, 1000, samples_count * 1000, 0)),
+        _full_box(b"hdlr", struct.pack(">I4s", 0, b"vide"), b"\0" * 12),
+        _box(b"minf", stbl),
+    )
+    mvex = [_box(b"mvex")] if fragmented else []
+    return _box(b"moov", _box(b"trak", mdia), *mvex)
+
+
+def _progressive_file(samples_count=10, syncs=(0, 5)):
+    """
+    ftyp, moov, then an mdat of samples of one second each, every byte of a sample being its number
+    """
+    ftyp = _box(b"ftyp", b"isom\0\0\0\0")
+    # The size of the moov does not depend on the offsets it holds
+    moov_size = len(_moov([0] * samples_count, samples_count, syncs))
+    first_offset = len(ftyp) + moov_size + 8
+    offsets = [first_offset + i * _sample_size for i in range(samples_count)]
+    mdat = _box(b"mdat", *(bytes([i + 1]) * _sample_size for i in range(samples_count)))
+    return ftyp + _moov(offsets, samples_count, syncs) + mdat, offsets
+
+
+def _fragmented_file(fragments_count=5, with_sidx=True):
+    """
+    ftyp, moov, sidx, then fragments of two seconds each, every byte of a fragment's data being its number
+    """
+    init = _box(b"ftyp", b"isom\0\0\0\0") + _moov([], 0, [], fragmented=True)
+    fragments = [
+        _box(b"moof", b"\0" * 16) + _box(b"mdat", bytes([i + 1]) * _fragment_size) for i in range(fragments_count)
+    ]
+    references = b"".join(struct.pack(">III", len(fragment), 2000, 0) for fragment in fragments)
+    sidx = _full_box(b"sidx", struct.pack(">IIIIHH", 1, 1000, 0, 0, 0, fragments_count), references)
+    return init + (sidx if with_sidx else b"") + b"".join(fragments), init, fragments
+
+
+class _RangeHandler(BaseHTTPRequestHandler):
+    files = {}
+
+    def do_GET(self):
+        data = self.files[self.path]
+        start, end = map(int, re.match(r"bytes=(\d+)-(\d+)", self.headers["Range"]).groups())
+        end = min(end, len(data) - 1)
+        self.send_response(206)
+        self.send_header("Content-Range", f"bytes {start}-{end}/{len(data)}")
+        self.send_header("Content-Length", str(end - start + 1))
+        self.end_headers()
+        self.wfile.write(data[start : end + 1])
+
+    def log_message(self, *args):
+        pass
+
+
+class FetchWindowsTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.server = ThreadingHTTPServer(("127.0.0.1", 0), _RangeHandler)
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+        self.file_path = os.path.join(self.folder.name, "video.mp4")
+
+    def tearDown(self):
+        self.folder.cleanup()
+
+    def _serve(self, name, data):
+        _RangeHandler.files[f"/{name}"] = data
+        return f"http://127.0.0.1:{self.server.server_port}/{name}"
+
+    def test_progressive(self):
+        data, offsets = _progressive_file()
+        url = self._serve("progressive.mp4", data)
+
+        fetched_size = mp4.fetch_windows(url, self.file_path, [(6.5, 7.5)])
+
+        with open(self.file_path, "rb") as f:
+            result = f.read()
+        self.assertEqual(len(result), len(data))
+        self.assertLess(fetched_size, len(data) / 2)
+        # Headers are there, and samples from the previous sync sample to the end of the window
+        self.assertEqual(result[: offsets[0]], data[: offsets[0]])
+        for i, offset in enumerate(offsets):
+            expected = bytes([i + 1]) if 5 <= i <= 7 else b"\0"
+            self.assertEqual(result[offset : offset + _sample_size], expected * _sample_size, f"sample {i}")
+
+    def test_fragmented(self):
+        data, init, fragments = _fragmented_file()
+        url = self._serve("fragmented.mp4", data)
+
+        fetched_size = mp4.fetch_windows(url, self.file_path, [(4.5, 5.0)])
+
+        with open(self.file_path, "rb") as f:
+            result = f.read()
+        # The first fragment is kept for the file to start at the same time
+        self.assertEqual(result, init + fragments[0] + fragments[2])
+        self.assertEqual(fetched_size, len(init) + len(fragments[0]) + len(fragments[2]))
+
+    def test_fragmented_first_fragment(self):
+        data, init, fragments = _fragmented_file()
+        url = self._serve("fragmented_first_fragment.mp4", data)
+
+        mp4.fetch_windows(url, self.file_path, [(0.5, 1.0)])
+
+        with open(self.file_path, "rb") as f:
+            self.assertEqual(f.read(), init + fragments[0])
+
+    @unittest.skipIf(shutil.which("ffmpeg") is None, "ffmpeg is not installed")
+    def test_fragmented_timing(self):
+        source_path = os.path.join(self.folder.name, "source.mp4")
+        source_args = ["-f", "lavfi", "-i", "testsrc=duration=10:size=160x120:rate=10", "-c:v", "mpeg4", "-g", "10"]
+        fragment_args = ["-bf", "0", "-movflags", "frag_keyframe+empty_moov+default_base_moof+global_sidx"]
+        subprocess.run(["ffmpeg", "-v", "error", *source_args, *fragment_args, source_path], check=True)
+        with open(source_path, "rb") as f:
+            url = self._serve("fragmented_timing.mp4", f.read())
+
+        mp4.fetch_windows(url, self.file_path, [(6.2, 6.8)])
+
+        # A frame of the window cut out of the partial file is the same as the one of the whole file
+        def frame(file_path):
+            args = ["-ss", "6.5", "-i", file_path, "-frames:v", "1", "-f", "rawvideo", "-pix_fmt", "gray", "-"]
+            return subprocess.run(["ffmpeg", "-v", "error", *args], check=True, stdout=subprocess.PIPE).stdout
+
+        expected_frame = frame(source_path)
+        self.assertEqual(len(expected_frame), 160 * 120)
+        self.assertEqual(frame(self.file_path), expected_frame)
+
+    def test_fragmented_without_index(self):
+        data, _, _ = _fragmented_file(with_sidx=False)
+        url = self._serve("fragmented_without_index.mp4", data)
+
+        with self.assertRaises(IOError):
+            mp4.fetch_windows(url, self.file_path, [(4.5, 5.0)])
+
+    def test_no_samples(self):
+        data, _ = _progressive_file(samples_count=0, syncs=())
+        url = self._serve("empty.mp4", data)
+
+        with self.assertRaises(IOError):
+            mp4.fetch_windows(url, self.file_path, [(4.5, 5.0)])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,71 @@
+import importlib.util
+import unittest
+
+
+def _video(format_id, height, vcodec="avc1.4d401f", fps=30, tbr=1000, acodec="none", ext="mp4", protocol="https"):
+    return {
+        "format_id": format_id,
+        "ext": ext,
+        "width": height * 16 // 9,
+        "height": height,
+        "fps": fps,
+        "vcodec": vcodec,
+        "acodec": acodec,
+        "tbr": tbr,
+        "protocol": protocol,
+    }
+
+
+def _audio(format_id, ext="m4a", abr=128):
+    return {"format_id": format_id, "ext": ext, "vcodec": "none", "acodec": "mp4a.40.2", "abr": abr}
+
+
+@unittest.skipIf(importlib.util.find_spec("youtube_dl") is None, "youtube_dl is not installed")
+class SelectFormatTest(unittest.TestCase):
+    def setUp(self):
+        from utils import youtube
+
+        self.select_format = youtube.select_format
+        self.formats = [
+            _video("360", 360),
+            _video("720", 720),
+            _video("720vp9", 720, vcodec="vp9"),
+            _video("720p60", 720, fps=60),
+            _video("1080", 1080),
+            _video("progressive", 360, acodec="mp4a.40.2"),
+            _audio("webm", ext="webm", abr=160),
+            _audio("m4a"),
+        ]
+
+    def test_smallest_big_enough(self):
+        fmt = self.select_format(self.formats, "1280x720")
+
+        self.assertEqual(fmt["format_id"], "720+m4a")
+        self.assertEqual(fmt["video"]["height"], 720)
+        self.assertEqual(fmt["audio"]["ext"], "m4a")
+
+    def test_codecs(self):
+        self.assertEqual(self.select_format(self.formats, "1280x720", codecs=["vp9"])["format_id"], "720vp9+m4a")
+
+    def test_max_fps(self):
+        formats = [fmt for fmt in self.formats if fmt["format_id"] != "720"]
+
+        self.assertEqual(self.select_format(formats, "1280x720", max_fps=30)["format_id"], "720vp9+m4a")
+        self.assertEqual(self.select_format(formats, "1280x720", codecs=["avc1"])["format_id"], "720p60+m4a")
+
+    def test_biggest_when_none_big_enough(self):
+        self.assertEqual(self.select_format(self.formats, "3840x2160")["format_id"], "1080+m4a")
+
+    def test_progressive(self):
+        fmt = self.select_format(self.formats, "1280x720", progressive=True)
+
+        self.assertEqual(fmt["format_id"], "progressive")
+        self.assertIsNone(fmt["audio"])
+
+    def test_no_video(self):
+        self.assertIsNone(self.select_format([_audio("m4a")], "1280x720"))
+        self.assertIsNone(self.select_format(self.formats[:5], "1280x720", progressive=True))
+
+
+if __name__ == "__main__":
+    unittest.main()
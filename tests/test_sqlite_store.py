@@ -0,0 +1,80 @@
+import os
+import tempfile
+import unittest
+
+from utils import io, sqlite_store
+
+
+class StoreTest(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+        self.database_path = os.path.join(self.folder.name, "data.sqlite")
+        self.store = sqlite_store.Store(self.database_path)
+
+    def tearDown(self):
+        self.store.close()
+        self.folder.cleanup()
+
+    def _reopen(self):
+        self.store.close()
+        self.store = sqlite_store.Store(self.database_path)
+
+    def test_values(self):
+        self.store.dump("videos", [{"id": {"videoId": "a"}}])
+        self.store.dump(os.path.join("build", "incremental"), {"clips": ["a.mp4"]})
+        self._reopen()
+
+        self.assertEqual(self.store.load("videos"), (True, [{"id": {"videoId": "a"}}]))
+        self.assertEqual(self.store.load("build/incremental"), (True, {"clips": ["a.mp4"]}))
+        self.assertEqual(self.store.load("channel_id"), (False, None))
+
+    def test_video_rows(self):
+        video_data = {
+            "time": "00:10:00.000",
+            "timestamps": [["00:00:01.000", "hello", "00:00:01.500"], ["00:00:02.000", "world", "00:00:02.500"]],
+            "clips": ["a_1.mp4", "a_2.mp4"],
+        }
+        self.store.dump(os.path.join("videos", "a"), video_data)
+        self._reopen()
+
+        self.assertEqual(self.store.load(os.path.join("videos", "a")), (True, video_data))
+        self.assertEqual(self.store.load("videos/b"), (False, None))
+
+    def test_video_rows_removed(self):
+        self.store.dump("videos/a", {"timestamps": [["00:00:01.000", "hello", "00:00:01.500"]] * 3, "clips": ["a.mp4"]})
+        self.store.dump("videos/a", {"timestamps": [["00:00:03.000", "world", "00:00:03.500"]]})
+
+        # Lists that are not set anymore are not loaded as empty ones
+        self.assertEqual(
+            self.store.load("videos/a"), (True, {"timestamps": [["00:00:03.000", "world", "00:00:03.500"]]})
+        )
+
+    def test_batches(self):
+        self.store.batch_size = 2
+        self.store.dump("videos/a", {"time": "00:01:00.000"})
+        self.assertEqual(self.store.pending_writes, 1)
+        self.store.dump("videos/b", {"time": "00:02:00.000"})
+        self.assertEqual(self.store.pending_writes, 0)
+
+    def test_version(self):
+        version = self.store.version()
+        self.store.dump("build/incremental", {"clips": []})
+        self.store.commit()
+        self.assertEqual(self.store.version(), version)
+
+        self.store.dump("videos/a", {"time": "00:01:00.000"})
+        self.store.commit()
+        self.assertEqual(self.store.version(), version + 1)
+
+    def test_import_yaml(self):
+        io.dump_yaml(os.path.join(self.folder.name, "videos.yaml"), [{"id": {"videoId": "a"}}])
+        io.dump_yaml(os.path.join(self.folder.name, "videos", "a.yaml"), {"timestamps": [["0", "hello", "1"]]})
+
+        self.assertEqual(self.store.import_yaml(self.folder.name), 2)
+
+        self.assertEqual(self.store.load("videos"), (True, [{"id": {"videoId": "a"}}]))
+        self.assertEqual(self.store.load("videos/a"), (True, {"timestamps": [["0", "hello", "1"]]}))
+
+
+if __name__ == "__main__":
+    unittest.main()
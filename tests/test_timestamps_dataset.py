@@ -0,0 +1,85 @@
+import os
+import tempfile
+import unittest
+from types import SimpleNamespace
+
+from utils import saved_data, timestamps_dataset
+
+
+def _video(video_id, timestamps, time="00:10:00.000"):
+    return {
+        "id": {"videoId": video_id},
+        "snippet": {"title": f"Title of {video_id}", "publishedAt": "2020-08-01T12:00:00Z"},
+        "data": {"timestamps": timestamps, "time": time},
+    }
+
+
+def _summary(videos):
+    return [
+        (video["id"]["videoId"], video["data"].get("time"), [tuple(t) for t in video["data"]["timestamps"]])
+        for video in videos
+    ]
+
+
+class TimestampsDatasetTest(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+        self.conf = SimpleNamespace(
+            data_folder=self.folder.name,
+            data_backend="yaml",
+            data_batch_size=1,
+            do_output_data=True,
+            max_videos_amount=10,
+            logger_prefix="> ",
+        )
+        self.videos = [
+            _video("a", [["00:00:01.000", "hello", "00:00:01.500"], ["00:01:00.250", "world", "00:01:01.000"]]),
+            _video("b", []),
+            _video("c", [["01:00:00.000", "hello", "01:00:00.750"]]),
+        ]
+        saved_data.write(
+            self.conf, "videos", lambda: [{k: v for k, v in video.items() if k != "data"} for video in self.videos]
+        )
+        for video in self.videos:
+            saved_data.write(self.conf, os.path.join("videos", video["id"]["videoId"]), lambda: video["data"])
+
+    def tearDown(self):
+        self.folder.cleanup()
+
+    def _read(self):
+        return _summary(timestamps_dataset.read_videos(self.conf))
+
+    def _expected(self):
+        return _summary(self.videos)
+
+    def test_round_trip(self):
+        timestamps_dataset.write(self.conf, self.videos)
+
+        self.assertEqual(self._read(), self._expected())
+
+    def test_lazy_timestamps(self):
+        timestamps_dataset.write(self.conf, self.videos)
+
+        timestamps = timestamps_dataset.read_videos(self.conf)[0]["data"]["timestamps"]
+        self.assertIsInstance(timestamps, timestamps_dataset._Timestamps)
+        self.assertEqual(len(timestamps), 2)
+        self.assertEqual(timestamps[-1], ("00:01:00.250", "world", "00:01:01.000"))
+        with self.assertRaises(IndexError):
+            timestamps[2]
+
+    def test_stale_dataset(self):
+        timestamps_dataset.write(self.conf, self.videos)
+        self.videos[1]["data"]["timestamps"] = [["00:00:02.000", "world", "00:00:02.500"]]
+        saved_data.write(self.conf, os.path.join("videos", "b"), lambda: self.videos[1]["data"])
+        # Mtimes may not have changed yet on coarse file systems
+        os.utime(os.path.join(self.folder.name, "videos", "b.yaml"), ns=(0, 2**62))
+
+        # Saved data written after the dataset is read rather than the dataset
+        self.assertEqual(self._read(), self._expected())
+
+    def test_no_dataset(self):
+        self.assertEqual(self._read(), self._expected())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,92 @@
+import os
+import tempfile
+import unittest
+
+from utils import transcripts
+
+
+def _tokens(*words):
+    return [(f"00:00:{i:02d}.000", word, f"00:00:{i:02d}.500") for i, word in enumerate(words)]
+
+
+class MatcherTest(unittest.TestCase):
+    def test_literals_match_prefixes(self):
+        matcher = transcripts.Matcher({"cat": "cat", "cats": "cats", "dog": "dog"})
+
+        self.assertEqual(matcher.word_names("cats"), ["cat", "cats"])
+        self.assertEqual(matcher.word_names("cat"), ["cat"])
+        self.assertEqual(matcher.word_names("ca"), [])
+        self.assertEqual(matcher.word_names("hotdog"), [])
+
+    def test_patterns(self):
+        matcher = transcripts.Matcher({"colors": "colou?r", "literal": "red", "numbers": r"\d+"})
+
+        self.assertEqual(matcher.word_names("colour"), ["colors"])
+        self.assertEqual(matcher.word_names("redcolor"), ["literal"])
+        self.assertEqual(matcher.word_names("42"), ["numbers"])
+        self.assertEqual(matcher.word_names("blue"), [])
+
+    def test_match(self):
+        matcher = transcripts.Matcher({"hello": "hello", "world": "wor.d", "none": "none"})
+
+        matches = matcher.match(_tokens("hello", "world", "hello", "word", "hellos"))
+
+        self.assertEqual(matches, {"hello": [0, 2, 4], "world": [1], "none": []})
+
+    def test_same_pattern_names(self):
+        matcher = transcripts.Matcher({"first": "hi", "second": "hi"})
+
+        self.assertEqual(matcher.match(_tokens("hi", "ho")), {"first": [0], "second": [0]})
+
+
+class TranscriptsTest(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.folder.cleanup()
+
+    def test_round_trip(self):
+        video_tokens = [("00:00:01.250", "hello", "00:00:01.750"), ("01:02:03.004", "world", "01:02:04.000")]
+
+        transcripts.save(self.folder.name, "a", video_tokens, "01:10:00.000")
+
+        self.assertEqual(transcripts.load(self.folder.name, "a"), (video_tokens, "01:10:00.000"))
+
+    def test_round_trip_without_time(self):
+        transcripts.save(self.folder.name, "a", [], None)
+
+        self.assertEqual(transcripts.load(self.folder.name, "a"), ([], None))
+
+    def test_load_missing(self):
+        self.assertIsNone(transcripts.load(self.folder.name, "a"))
+
+    def test_search(self):
+        transcripts.save(self.folder.name, "a", _tokens("hello", "world"), None)
+        transcripts.save(self.folder.name, "b", _tokens("goodbye", "world", "world"), None)
+        transcripts.save(self.folder.name, "c", _tokens("hello", "again"), None)
+        transcripts.update_index(self.folder.name)
+
+        results = transcripts.search(self.folder.name, "wor")
+
+        self.assertEqual(results, {"a": [_tokens("hello", "world")[1]], "b": _tokens("goodbye", "world", "world")[1:]})
+        self.assertEqual(list(transcripts.search(self.folder.name, "hello", videos_ids=["c"])), ["c"])
+        self.assertEqual(transcripts.search(self.folder.name, "nothing"), {})
+
+    def test_update_index(self):
+        transcripts.save(self.folder.name, "a", _tokens("hello"), None)
+        transcripts.update_index(self.folder.name)
+        transcripts.save(self.folder.name, "b", _tokens("hello"), None)
+        transcripts.save(self.folder.name, "a", _tokens("world"), None)
+        # The transcript has to look changed, whatever the resolution of the mtimes
+        transcript_path = os.path.join(self.folder.name, "a.npz")
+        os.utime(transcript_path, (0, os.path.getmtime(transcript_path) + 10))
+
+        transcripts.update_index(self.folder.name)
+
+        self.assertEqual(list(transcripts.search(self.folder.name, "hello")), ["b"])
+        self.assertEqual(list(transcripts.search(self.folder.name, "world")), ["a"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,3 +1,42 @@
+def timestamps_positions(video, pos):
+    """
+    Positions (starting at 1) of the timestamps covered by the clip at the given position
+    """
+    clips_timestamps = video.get("data", {}).get("clips_timestamps", None)
+    if clips_timestamps is None:
+        return [pos]
+    return clips_timestamps[pos - 1]
+
+
+def for_target(videos, target):
+    """
+    Restrict the data of the videos to the timestamps of one of the extracted words,
+    and to the clips covering them
+    """
+    target_videos = []
+    for video in videos:
+        video_data = video.get("data", None)
+        if video_data is None:
+            target_videos.append(video)
+            continue
+
+        timestamps = video_data.get("timestamps", [])
+        target_positions = video_data.get("targets", {}).get(target, [])
+        new_positions = {position: i + 1 for i, position in enumerate(target_positions)}
+        target_data = {**video_data, "timestamps": [timestamps[position - 1] for position in target_positions]}
+
+        if "clips" in video_data:
+            target_data["clips"], target_data["clips_timestamps"] = [], []
+            for pos, clip in enumerate(video_data["clips"], start=1):
+                positions = [new_positions[p] for p in timestamps_positions(video, pos) if p in new_positions]
+                if len(positions) > 0:
+                    target_data["clips"].append(clip)
+                    target_data["clips_timestamps"].append(positions)
+
+        target_videos.append({**video, "data": target_data})
+    return target_videos
+
+
 def list_for(videos, filter_videos_ids=None, filter_out_videos_ids=None, var="clips"):
     if filter_videos_ids is None:
         filter_videos_ids = []
@@ -16,5 +55,6 @@ def list_for(videos, filter_videos_ids=None, filter_out_videos_ids=None, var="cl
         values = video.get("data", {}).get(var, [])
 
         for i, value in enumerate(values):
-            counter += 1
+            # A clip can cover multiple timestamps, the counter being the one of its last timestamp
+            counter += len(timestamps_positions(video, i + 1)) if var == "clips" else 1
             yield video, value, i + 1, counter
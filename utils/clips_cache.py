@@ -0,0 +1,79 @@
+import hashlib
+import json
+import os
+
+from utils import io, ffmpeg
+
+
+def _manifest_path(folder):
+    return os.path.join(folder, "manifest.yaml")
+
+
+def _checksum(file_path):
+    sha1 = hashlib.sha1()
+    with open(file_path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            sha1.update(chunk)
+    return sha1.hexdigest()
+
+
+def key(params):
+    """
+    Key of a clip, computed from every parameter used to cut it
+    """
+    return hashlib.sha1(json.dumps(params, sort_keys=True).encode("utf8")).hexdigest()[:16]
+
+
+def path(folder, clip_key):
+    return os.path.join(folder, f"{clip_key}.mp4")
+
+
+def load(folder):
+    return io.load_yaml(_manifest_path(folder)) or {}
+
+
+def save(folder, manifest):
+    io.dump_yaml(_manifest_path(folder), manifest)
+
+
+def is_valid(manifest, folder, clip_key, verify_checksum=False):
+    """
+    Check the clip was completely written, comparing its size
+    (and checksum if asked) to the ones recorded in the manifest
+    """
+    entry = manifest.get(clip_key, None)
+    clip_path = path(folder, clip_key)
+    if entry is None or not os.path.exists(clip_path):
+        return False
+    if os.path.getsize(clip_path) != entry["size"]:
+        return False
+    return not verify_checksum or _checksum(clip_path) == entry["checksum"]
+
+
+def add(manifest, folder, clip_key, params):
+    clip_path = path(folder, clip_key)
+    infos = ffmpeg.probe(clip_path)
+    manifest[clip_key] = {
+        "size": os.path.getsize(clip_path),
+        "duration": infos["duration"],
+        "checksum": _checksum(clip_path),
+        "params": params,
+        # Streams information, so that building the clips together does not probe them again
+        "infos": infos,
+    }
+
+
+def probe(file_path, manifests=None):
+    """
+    Get the streams information of a file, as recorded in the manifest of its folder if it is a cached clip
+    (manifests being kept by folder in the given dictionary, so that each one is only loaded once)
+    """
+    manifests = {} if manifests is None else manifests
+    folder = os.path.dirname(file_path)
+    if folder not in manifests:
+        manifests[folder] = load(folder)
+
+    clip_key = os.path.basename(file_path)[: -len(".mp4")]
+    if is_valid(manifests[folder], folder, clip_key) and "infos" in manifests[folder][clip_key]:
+        return manifests[folder][clip_key]["infos"]
+    return ffmpeg.probe(file_path)
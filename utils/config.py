@@ -1,16 +1,23 @@
 from configparser import ConfigParser
 
 
-def read(file, section, config_class):
+def read_args(file, section):
+    """
+    Read the values of the "all" section, overridden by the ones of the given section
+    """
     parser = ConfigParser()
     parser.read(file)
 
     args = {}
-    for s in parser.sections():
-        if s in ["all", section]:
+    for s in ["all", section]:
+        if s in parser:
             for key in parser[s]:
                 args[key] = parser[s][key]
 
-    config = config_class(**args)
+    return args
+
+
+def read(file, section, config_class):
+    config = config_class(**read_args(file, section))
 
     return config
@@ -25,3 +25,17 @@ def sec_to_str(sec):
 
 def str_to_bool(s):
     return s.lower() in ["true", "1", "yes"]
+
+
+def str_to_ms(timestamp):
+    """
+    format: HH:mm:ss.xxx
+    """
+    return round(str_to_sec(timestamp) * 1000)
+
+
+def ms_to_str(ms):
+    """
+    format: HH:mm:ss.xxx
+    """
+    return f"{ms // 3600000:02d}:{ms // 60000 % 60:02d}:{ms // 1000 % 60:02d}.{ms % 1000:03d}"
@@ -0,0 +1,88 @@
+import os
+import threading
+import time
+
+from utils import logger
+
+_caches = {}
+_caches_lock = threading.Lock()
+
+
+class DownloadsCache:
+    """
+    Downloaded files kept on disk up to a maximum size, the least recently
+    used ones being removed first. The modification time of the files is used
+    as their last access time, so that it is kept from one run to another.
+    """
+
+    def __init__(self, folder, max_size):
+        self.folder = folder
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._pins = {}
+        self._lock = threading.Lock()
+
+    def lookup(self, file_path):
+        with self._lock:
+            if os.path.exists(file_path):
+                self.hits += 1
+                os.utime(file_path, (time.time(), time.time()))
+                return True
+            self.misses += 1
+            return False
+
+    def touch(self, file_path):
+        with self._lock:
+            if os.path.exists(file_path):
+                os.utime(file_path, (time.time(), time.time()))
+
+    def pin(self, video_id):
+        """
+        Prevent the files of a video being used from being removed
+        """
+        with self._lock:
+            self._pins[video_id] = self._pins.get(video_id, 0) + 1
+
+    def unpin(self, video_id):
+        with self._lock:
+            self._pins[video_id] -= 1
+            if self._pins[video_id] == 0:
+                del self._pins[video_id]
+
+    def _is_pinned(self, file_name):
+        return any(file_name.startswith(f"{video_id}.") for video_id in self._pins)
+
+    def evict(self):
+        with self._lock:
+            if not os.path.exists(self.folder):
+                return
+
+            files = []
+            for entry in os.scandir(self.folder):
+                if entry.is_file():
+                    stat = entry.stat()
+                    files.append((stat.st_mtime, stat.st_size, entry.name, entry.path))
+
+            total_size = sum(size for _, size, _, _ in files)
+            for _, size, file_name, file_path in sorted(files):
+                if total_size <= self.max_size:
+                    break
+                if self._is_pinned(file_name):
+                    continue
+                try:
+                    logger.info(f"Evict '{file_name}' from downloads cache")
+                    os.remove(file_path)
+                    total_size -= size
+                except OSError as e:
+                    logger.error(f"Unable to evict file: {e}")
+
+
+def get(folder, max_size):
+    """
+    Get the cache of a folder, shared by every thread
+    """
+    with _caches_lock:
+        if folder not in _caches:
+            _caches[folder] = DownloadsCache(folder, max_size)
+        return _caches[folder]
@@ -1,43 +1,133 @@
+import functools
 import html
 
 import moviepy.video.fx.all as vfx
-from moviepy.video.VideoClip import TextClip
-from moviepy.video.compositing.CompositeVideoClip import CompositeVideoClip
+import numpy as np
+from PIL import Image, ImageDraw, ImageFont
+
+from utils import clips
+
+# Monospaced, so that the counters stay aligned
+_font_name = "DejaVuSansMono.ttf"
+_font_size = 24
+_line_spacing = 4
+_padding = 2
+_text_color = (0, 0, 0)
+_background_color = (255, 255, 255)
+
+# Longest timestamp expected, used to size the title block once for every clip of a video
+_timestamp_placeholder = "00:00:00.000"
+
+
+@functools.lru_cache(maxsize=None)
+def _font():
+    # Loaded once, the font keeps its rendered glyphs cached
+    try:
+        return ImageFont.truetype(_font_name, _font_size)
+    except OSError:
+        return ImageFont.load_default()
+
+
+def _text_width(text):
+    return _font().getbbox(text)[2]
+
+
+def _line_height():
+    return _font().getbbox("Ay")[3] + _line_spacing
+
+
+def _text_block(lines, min_width=0):
+    """
+    Render lines of text on an opaque background, aligned to the left
+    """
+    width = max([min_width, *(_text_width(line) for line in lines)]) + 2 * _padding
+    height = len(lines) * _line_height() + 2 * _padding
+    image = Image.new("RGB", (width, height), _background_color)
+    draw = ImageDraw.Draw(image)
+    for i, line in enumerate(lines):
+        draw.text((_padding, _padding + i * _line_height()), line, font=_font(), fill=_text_color)
+    return image
+
+
+@functools.lru_cache(maxsize=64)
+def _title_block(video_id, video_title, video_published_at):
+    """
+    Part of the title block shared by every clip of a video,
+    leaving the timestamp value to be drawn for every clip
+    """
+    lines = [video_title, f"https://youtube.com/watch?v={video_id}", "Timestamp: ", f"Date: {video_published_at}"]
+    return _text_block(lines, min_width=_text_width(f"Timestamp: {_timestamp_placeholder}"))
+
+
+def _clip_title_block(video_id, video_title, video_published_at, start):
+    block = _title_block(video_id, video_title, video_published_at)
+    x = _padding + _text_width("Timestamp: ")
+    y = _padding + 2 * _line_height()
+    width = max(block.width, x + _text_width(start) + _padding)
+
+    image = Image.new("RGB", (width, block.height), _background_color)
+    image.paste(block, (0, 0))
+    ImageDraw.Draw(image).text((x, y), start, font=_font(), fill=_text_color)
+    return image
+
+
+def _overlay(width, height, title_image, counter_image):
+    """
+    Pre-blend the text blocks into a single image of the size of the frames, returning
+    the top left corner of the part they cover, its pixels and the mask of the opaque ones
+    """
+    image = Image.new("RGBA", (width, height), (0, 0, 0, 0))
+    image.paste(title_image, (0, height - title_image.height))
+    image.paste(counter_image, (0, 0))
+    x0, y0, x1, y1 = image.getchannel("A").getbbox()
+    pixels = np.array(image.crop((x0, y0, x1, y1)))
+    return (x0, y0), np.ascontiguousarray(pixels[:, :, :3]), pixels[:, :, 3:] > 0
+
+
+def _apply_overlay(width, height, overlay):
+    (x, y), pixels, mask = overlay
+    overlay_height, overlay_width = mask.shape[:2]
+
+    def apply(frame):
+        # Frames smaller than the size are put on a black background, as a composition would
+        if frame.shape[:2] != (height, width):
+            background = np.zeros((height, width, 3), dtype=np.uint8)
+            frame_height, frame_width = min(height, frame.shape[0]), min(width, frame.shape[1])
+            background[:frame_height, :frame_width] = frame[:frame_height, :frame_width]
+            frame = background
+        else:
+            frame = frame.copy()
+        np.copyto(frame[y : y + overlay_height, x : x + overlay_width], pixels, where=mask)
+        return frame
+
+    return apply
 
 
 def add_info_overlay(clip, size, video, pos, counter, total):
     video_id = video["id"]["videoId"]
     video_title = html.unescape(video["snippet"]["title"])
     video_published_at = video["snippet"]["publishedAt"]
-    start, _, end = video["data"]["timestamps"][pos - 1]
-    episode_counter = str(pos)
-    aligned_counter = str(counter).rjust(len(str(total)))
+    # The clip might cover multiple timestamps
+    positions = clips.timestamps_positions(video, pos)
+    start, _, end = video["data"]["timestamps"][positions[0] - 1]
+    episode_counter = ", ".join(str(position) for position in positions)
+    # Without total, the counter is not aligned to it nor followed by it
+    total_log = "" if total is None else f"/{total}"
+    counter_width = 0 if total is None else len(str(total))
+    aligned_counter = str(counter).rjust(counter_width)
+    if len(positions) > 1:
+        aligned_counter = f"{str(counter - len(positions) + 1).rjust(counter_width)}-{counter}"
     width, height = map(int, size.split("x"))
 
-    clip_text_title = (
-        TextClip(
-            txt=f"{video_title}\nhttps://youtube.com/watch?v={video_id}\nTimestamp: {start}\nDate: {video_published_at}",
-            fontsize=24,
-            color="black",
-            bg_color="white",
-            align="west",
-        )
-        .set_duration(clip.duration)
-        .set_position(("left", "bottom"))
-    )
-    clip_text_counter = (
-        TextClip(
-            txt=f"Episode counter: {episode_counter}\nTotal counter  : {aligned_counter}/{total}",
-            fontsize=24,
-            color="black",
-            bg_color="white",
-            align="west",
-        )
-        .set_duration(clip.duration)
-        .set_position(("left", "top"))
-    )
+    title_image = _clip_title_block(video_id, video_title, video_published_at, start)
+    counter_lines = [f"Episode counter: {episode_counter}", f"Total counter  : {aligned_counter}{total_log}"]
+    counter_image = _text_block(counter_lines)
 
     if clip.size != [width, height]:
         clip = clip.fx(vfx.resize, width=width)
 
-    return CompositeVideoClip([clip, clip_text_title, clip_text_counter], size=(width, height))
+    # Text blocks are opaque, so their pixels are copied over every frame without any blending
+    overlay = _overlay(width, height, title_image, counter_image)
+    overlay_clip = clip.fl_image(_apply_overlay(width, height, overlay))
+    overlay_clip.size = [width, height]
+    return overlay_clip
@@ -0,0 +1,83 @@
+import os
+import time
+from contextlib import contextmanager
+
+from utils import logger, ffmpeg
+
+# Encoding statistics of every profile, as measured by this process
+_stats = {}
+
+
+def moviepy_params(profile, ffmpeg_params=None):
+    """
+    Parameters of the MoviePy writing functions matching the profile
+    """
+    return {
+        "codec": profile.get("codec", "libx264"),
+        "bitrate": profile.get("bitrate", None),
+        "preset": profile.get("preset", "medium"),
+        "audio_codec": profile.get("audio_codec", "aac"),
+        "audio_bitrate": profile.get("audio_bitrate", "192k"),
+        "ffmpeg_params": ffmpeg.quality_args(profile) + (ffmpeg_params or []),
+    }
+
+
+def temp_audiofile(file_path, profile):
+    """
+    Path of the temporary audio file MoviePy writes along the file,
+    its extension needing to match the audio codec
+    """
+    extension = ".mp3" if profile.get("audio_codec", "aac") == "libmp3lame" else ".m4a"
+    return file_path.replace(".mp4", extension)
+
+
+def _size_log(size):
+    return f"{size / (1024 * 1024):.1f} MB"
+
+
+def _add(profile_name, stats):
+    profile_stats = _stats.setdefault(profile_name, {"frames": 0, "seconds": 0.0, "size": 0})
+    for key, value in stats.items():
+        profile_stats[key] += value
+
+
+@contextmanager
+def measure(profile_name, files_paths, start=None):
+    """
+    Measure the time spent to encode the files (since start if given),
+    and their amount of frames and size once written
+    """
+    start = start or time.time()
+    yield
+    seconds = time.time() - start
+
+    frames, size = 0, 0
+    for file_path in files_paths:
+        infos = ffmpeg.probe(file_path)
+        frames += round((infos["duration"] or 0) * (infos["fps"] or 0))
+        size += os.path.getsize(file_path)
+
+    _add(profile_name, {"frames": frames, "seconds": seconds, "size": size})
+    fps = frames / seconds if seconds > 0 else 0
+    logger.debug(f"Encoded {frames} frames at {fps:.1f} fps ({_size_log(size)}) with '{profile_name}' profile")
+
+
+def pop_stats():
+    """
+    Get and reset the statistics, to be merged in another process
+    """
+    stats = {profile_name: dict(profile_stats) for profile_name, profile_stats in _stats.items()}
+    _stats.clear()
+    return stats
+
+
+def merge_stats(stats):
+    for profile_name, profile_stats in stats.items():
+        _add(profile_name, profile_stats)
+
+
+def log_stats():
+    for profile_name, profile_stats in sorted(_stats.items()):
+        frames, seconds, size = profile_stats["frames"], profile_stats["seconds"], profile_stats["size"]
+        fps = frames / seconds if seconds > 0 else 0
+        logger.info(f"Encoding profile '{profile_name}': {frames} frames at {fps:.1f} fps, {_size_log(size)}")
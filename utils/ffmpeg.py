@@ -0,0 +1,484 @@
+import os
+import re
+import shutil
+import subprocess as sp
+import tempfile
+
+from moviepy.config import get_setting
+
+from utils import logger
+
+# Encoders able to produce streams compatible with the ones
+# we download, so that re-encoded parts can be stream copied along
+_encoders = {
+    "h264": "libx264",
+    "hevc": "libx265",
+    "vp9": "libvpx-vp9",
+}
+
+# Names the encoders give to the profiles ffmpeg reports, so that re-encoded parts use the profile of the source
+_encoders_profiles = {
+    "h264": {
+        "Constrained Baseline": "baseline",
+        "Baseline": "baseline",
+        "Main": "main",
+        "High": "high",
+        "High 10": "high10",
+        "High 4:2:2": "high422",
+        "High 4:4:4 Predictive": "high444",
+    },
+    "hevc": {"Main": "main", "Main 10": "main10"},
+    "vp9": {"Profile 0": "0", "Profile 1": "1", "Profile 2": "2", "Profile 3": "3"},
+}
+
+
+# Samples of every AAC frame, the streams of ffmpeg's encoder also starting with a frame of priming
+aac_frame_samples = 1024
+
+# Seeking times are only parsed to the microsecond, so seeks to a keyframe are moved
+# this amount of seconds past it (far less than a frame), not to land on the previous one
+_seek_margin = 0.001
+
+# Profile used when none is given
+_default_profile = {"codec": "libx264", "bitrate": "20000k", "audio_codec": "aac", "audio_bitrate": "2000k"}
+
+
+def _binary():
+    return get_setting("FFMPEG_BINARY")
+
+
+def _run(args, log_level="error"):
+    cmd = [_binary(), "-hide_banner", "-nostdin", "-loglevel", log_level, *args]
+    logger.debug(f"Run '{' '.join(cmd)}'")
+    proc = sp.run(cmd, stdout=sp.DEVNULL, stderr=sp.PIPE)
+    return proc.returncode, proc.stderr.decode("utf8", errors="ignore")
+
+
+def run(args):
+    returncode, stderr = _run(["-y", *args])
+    if returncode != 0:
+        raise IOError(f"ffmpeg error: {stderr.strip()}")
+
+
+def probe(file_path):
+    # Without output file, ffmpeg fails but still prints the streams information
+    _, stderr = _run(["-i", file_path], log_level="info")
+
+    infos = {
+        "duration": None,
+        "video_codec": None,
+        "video_profile": None,
+        "width": None,
+        "height": None,
+        "pix_fmt": None,
+        "fps": None,
+        "audio_codec": None,
+        "audio_rate": None,
+        "audio_channels": None,
+    }
+
+    match = re.search(r"Duration: (\d+):(\d+):(\d+\.\d+)", stderr)
+    if match:
+        hours, minutes, seconds = match.groups()
+        infos["duration"] = int(hours) * 3600 + int(minutes) * 60 + float(seconds)
+
+    match = re.search(r"Stream #\S+: Video: (\w+)[^,]*, (\w+)[^,]*(?:\([^)]*\))?, (\d+)x(\d+)", stderr)
+    if match:
+        infos["video_codec"], infos["pix_fmt"] = match.group(1), match.group(2)
+        infos["width"], infos["height"] = int(match.group(3)), int(match.group(4))
+
+    match = re.search(r"Stream #\S+: Video: \w+ \(([^)]+)\)", stderr)
+    if match:
+        infos["video_profile"] = match.group(1)
+
+    match = re.search(r"Stream #\S+: Video: .*?, ([\d.]+) fps", stderr)
+    if match:
+        infos["fps"] = float(match.group(1))
+
+    match = re.search(r"Stream #\S+: Audio: (\w+)[^,]*, (\d+) Hz, ([^,]+)", stderr)
+    if match:
+        infos["audio_codec"], infos["audio_rate"] = match.group(1), int(match.group(2))
+        infos["audio_channels"] = {"mono": 1, "stereo": 2}.get(match.group(3).strip(), 2)
+
+    return infos
+
+
+def keyframes(file_path, start=None, duration=None):
+    """
+    List the timestamps (in seconds) of the keyframes,
+    only decoding the keyframes themselves
+    """
+    args = ["-skip_frame", "nokey", "-copyts"]
+    if start is not None:
+        args += ["-ss", str(max(0.0, start))]
+    if duration is not None:
+        args += ["-t", str(duration)]
+    args += ["-i", file_path, "-map", "0:v:0", "-vf", "showinfo", "-f", "null", "-"]
+
+    returncode, stderr = _run(args, log_level="info")
+    if returncode != 0:
+        raise IOError(f"ffmpeg error: {stderr.strip()}")
+
+    # The printed times are rounded, so they are computed from the timestamps and their time base
+    match = re.search(r"config in time_base: (\d+)/(\d+)", stderr)
+    if match is None:
+        return [float(t) for t in re.findall(r"pts_time:\s*([\d.]+)", stderr)]
+    time_base = int(match.group(1)) / int(match.group(2))
+    return [int(pts) * time_base for pts in re.findall(r"\bpts:\s*(-?\d+)\s+pts_time:", stderr)]
+
+
+def normalization(resolution, fps, audio_rate):
+    """
+    Format every clip is normalized to, so that later stages can consider them uniform
+    """
+    width, height = map(int, resolution.split("x"))
+    return {"width": width, "height": height, "fps": fps, "audio_rate": audio_rate}
+
+
+def video_filters(normalize):
+    if normalize is None:
+        return ""
+    width, height = normalize["width"], normalize["height"]
+    return (
+        f"scale={width}:{height}:force_original_aspect_ratio=decrease,"
+        f"pad={width}:{height}:(ow-iw)/2:(oh-ih)/2,setsar=1,"
+        f"fps={normalize['fps']},format=yuv420p"
+    )
+
+
+def audio_filters(normalize):
+    if normalize is None:
+        return ""
+    return f"aresample={normalize['audio_rate']},aformat=channel_layouts=stereo"
+
+
+def _is_normalized(infos, normalize):
+    return (
+        infos["width"] == normalize["width"]
+        and infos["height"] == normalize["height"]
+        and infos["fps"] == normalize["fps"]
+        and infos["pix_fmt"] == "yuv420p"
+        and infos["audio_rate"] in [None, normalize["audio_rate"]]
+        and infos["audio_channels"] in [None, 2]
+    )
+
+
+def quality_args(profile):
+    """
+    Arguments of the profile other than the video codec, bitrate and preset
+    """
+    args = []
+    if profile.get("crf", None) is not None:
+        args += ["-crf", str(profile["crf"])]
+    if profile.get("pix_fmt", None) is not None:
+        args += ["-pix_fmt", profile["pix_fmt"]]
+    if profile.get("keyframe_interval", None) is not None:
+        args += ["-g", str(profile["keyframe_interval"])]
+    return args
+
+
+def video_args(profile, codec=None):
+    """
+    Encoding arguments of the video stream, the codec of the profile being replaced by the given one if any
+    """
+    args = ["-c:v", codec or profile.get("codec", "libx264")]
+    if profile.get("bitrate", None) is not None:
+        args += ["-b:v", profile["bitrate"]]
+    if profile.get("preset", None) is not None:
+        args += ["-preset", profile["preset"]]
+    return args + quality_args(profile)
+
+
+def audio_args(profile, codec=None):
+    return ["-c:a", codec or profile.get("audio_codec", "aac"), "-b:a", profile.get("audio_bitrate", "192k")]
+
+
+def signature(infos):
+    """
+    Properties two files need to share to be concatenated by stream copy
+    """
+    keys = ["video_codec", "width", "height", "pix_fmt", "fps", "audio_codec", "audio_rate", "audio_channels"]
+    return tuple(infos[key] for key in keys)
+
+
+def conform(src_path, dst_path, infos, profile=None, threads=1):
+    """
+    Re-encode the file so that it shares the signature of the given infos
+    """
+    normalize = {"width": infos["width"], "height": infos["height"], "fps": infos["fps"]}
+    profile = profile or _default_profile
+    args = ["-i", src_path, "-vf", video_filters(normalize).replace("yuv420p", infos["pix_fmt"])]
+    args += [*video_args(profile, _encoders.get(infos["video_codec"], "libx264")), "-pix_fmt", infos["pix_fmt"]]
+    if infos["audio_codec"] is not None:
+        args += [*audio_args(profile, "aac"), "-ar", str(infos["audio_rate"])]
+        args += ["-ac", str(infos["audio_channels"])]
+    else:
+        args += ["-an"]
+    run([*args, "-threads", str(threads), dst_path])
+
+
+def cut(src_path, dst_path, start, end, profile=None, threads=1, normalize=None):
+    start = max(0.0, start)
+    profile = profile or _default_profile
+    args = ["-ss", str(start), "-i", src_path, "-t", str(end - start)]
+    if normalize is not None:
+        args += ["-vf", video_filters(normalize), "-af", audio_filters(normalize)]
+    args += [*video_args(profile), *audio_args(profile)]
+    run([*args, "-threads", str(threads), dst_path])
+
+
+def _encoder_profile(infos):
+    return _encoders_profiles.get(infos["video_codec"], {}).get(infos["video_profile"], None)
+
+
+def _stream_format(infos):
+    """
+    Properties of a video stream that re-encoded parts need to share with it to be played along
+    """
+    return infos["video_codec"], _encoder_profile(infos), infos["width"], infos["height"], infos["pix_fmt"]
+
+
+def _encode_part(src_path, dst_path, start, end, infos, profile, threads):
+    # The parts need to match the copied source stream, whatever the profile
+    args = ["-ss", str(start), "-i", src_path, "-t", str(end - start), "-an"]
+    args += [*video_args(profile, _encoders[infos["video_codec"]]), "-threads", str(threads)]
+    args += ["-profile:v", _encoder_profile(infos)]
+    if infos["pix_fmt"] is not None:
+        args += ["-pix_fmt", infos["pix_fmt"]]
+    run([*args, "-f", "mpegts", dst_path])
+
+
+def _copy_part(src_path, dst_path, start, end):
+    """
+    Copy the GOPs from the keyframe at start to the keyframe at end (excluded)
+    """
+    # Copied packets are shifted by the seek margin, so the margin is taken twice out of the duration
+    args = ["-ss", str(start + _seek_margin), "-i", src_path, "-t", str(end - start - 2 * _seek_margin)]
+    run([*args, "-an", "-c", "copy", "-f", "mpegts", dst_path])
+
+
+def _encode_audio(src_path, dst_path, start, end, infos, profile):
+    args = ["-ss", str(start), "-i", src_path, "-t", str(end - start), "-vn", *audio_args(profile, "aac")]
+    run([*args, "-ar", str(infos["audio_rate"]), "-ac", str(infos["audio_channels"]), dst_path])
+
+
+def concat(parts_paths, dst_path):
+    list_file_path = f"{dst_path}.ffconcat"
+    with open(list_file_path, "w", encoding="utf8") as f:
+        f.write("ffconcat version 1.0\n")
+        for part_path in parts_paths:
+            escaped_path = os.path.abspath(part_path).replace("'", r"'\''")
+            f.write(f"file '{escaped_path}'\n")
+
+    try:
+        args = ["-f", "concat", "-safe", "0", "-i", list_file_path, "-c", "copy", "-bsf:a", "aac_adtstoasc"]
+        run([*args, "-movflags", "+faststart", dst_path])
+    finally:
+        os.remove(list_file_path)
+
+
+def mux(video_path, audio_path, dst_path, ts_offset=None, audio_offset=None):
+    """
+    Put together the video stream of a file and the audio stream of another, without re-encoding them
+    (their timestamps being shifted by ts_offset seconds if given, and the audio ones by audio_offset more)
+    """
+    args = ["-i", video_path]
+    if audio_offset is not None:
+        args += ["-itsoffset", str(audio_offset)]
+    args += ["-i", audio_path, "-map", "0:v:0", "-map", "1:a:0", "-c", "copy"]
+    if ts_offset is not None:
+        args += ["-output_ts_offset", str(ts_offset)]
+    if dst_path.endswith(".mp4"):
+        args += ["-movflags", "+faststart"]
+    run([*args, dst_path])
+
+
+def keep_adts_frames(file_path, start, count):
+    """
+    Only keep count frames of a raw AAC (ADTS) file, from the frame at index start
+    """
+    with open(file_path, "rb") as f:
+        data = f.read()
+
+    frames = []
+    offset = 0
+    while offset < len(data):
+        # Every frame starts with a 7 bytes header holding its size
+        header = data[offset : offset + 7]
+        frame_size = 0
+        if len(header) == 7 and header[0] == 0xFF and header[1] & 0xF0 == 0xF0:
+            frame_size = ((header[3] & 0x03) << 11) | (header[4] << 3) | (header[5] >> 5)
+        if frame_size < 7:
+            raise IOError(f"Invalid ADTS frame at offset {offset} of '{file_path}'")
+        frames.append(data[offset : offset + frame_size])
+        offset += frame_size
+
+    with open(file_path, "wb") as f:
+        f.write(b"".join(frames[start : start + count]))
+
+
+def _renditions_args(renditions, fps, profile, threads, output_args=()):
+    """
+    Arguments splitting the frames of the first input towards the encoder of every (dst_path, width, height) rendition
+    """
+    filters = [f"[0:v]split={len(renditions)}" + "".join(f"[v{i}]" for i in range(len(renditions)))]
+    outputs = []
+    for i, (dst_path, rendition_width, rendition_height) in enumerate(renditions):
+        scale = video_filters({"width": rendition_width, "height": rendition_height, "fps": fps})
+        filters.append(f"[v{i}]{scale}[vo{i}]")
+        outputs += ["-map", f"[vo{i}]", *output_args, *video_args(profile), "-threads", str(threads), dst_path]
+    return ["-filter_complex", ";".join(filters), *outputs]
+
+
+def renditions(src_path, renditions, fps, profile=None, threads=1):
+    """
+    Write the video in every (dst_path, width, height) rendition from a single decode, the audio being copied
+    """
+    profile = profile or _default_profile
+    output_args = ["-map", "0:a?", "-c:a", "copy", "-movflags", "+faststart"]
+    run(["-i", src_path, *_renditions_args(renditions, fps, profile, threads, output_args)])
+
+
+class RenditionsWriter:
+    """
+    Encode raw RGB frames, written one at a time, into several files at once,
+    every frame being decoded once then split and scaled for every rendition
+    """
+
+    def __init__(self, renditions, size, fps, profile=None, threads=1):
+        """
+        :param renditions: list of (dst_path, width, height) of the files to write
+        :param size: (width, height) of the written frames
+        """
+        profile = profile or _default_profile
+        width, height = size
+
+        args = ["-f", "rawvideo", "-pix_fmt", "rgb24", "-s", f"{width}x{height}", "-r", str(fps), "-i", "-"]
+        args += _renditions_args(renditions, fps, profile, threads)
+
+        # Frames are read from the standard input, and errors are kept aside not to fill a pipe nobody reads
+        cmd = [_binary(), "-hide_banner", "-loglevel", "error", "-y", *args]
+        logger.debug(f"Run '{' '.join(cmd)}'")
+        self.stderr = tempfile.TemporaryFile()
+        self.proc = sp.Popen(cmd, stdin=sp.PIPE, stdout=sp.DEVNULL, stderr=self.stderr)
+
+    def _error(self):
+        self.stderr.seek(0)
+        return IOError(f"ffmpeg error: {self.stderr.read().decode('utf8', errors='ignore').strip()}")
+
+    def write_frame(self, frame):
+        try:
+            self.proc.stdin.write(frame.tobytes())
+        except BrokenPipeError:
+            self.proc.wait()
+            raise self._error()
+
+    def close(self):
+        try:
+            self.proc.stdin.close()
+        except BrokenPipeError:
+            pass
+        returncode = self.proc.wait()
+        try:
+            if returncode != 0:
+                raise self._error()
+        finally:
+            self.stderr.close()
+
+
+def smart_cut(src_path, dst_path, start, end, profile=None, threads=1, normalize=None):
+    """
+    Stream copy the GOPs fully inside [start, end]
+    and only re-encode the partial GOPs on the edges
+
+        start  key        key    end
+          |-----|----------|------|
+          encode    copy    encode
+
+    The audio is encoded in one go, as every encoded part would start with encoder priming
+    """
+    start = max(0.0, start)
+    infos = probe(src_path)
+    frames = [t for t in keyframes(src_path, start, end - start) if start <= t <= end]
+
+    # Nothing to copy or unable to match the source codecs, fallback to a full re-encode
+    if len(frames) < 2 or _encoder_profile(infos) is None:
+        logger.debug("Unable to smart cut, re-encode whole clip")
+        return cut(src_path, dst_path, start, end, profile, threads, normalize)
+
+    # Copied GOPs can not be normalized, so the source needs to already be
+    if normalize is not None and not _is_normalized(infos, normalize):
+        logger.debug("Source is not normalized, re-encode whole clip")
+        return cut(src_path, dst_path, start, end, profile, threads, normalize)
+
+    profile = profile or _default_profile
+    first_key, last_key = frames[0], frames[-1]
+    parts_folder = f"{dst_path}.parts"
+    os.makedirs(parts_folder, exist_ok=True)
+
+    try:
+        head_parts, tail_parts = [], []
+        if first_key > start:
+            head_parts.append(os.path.join(parts_folder, "head.ts"))
+            _encode_part(src_path, head_parts[0], start, first_key - _seek_margin, infos, profile, threads)
+        if end > last_key:
+            tail_parts.append(os.path.join(parts_folder, "tail.ts"))
+            _encode_part(src_path, tail_parts[0], last_key, end, infos, profile, threads)
+
+        # The encoder may not reproduce the stream of the source (its profile or format),
+        # which players do not expect to change in the middle of a file
+        if any(_stream_format(probe(part_path)) != _stream_format(infos) for part_path in head_parts + tail_parts):
+            logger.debug("Re-encoded edges do not match the source stream, re-encode whole clip")
+            return cut(src_path, dst_path, start, end, profile, threads, normalize)
+
+        middle_path = os.path.join(parts_folder, "middle.ts")
+        _copy_part(src_path, middle_path, first_key, last_key)
+        parts = [*head_parts, middle_path, *tail_parts]
+        if infos["audio_codec"] is None:
+            concat(parts, dst_path)
+        else:
+            video_path, audio_path = os.path.join(parts_folder, "video.mp4"), os.path.join(parts_folder, "audio.m4a")
+            concat(parts, video_path)
+            _encode_audio(src_path, audio_path, start, end, infos, profile)
+            mux(video_path, audio_path, dst_path)
+    finally:
+        shutil.rmtree(parts_folder, ignore_errors=True)
+
+
+def cut_many(src_path, windows, profile=None, threads=1, normalize=None):
+    """
+    Cut every (start, end, dst_path) window in a single sequential decode of the source,
+    the decoded frames being split and trimmed towards one encoder per window
+    """
+    windows = sorted((max(0.0, start), end, dst_path) for start, end, dst_path in windows)
+    if len(windows) == 0:
+        return
+
+    profile = profile or _default_profile
+    has_audio = probe(src_path)["audio_codec"] is not None
+
+    # Only decode the part of the source covering the windows
+    seek = windows[0][0]
+    duration = max(end for _, end, _ in windows) - seek
+
+    filters = [f"[0:v]split={len(windows)}" + "".join(f"[v{i}]" for i in range(len(windows)))]
+    if has_audio:
+        filters.append(f"[0:a]asplit={len(windows)}" + "".join(f"[a{i}]" for i in range(len(windows))))
+
+    # Only normalize the trimmed frames, not every decoded one
+    normalize_video = "," + video_filters(normalize) if normalize is not None else ""
+    normalize_audio = "," + audio_filters(normalize) if normalize is not None else ""
+
+    outputs = []
+    for i, (start, end, dst_path) in enumerate(windows):
+        trim = f"trim=start={start - seek}:end={end - seek},setpts=PTS-STARTPTS"
+        filters.append(f"[v{i}]{trim}{normalize_video}[vo{i}]")
+        outputs += ["-map", f"[vo{i}]", *video_args(profile)]
+        if has_audio:
+            atrim = f"atrim=start={start - seek}:end={end - seek},asetpts=PTS-STARTPTS"
+            filters.append(f"[a{i}]{atrim}{normalize_audio}[ao{i}]")
+            outputs += ["-map", f"[ao{i}]", *audio_args(profile)]
+        outputs += ["-threads", str(threads), dst_path]
+
+    args = ["-ss", str(seek), "-t", str(duration), "-i", src_path, "-filter_complex", ";".join(filters)]
+    run([*args, *outputs])
@@ -15,7 +15,8 @@ def dump_yaml(file_path, data):
     folder_path = os.path.dirname(file_path)
     os.makedirs(folder_path, exist_ok=True)
 
-    # TODO: If file already exists, dump aside then move
-    #       to prevent data loss (example: when using ctrl+c)
-    with open(file_path, "w", encoding="utf8") as f:
+    # Dump aside then move, to prevent data loss (example: when using ctrl+c)
+    temp_file_path = f"{file_path}.tmp"
+    with open(temp_file_path, "w", encoding="utf8") as f:
         f.write(yaml.dump(data))
+    os.replace(temp_file_path, file_path)
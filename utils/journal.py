@@ -0,0 +1,78 @@
+import json
+import os
+
+
+class Journal:
+    """
+    Append-only log of JSON records, one per line
+
+    Records are flushed as soon as they are appended and synced to the disk by
+    batches, so that appending one costs the same whatever the size of the log.
+    A record interrupted while being written is dropped when the log is opened
+    again, the previous ones being left untouched.
+    """
+
+    def __init__(self, file_path, sync_interval=1):
+        self.file_path = file_path
+        self.sync_interval = max(1, sync_interval)
+        self.pending_records = 0
+        self.records = []
+
+        os.makedirs(os.path.dirname(file_path) or ".", exist_ok=True)
+        valid_size = 0
+        if os.path.exists(file_path):
+            with open(file_path, "rb") as f:
+                for line in f:
+                    try:
+                        if not line.endswith(b"\n"):
+                            raise ValueError("Incomplete record")
+                        self.records.append(json.loads(line))
+                    except ValueError:
+                        break
+                    valid_size += len(line)
+
+        self.file = open(file_path, "ab")
+        # Drop the interrupted record, so that the next ones are not appended to it
+        self.file.truncate(valid_size)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def append(self, record):
+        self.file.write(json.dumps(record).encode("utf8") + b"\n")
+        self.file.flush()
+        self.records.append(record)
+
+        self.pending_records += 1
+        if self.pending_records >= self.sync_interval:
+            self.sync()
+
+    def sync(self):
+        if self.pending_records > 0:
+            os.fsync(self.file.fileno())
+            self.pending_records = 0
+
+    def reset(self):
+        """
+        Remove every record
+        """
+        self.file.truncate(0)
+        os.fsync(self.file.fileno())
+        self.pending_records = 0
+        self.records = []
+
+    def close(self):
+        if not self.file.closed:
+            self.sync()
+            self.file.close()
+
+    def remove(self):
+        """
+        Close the log and remove its file, once its records are not needed anymore
+        """
+        self.close()
+        os.remove(self.file_path)
+        self.records = []
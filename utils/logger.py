@@ -14,6 +14,10 @@ def setup(verbose):
     _logger.addHandler(stream_handler)
 
 
+def is_verbose():
+    return _logger.level == logging.DEBUG
+
+
 def info(msg, prefix="> ", *args, **kwargs):
     _logger.info(prefix + msg, *args, **kwargs)
 
@@ -0,0 +1,296 @@
+import struct
+from bisect import bisect_left, bisect_right
+from urllib.request import Request, urlopen
+
+from utils import logger
+
+# Ranges closer than this amount of bytes are fetched with a single request
+_merge_gap = 64 * 1024
+
+
+"""
+HTTP
+"""
+
+
+def _fetch(url, start, end):
+    """
+    Fetch bytes [start, end[ of the url
+    """
+    request = Request(url, headers={"Range": f"bytes={start}-{end - 1}"})
+    with urlopen(request) as response:
+        if response.status != 206:
+            raise IOError(f"Range requests are not supported (status: {response.status})")
+        return response.read()
+
+
+def _fetch_size(url):
+    request = Request(url, headers={"Range": "bytes=0-0"})
+    with urlopen(request) as response:
+        if response.status != 206:
+            raise IOError(f"Range requests are not supported (status: {response.status})")
+        # format: bytes 0-0/<size>
+        return int(response.headers["Content-Range"].split("/")[-1])
+
+
+"""
+Boxes
+"""
+
+
+def _read_box_header(data, offset):
+    size, box_type = struct.unpack_from(">I4s", data, offset)
+    header_size = 8
+    if size == 1:
+        size = struct.unpack_from(">Q", data, offset + 8)[0]
+        header_size = 16
+    return size, box_type, header_size
+
+
+def _iter_boxes(data, start=0, end=None):
+    end = len(data) if end is None else end
+    offset = start
+    while offset + 8 <= end:
+        size, box_type, header_size = _read_box_header(data, offset)
+        if size == 0:
+            size = end - offset
+        yield box_type, offset + header_size, offset + size
+        offset += size
+
+
+def _find_box(data, box_type, start=0, end=None):
+    for child_type, child_start, child_end in _iter_boxes(data, start, end):
+        if child_type == box_type:
+            return child_start, child_end
+    return None
+
+
+def _top_level_boxes(url, size):
+    """
+    List the (type, offset, size, header size) of the top level boxes of the remote file,
+    only fetching their headers
+    """
+    boxes = []
+    offset = 0
+    while offset < size:
+        header = _fetch(url, offset, min(offset + 16, size))
+        box_size, box_type, header_size = _read_box_header(header, 0)
+        if box_size == 0:
+            box_size = size - offset
+        boxes.append((box_type, offset, box_size, header_size))
+        # Fragments are listed by the segment index, no need to walk through all of them
+        if box_type in [b"sidx", b"moof"]:
+            break
+        offset += box_size
+    return boxes
+
+
+"""
+Sample tables
+"""
+
+
+def _full_box_entries(data, start, fmt, count_offset=0):
+    # Skip version and flags
+    count = struct.unpack_from(">I", data, start + 4 + count_offset)[0]
+    entry_size = struct.calcsize(fmt)
+    first = start + 8 + count_offset
+    return [struct.unpack_from(fmt, data, first + i * entry_size) for i in range(count)]
+
+
+def _parse_track(data, start, end):
+    mdia = _find_box(data, b"mdia", start, end)
+    mdhd = _find_box(data, b"mdhd", *mdia)
+    hdlr = _find_box(data, b"hdlr", *mdia)
+    stbl = _find_box(data, b"stbl", *_find_box(data, b"minf", *mdia))
+
+    version = data[mdhd[0]]
+    timescale = struct.unpack_from(">I", data, mdhd[0] + (20 if version == 1 else 12))[0]
+    handler = data[hdlr[0] + 8 : hdlr[0] + 12]
+
+    # Sample timings
+    times = []
+    time = 0
+    for count, delta in _full_box_entries(data, _find_box(data, b"stts", *stbl)[0], ">II"):
+        for _ in range(count):
+            times.append(time / timescale)
+            time += delta
+
+    # Sample sizes
+    stsz = _find_box(data, b"stsz", *stbl)[0]
+    sample_size, sample_count = struct.unpack_from(">II", data, stsz + 4)
+    if sample_size != 0:
+        sizes = [sample_size] * sample_count
+    else:
+        sizes = [size for size, in _full_box_entries(data, stsz, ">I", count_offset=4)]
+
+    # Sample offsets, computed from the chunks offsets and the samples to chunks mapping
+    stco = _find_box(data, b"stco", *stbl)
+    if stco is not None:
+        chunks_offsets = [offset for offset, in _full_box_entries(data, stco[0], ">I")]
+    else:
+        chunks_offsets = [offset for offset, in _full_box_entries(data, _find_box(data, b"co64", *stbl)[0], ">Q")]
+    stsc = _full_box_entries(data, _find_box(data, b"stsc", *stbl)[0], ">III")
+
+    offsets = []
+    sample = 0
+    for i, (first_chunk, samples_per_chunk, _) in enumerate(stsc):
+        last_chunk = stsc[i + 1][0] - 1 if i + 1 < len(stsc) else len(chunks_offsets)
+        for chunk in range(first_chunk - 1, last_chunk):
+            offset = chunks_offsets[chunk]
+            for _ in range(samples_per_chunk):
+                if sample >= len(sizes):
+                    break
+                offsets.append(offset)
+                offset += sizes[sample]
+                sample += 1
+
+    # Sync samples (every sample is a sync sample if the box is missing)
+    stss = _find_box(data, b"stss", *stbl)
+    syncs = None if stss is None else [number - 1 for number, in _full_box_entries(data, stss[0], ">I")]
+
+    return {
+        "handler": handler,
+        "times": times,
+        "sizes": sizes,
+        "offsets": offsets,
+        "syncs": syncs,
+    }
+
+
+def _track_ranges(track, start, end):
+    times = track["times"]
+    first = max(0, bisect_right(times, start) - 1)
+    last = bisect_left(times, end)
+
+    # Decoding needs to start from a sync sample
+    if track["syncs"] is not None:
+        pos = bisect_right(track["syncs"], first) - 1
+        first = track["syncs"][pos] if pos >= 0 else 0
+
+    return [(track["offsets"][i], track["offsets"][i] + track["sizes"][i]) for i in range(first, last)]
+
+
+def _merge_ranges(ranges, gap=_merge_gap):
+    merged = []
+    for start, end in sorted(ranges):
+        if len(merged) > 0 and start <= merged[-1][1] + gap:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
+
+
+"""
+Partial download
+"""
+
+
+def _write_ranges(url, file_path, size, ranges):
+    # Unfetched parts of the file are left as holes, so the file stays
+    # seekable as every offset of the index stays valid, but is sparse on disk
+    with open(file_path, "wb") as f:
+        f.truncate(size)
+        for start, end in ranges:
+            f.seek(start)
+            f.write(_fetch(url, start, end))
+
+
+def _fetch_progressive(url, file_path, size, boxes, windows):
+    _, moov_offset, moov_size, _ = next(box for box in boxes if box[0] == b"moov")
+    moov = _fetch(url, moov_offset, moov_offset + moov_size)
+    _, _, moov_header_size = _read_box_header(moov, 0)
+    # The samples of fragmented files are not listed by the sample tables, but by their fragments
+    if _find_box(moov, b"mvex", moov_header_size) is not None:
+        raise IOError("Fragmented mp4 without segment index")
+
+    # Every box is kept but the media data, of which only the header is
+    headers_ranges = [
+        (offset, offset + (header_size if box_type == b"mdat" else box_size))
+        for box_type, offset, box_size, header_size in boxes
+    ]
+    samples_ranges = []
+    for trak_type, trak_start, trak_end in _iter_boxes(moov, moov_header_size):
+        if trak_type != b"trak":
+            continue
+        track = _parse_track(moov, trak_start, trak_end)
+        if track["handler"] not in [b"vide", b"soun"]:
+            continue
+        for start, end in windows:
+            samples_ranges += _track_ranges(track, start, end)
+
+    # A file without any media would pass for a downloaded one
+    if len(samples_ranges) == 0:
+        raise IOError("No samples found in the windows")
+
+    ranges = _merge_ranges(headers_ranges + samples_ranges)
+    _write_ranges(url, file_path, size, ranges)
+    return sum(end - start for start, end in ranges)
+
+
+def _fetch_fragmented(url, file_path, boxes, windows):
+    # Everything before the first fragment is the initialization segment
+    init_end = next(offset for box_type, offset, _, _ in boxes if box_type in [b"sidx", b"moof"])
+    _, sidx_offset, sidx_size, _ = next(box for box in boxes if box[0] == b"sidx")
+    sidx = _fetch(url, sidx_offset, sidx_offset + sidx_size)
+
+    # Parse the segment index to know the time and bytes of every fragment
+    version = sidx[8]
+    timescale = struct.unpack_from(">I", sidx, 16)[0]
+    if version == 0:
+        time, first_offset = struct.unpack_from(">II", sidx, 20)
+        pos = 28
+    else:
+        time, first_offset = struct.unpack_from(">QQ", sidx, 20)
+        pos = 36
+    count = struct.unpack_from(">H", sidx, pos + 2)[0]
+    offset = sidx_offset + sidx_size + first_offset
+
+    ranges = [(0, init_end)]
+    windows_fragments_count = 0
+    for i in range(count):
+        referenced_size, duration, _ = struct.unpack_from(">III", sidx, pos + 4 + i * 12)
+        referenced_size &= 0x7FFFFFFF
+        fragment_start, fragment_end = time / timescale, (time + duration) / timescale
+        is_in_windows = any(fragment_start < end and start < fragment_end for start, end in windows)
+        windows_fragments_count += is_in_windows
+        # The first fragment is always kept, so that the file starts at the time the whole video does
+        # (ffmpeg and MoviePy seeking relatively to the start time of the file)
+        if i == 0 or is_in_windows:
+            ranges.append((offset, offset + referenced_size))
+        time += duration
+        offset += referenced_size
+
+    if windows_fragments_count == 0:
+        raise IOError("No fragments found in the windows")
+
+    # The index would point to the wrong offsets, so we rebuild a compact
+    # file from the initialization segment followed by the needed fragments
+    with open(file_path, "wb") as f:
+        for start, end in _merge_ranges(ranges, gap=0):
+            f.write(_fetch(url, start, end))
+    return sum(end - start for start, end in ranges)
+
+
+def fetch_windows(url, file_path, windows, padding=0):
+    """
+    Download only the parts of a remote mp4 file covering the (start, end) windows (in seconds)
+    """
+    windows = [(max(0.0, start - padding), end + padding) for start, end in windows]
+
+    size = _fetch_size(url)
+    boxes = _top_level_boxes(url, size)
+    boxes_types = [box_type for box_type, _, _, _ in boxes]
+
+    # The scan stops at the segment index or the first fragment, so only one of them is listed
+    if b"sidx" in boxes_types:
+        fetched_size = _fetch_fragmented(url, file_path, boxes, windows)
+    elif b"moof" in boxes_types:
+        raise IOError("Fragmented mp4 without segment index")
+    elif b"moov" in boxes_types:
+        fetched_size = _fetch_progressive(url, file_path, size, boxes, windows)
+    else:
+        raise IOError("Unsupported mp4 layout")
+
+    logger.debug(f"Fetched {fetched_size} of {size} bytes")
+    return fetched_size
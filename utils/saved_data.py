@@ -1,17 +1,60 @@
+import atexit
 import os
+import threading
+
+from utils import logger, io, sqlite_store
+
+# Opened SQLite stores, by database path
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def _store(conf):
+    """
+    Get the SQLite store of the data folder, importing the YAML files
+    already saved there when the database is created
+    """
+    database_path = os.path.join(conf.data_folder, "data.sqlite")
+    with _stores_lock:
+        if database_path not in _stores:
+            is_new = not os.path.exists(database_path)
+            store = sqlite_store.Store(database_path, batch_size=conf.data_batch_size)
+            if is_new:
+                store.import_yaml(conf.data_folder)
+            # Writes of the last batch are committed when exiting
+            atexit.register(store.close)
+            _stores[database_path] = store
+        return _stores[database_path]
+
+
+def _dump(conf, path, data):
+    if conf.data_backend == "sqlite":
+        _store(conf).dump(path, data)
+    else:
+        io.dump_yaml(os.path.join(conf.data_folder, f"{path}.yaml"), data)
+
+
+def _load(conf, path):
+    """
+    Get the saved value, as a (found, value) tuple
+    """
+    if conf.data_backend == "sqlite":
+        return _store(conf).load(path)
 
-from utils import logger, io
+    full_path = os.path.join(conf.data_folder, f"{path}.yaml")
+    if not os.path.exists(full_path):
+        return False, None
+    return True, io.load_yaml(full_path)
 
 
 def write(conf, path, func):
-    full_path = os.path.join(conf.data_folder, f"{path}.yaml")
     data = func()
 
     if not conf.do_output_data:
         return data
 
     logger.debug(f"Dump value of '{path}'", prefix=conf.logger_prefix)
-    io.dump_yaml(full_path, data)
+    _dump(conf, path, data)
     return data
 
 
@@ -22,11 +65,11 @@ def _write(conf, path, func):
 
 
 def read(conf, path, func, write=True, update=False):
-    full_path = os.path.join(conf.data_folder, f"{path}.yaml")
-
-    if not update and os.path.exists(full_path):
-        logger.debug(f"Load value of '{path}'", prefix=conf.logger_prefix)
-        return io.load_yaml(full_path)
+    if not update:
+        found, data = _load(conf, path)
+        if found:
+            logger.debug(f"Load value of '{path}'", prefix=conf.logger_prefix)
+            return data
 
     if not write:
         return func()
@@ -34,6 +77,29 @@ def read(conf, path, func, write=True, update=False):
     return _write(conf, path, func)
 
 
+def flush(conf):
+    """
+    Commit the pending writes, when they are batched
+    """
+    if conf.data_backend == "sqlite":
+        _store(conf).commit()
+
+
+def version(conf):
+    """
+    Stamp of the saved data of the videos, which changes whenever it is written
+    """
+    if conf.data_backend == "sqlite":
+        return [_store(conf).version()]
+
+    files_paths = [os.path.join(conf.data_folder, "videos.yaml")]
+    videos_folder = os.path.join(conf.data_folder, "videos")
+    if os.path.isdir(videos_folder):
+        files_paths += [entry.path for entry in os.scandir(videos_folder) if entry.name.endswith(".yaml")]
+    mtimes = [os.stat(file_path).st_mtime_ns for file_path in files_paths if os.path.exists(file_path)]
+    return [len(mtimes), max(mtimes, default=0)]
+
+
 def read_videos(conf):
     videos = read(conf, "videos", lambda: [], write=False)
     max_videos_amount = min(conf.max_videos_amount, len(videos))
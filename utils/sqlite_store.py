@@ -0,0 +1,214 @@
+import json
+import os
+import sqlite3
+import threading
+
+from utils import logger, io
+
+"""
+Saved data stored in a single SQLite database
+
+The data of every video is split in rows (its timestamps and clips), so that
+writing it again only writes the rows that changed, the build state and every
+other value being stored as a whole. Writes are committed by batches, and the
+database being in WAL mode, an interruption only loses the last batch.
+"""
+
+_schema = [
+    "CREATE TABLE IF NOT EXISTS saved_values (path TEXT PRIMARY KEY, value TEXT)",
+    "CREATE TABLE IF NOT EXISTS build (path TEXT PRIMARY KEY, value TEXT)",
+    """
+    CREATE TABLE IF NOT EXISTS videos (
+        video_id TEXT PRIMARY KEY, value TEXT, has_timestamps INTEGER, has_clips INTEGER
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS timestamps (
+        video_id TEXT, position INTEGER, start TEXT, word TEXT, end TEXT, PRIMARY KEY (video_id, position)
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS clips (
+        video_id TEXT, position INTEGER, file TEXT, PRIMARY KEY (video_id, position)
+    )
+    """,
+    "CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value INTEGER)",
+]
+
+# Columns of the rows of every video table, along with the key of the video data they come from
+_rows_tables = {
+    "timestamps": ("timestamps", ["start", "word", "end"]),
+    "clips": ("clips", ["file"]),
+}
+
+
+def _split_path(path):
+    """
+    Table and key a saved data path is stored at
+    """
+    parts = path.replace(os.sep, "/").split("/", 1)
+    if len(parts) == 2 and parts[0] == "videos":
+        return "videos", parts[1]
+    if len(parts) == 2 and parts[0] == "build":
+        return "build", parts[1]
+    return "saved_values", path.replace(os.sep, "/")
+
+
+def _row(value):
+    return tuple(value) if isinstance(value, (list, tuple)) else (value,)
+
+
+class Store:
+    def __init__(self, database_path, batch_size=1):
+        self.database_path = database_path
+        self.batch_size = max(1, batch_size)
+        self.pending_writes = 0
+        # Whether values other than the build state were written since the last commit
+        self.data_changed = False
+        # Shared by every thread, the connection is only used while holding the lock
+        self.lock = threading.RLock()
+
+        os.makedirs(os.path.dirname(database_path) or ".", exist_ok=True)
+        self.connection = sqlite3.connect(database_path, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        for statement in _schema:
+            self.connection.execute(statement)
+        self.connection.commit()
+
+    """
+    Values
+    """
+
+    def _load_video(self, cursor, video_id):
+        row = cursor.execute(
+            "SELECT value, has_timestamps, has_clips FROM videos WHERE video_id = ?", (video_id,)
+        ).fetchone()
+        if row is None:
+            return False, None
+
+        value, has_timestamps, has_clips = row
+        video_data = json.loads(value)
+        # Lists that were not set are not loaded as empty ones
+        has_rows = {"timestamps": has_timestamps, "clips": has_clips}
+        for table, (key, columns) in _rows_tables.items():
+            if not has_rows[table]:
+                continue
+            rows = cursor.execute(
+                f"SELECT {', '.join(columns)} FROM {table} WHERE video_id = ? ORDER BY position", (video_id,)
+            ).fetchall()
+            video_data[key] = [list(row) if len(columns) > 1 else row[0] for row in rows]
+        return True, video_data
+
+    def _dump_rows(self, cursor, table, video_id, values):
+        """
+        Only write the rows that changed, and remove the ones that are not there anymore
+        """
+        _, columns = _rows_tables[table]
+        stored_rows = cursor.execute(
+            f"SELECT {', '.join(columns)} FROM {table} WHERE video_id = ? ORDER BY position", (video_id,)
+        ).fetchall()
+
+        changed_rows = [
+            (video_id, position, *_row(value))
+            for position, value in enumerate(values)
+            if position >= len(stored_rows) or stored_rows[position] != _row(value)
+        ]
+        if len(changed_rows) > 0:
+            cursor.executemany(
+                f"INSERT OR REPLACE INTO {table} (video_id, position, {', '.join(columns)}) "
+                f"VALUES ({', '.join('?' * (len(columns) + 2))})",
+                changed_rows,
+            )
+        if len(stored_rows) > len(values):
+            cursor.execute(f"DELETE FROM {table} WHERE video_id = ? AND position >= ?", (video_id, len(values)))
+
+    def _dump_video(self, cursor, video_id, video_data):
+        video_data = dict(video_data or {})
+        timestamps = video_data.pop("timestamps", None)
+        clips = video_data.pop("clips", None)
+        cursor.execute(
+            "INSERT OR REPLACE INTO videos (video_id, value, has_timestamps, has_clips) VALUES (?, ?, ?, ?)",
+            (video_id, json.dumps(video_data), int(timestamps is not None), int(clips is not None)),
+        )
+        self._dump_rows(cursor, "timestamps", video_id, timestamps or [])
+        self._dump_rows(cursor, "clips", video_id, clips or [])
+
+    def load(self, path):
+        """
+        Get the value saved at the path, as a (found, value) tuple
+        """
+        table, key = _split_path(path)
+        with self.lock:
+            cursor = self.connection.cursor()
+            if table == "videos":
+                return self._load_video(cursor, key)
+            row = cursor.execute(f"SELECT value FROM {table} WHERE path = ?", (key,)).fetchone()
+            return (False, None) if row is None else (True, json.loads(row[0]))
+
+    def dump(self, path, value):
+        table, key = _split_path(path)
+        with self.lock:
+            cursor = self.connection.cursor()
+            if table == "videos":
+                self._dump_video(cursor, key, value)
+            else:
+                cursor.execute(f"INSERT OR REPLACE INTO {table} (path, value) VALUES (?, ?)", (key, json.dumps(value)))
+
+            self.data_changed = self.data_changed or table != "build"
+            self.pending_writes += 1
+            if self.pending_writes >= self.batch_size:
+                self.commit()
+
+    """
+    Transactions
+    """
+
+    def commit(self):
+        with self.lock:
+            if self.data_changed:
+                self.connection.execute("INSERT OR IGNORE INTO meta (key, value) VALUES ('version', 0)")
+                self.connection.execute("UPDATE meta SET value = value + 1 WHERE key = 'version'")
+                self.data_changed = False
+            self.connection.commit()
+            self.pending_writes = 0
+
+    def version(self):
+        """
+        Number of commits which wrote values other than the build state
+        """
+        with self.lock:
+            row = self.connection.execute("SELECT value FROM meta WHERE key = 'version'").fetchone()
+            return 0 if row is None else row[0]
+
+    def close(self):
+        with self.lock:
+            self.commit()
+            self.connection.close()
+
+    """
+    Import
+    """
+
+    def import_yaml(self, data_folder):
+        """
+        Copy every value saved as a YAML file in the data folder, in a single transaction
+        """
+        imported_count = 0
+        with self.lock:
+            batch_size, self.batch_size = self.batch_size, float("inf")
+            try:
+                for folder_path, _, files_names in os.walk(data_folder):
+                    for file_name in sorted(files_names):
+                        if not file_name.endswith(".yaml"):
+                            continue
+                        file_path = os.path.join(folder_path, file_name)
+                        path = os.path.relpath(file_path, data_folder)[: -len(".yaml")]
+                        self.dump(path, io.load_yaml(file_path))
+                        imported_count += 1
+                self.commit()
+            finally:
+                self.batch_size = batch_size
+
+        logger.info(f"Imported {imported_count} saved values from YAML files")
+        return imported_count
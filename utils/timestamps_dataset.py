@@ -0,0 +1,156 @@
+import os
+import shutil
+
+import numpy as np
+
+from utils import logger, saved_data
+from utils.convert import str_to_ms, ms_to_str
+
+"""
+Columnar dataset of the timestamps
+
+The data needed by the charts and statistics is kept in NumPy arrays,
+loaded as memory maps instead of parsing the data of every video:
+
+    videos_ids, titles, published_at, durations_ms   one value per video
+    timestamps_offsets                               where the timestamps of every video start (and end)
+    videos_indexes, starts_ms, ends_ms, words_ids    one value per timestamp
+    words                                            the words the ids refer to
+    version                                          stamp of the saved data the dataset was written from
+"""
+
+_videos_arrays = ["videos_ids", "titles", "published_at", "durations_ms", "timestamps_offsets"]
+_timestamps_arrays = ["videos_indexes", "starts_ms", "ends_ms", "words_ids"]
+
+
+def _dataset_folder(conf):
+    return os.path.join(conf.data_folder, "dataset")
+
+
+class _Timestamps:
+    """
+    Timestamps of a video, only read from the arrays when they are used
+    """
+
+    def __init__(self, dataset, begin, end):
+        self.dataset = dataset
+        self.begin = begin
+        self.end = end
+
+    def __len__(self):
+        return self.end - self.begin
+
+    def __getitem__(self, i):
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError("timestamp index out of range")
+        return self.dataset.timestamp(self.begin + i)
+
+    def __iter__(self):
+        starts_ms = self.dataset.arrays["starts_ms"][self.begin : self.end].tolist()
+        ends_ms = self.dataset.arrays["ends_ms"][self.begin : self.end].tolist()
+        words_ids = self.dataset.arrays["words_ids"][self.begin : self.end].tolist()
+        for start_ms, word_id, end_ms in zip(starts_ms, words_ids, ends_ms):
+            yield ms_to_str(start_ms), self.dataset.words[word_id], ms_to_str(end_ms)
+
+
+class Dataset:
+    def __init__(self, folder):
+        self.arrays = {
+            name: np.load(os.path.join(folder, f"{name}.npy"), mmap_mode="r")
+            for name in _videos_arrays + _timestamps_arrays
+        }
+        # The dictionary is small, and looked up for every timestamp
+        self.words = np.load(os.path.join(folder, "words.npy")).tolist()
+
+    def timestamp(self, i):
+        start_ms, word_id, end_ms = (int(self.arrays[name][i]) for name in ["starts_ms", "words_ids", "ends_ms"])
+        return ms_to_str(start_ms), self.words[word_id], ms_to_str(end_ms)
+
+    def videos(self, max_videos_amount=None):
+        """
+        List the videos, shaped like the saved ones, their timestamps being read lazily
+        """
+        videos_ids = self.arrays["videos_ids"].tolist()
+        titles = self.arrays["titles"].tolist()
+        published_at = self.arrays["published_at"].tolist()
+        durations_ms = self.arrays["durations_ms"].tolist()
+        offsets = self.arrays["timestamps_offsets"].tolist()
+
+        videos = []
+        for i in range(min(max_videos_amount or len(videos_ids), len(videos_ids))):
+            video_data = {"timestamps": _Timestamps(self, offsets[i], offsets[i + 1])}
+            if durations_ms[i] >= 0:
+                video_data["time"] = ms_to_str(durations_ms[i])
+            videos.append(
+                {
+                    "id": {"videoId": videos_ids[i]},
+                    "snippet": {"title": titles[i], "publishedAt": published_at[i]},
+                    "data": video_data,
+                }
+            )
+        return videos
+
+
+def write(conf, videos):
+    """
+    Write the dataset of the videos, replacing the previous one at once
+    """
+    folder = _dataset_folder(conf)
+    temp_folder = f"{folder}.tmp"
+    shutil.rmtree(temp_folder, ignore_errors=True)
+    os.makedirs(temp_folder)
+    # Taken first, so that data saved while the dataset is written makes it stale
+    np.save(os.path.join(temp_folder, "version.npy"), np.array(saved_data.version(conf), dtype=np.int64))
+
+    words = {}
+    columns = {name: [] for name in _videos_arrays + _timestamps_arrays}
+    columns["timestamps_offsets"].append(0)
+    for i, video in enumerate(videos):
+        video_id = video["id"]["videoId"]
+        # Videos which were not processed (filtered ones) still have their saved data
+        video_data = video.get("data", None)
+        if video_data is None:
+            video_data = saved_data.read(conf, os.path.join("videos", video_id), lambda: {}, write=False) or {}
+
+        columns["videos_ids"].append(video_id)
+        columns["titles"].append(video["snippet"]["title"])
+        columns["published_at"].append(video["snippet"]["publishedAt"])
+        time = video_data.get("time", None)
+        columns["durations_ms"].append(-1 if time is None else str_to_ms(time))
+
+        for start, word, end in video_data.get("timestamps", []):
+            columns["videos_indexes"].append(i)
+            columns["starts_ms"].append(str_to_ms(start))
+            columns["ends_ms"].append(str_to_ms(end))
+            columns["words_ids"].append(words.setdefault(word, len(words)))
+        columns["timestamps_offsets"].append(len(columns["starts_ms"]))
+
+    dtypes = {"durations_ms": np.int64, "timestamps_offsets": np.int64, "starts_ms": np.int64, "ends_ms": np.int64}
+    dtypes.update({"videos_indexes": np.int32, "words_ids": np.int32})
+    for name, values in columns.items():
+        np.save(os.path.join(temp_folder, f"{name}.npy"), np.array(values, dtype=dtypes.get(name, str)))
+    np.save(os.path.join(temp_folder, "words.npy"), np.array(list(words), dtype=str))
+
+    shutil.rmtree(folder, ignore_errors=True)
+    os.replace(temp_folder, folder)
+    logger.info(f"Wrote dataset of {len(videos)} videos and {len(columns['starts_ms'])} timestamps")
+
+
+def read_videos(conf):
+    """
+    Load the videos from the dataset if it is up to date, from their saved data otherwise
+    """
+    folder = _dataset_folder(conf)
+    if not os.path.exists(os.path.join(folder, "words.npy")):
+        logger.info("No dataset found, read saved data of every video")
+        return saved_data.read_videos(conf)
+
+    version_file_path = os.path.join(folder, "version.npy")
+    if not os.path.exists(version_file_path) or np.load(version_file_path).tolist() != saved_data.version(conf):
+        logger.info("Dataset is older than the saved data, read saved data of every video")
+        return saved_data.read_videos(conf)
+
+    logger.info("Load dataset")
+    return Dataset(folder).videos(conf.max_videos_amount)
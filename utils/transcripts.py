@@ -0,0 +1,215 @@
+import gzip
+import json
+import os
+
+import numpy as np
+from regex import regex
+
+from utils import logger
+from utils.convert import str_to_ms, ms_to_str
+
+"""
+Word level transcripts
+
+Every word of the subtitles of a video is kept, with its start and end, in a
+compressed NumPy file: the words are stored once in a vocabulary, and every
+token refers to its word by id. An inverted index lists the videos every word
+is pronounced in, so that searching a word only loads the transcripts of the
+videos it is pronounced in.
+"""
+
+_token_pattern = r"<(\d{2}:\d{2}:\d{2}.\d{3})>([^<]+)<(\d{2}:\d{2}:\d{2}.\d{3})>"
+
+
+def _transcript_path(folder, video_id):
+    return os.path.join(folder, f"{video_id}.npz")
+
+
+def _index_path(folder):
+    return os.path.join(folder, "index.json.gz")
+
+
+def normalize(word):
+    return word.lower().strip()
+
+
+def tokens(content):
+    """
+    List every (start, word, end) token of cleaned subtitles content, the words being normalized
+    """
+    matches = regex.findall(_token_pattern, content, overlapped=True)
+    return [(start, normalize(word), end) for start, word, end in matches]
+
+
+class Matcher:
+    """
+    Match words against many named patterns at once
+
+    Patterns without any special character only match the words they start, so they
+    are looked up in a set by the prefixes of the word. The other ones are only tried
+    one by one if the alternation of all of them matches the word.
+    """
+
+    def __init__(self, patterns):
+        self.names = list(patterns)
+        self.literals = {}
+        self.patterns = {}
+        for name, pattern in patterns.items():
+            if regex.escape(pattern) == pattern:
+                self.literals.setdefault(pattern, []).append(name)
+            else:
+                self.patterns[name] = regex.compile(pattern)
+
+        self.max_literal_length = max([-1, *(len(literal) for literal in self.literals)])
+        self.any_pattern = None
+        if len(self.patterns) > 0:
+            self.any_pattern = regex.compile("|".join(f"(?:{p.pattern})" for p in self.patterns.values()))
+
+    def word_names(self, word):
+        """
+        Names of the patterns matching the word
+        """
+        names = []
+        for length in range(min(len(word), self.max_literal_length) + 1):
+            names += self.literals.get(word[:length], [])
+        if self.any_pattern is not None and self.any_pattern.match(word):
+            names += [name for name, pattern in self.patterns.items() if pattern.match(word)]
+        return names
+
+    def match(self, video_tokens):
+        """
+        Indexes of the tokens matching every pattern, by name, the tokens being
+        scanned once and the patterns only being tried once per distinct word
+        """
+        words_names = {}
+        matches = {name: [] for name in self.names}
+        for i, (_, word, _) in enumerate(video_tokens):
+            if word not in words_names:
+                words_names[word] = self.word_names(word)
+            for name in words_names[word]:
+                matches[name].append(i)
+        return matches
+
+
+def match(video_tokens, pattern):
+    """
+    Tokens whose word matches the pattern
+    """
+    return [video_tokens[i] for i in Matcher({pattern: pattern}).match(video_tokens)[pattern]]
+
+
+def save(folder, video_id, video_tokens, time):
+    words = {}
+    words_ids = [words.setdefault(word, len(words)) for _, word, _ in video_tokens]
+
+    # Written aside then moved, so that an interrupted write is never loaded
+    os.makedirs(folder, exist_ok=True)
+    transcript_path = _transcript_path(folder, video_id)
+    temp_transcript_path = transcript_path.replace(".npz", ".tmp.npz")
+    np.savez_compressed(
+        temp_transcript_path,
+        words=np.array(list(words), dtype=str),
+        words_ids=np.array(words_ids, dtype=np.int32),
+        starts_ms=np.array([str_to_ms(start) for start, _, _ in video_tokens], dtype=np.int64),
+        ends_ms=np.array([str_to_ms(end) for _, _, end in video_tokens], dtype=np.int64),
+        time=np.array(time or "", dtype=str),
+    )
+    os.replace(temp_transcript_path, transcript_path)
+
+
+def load(folder, video_id):
+    """
+    Get the tokens and the time of a video, or None if its transcript was not saved
+    """
+    transcript_path = _transcript_path(folder, video_id)
+    if not os.path.exists(transcript_path):
+        return None
+
+    with np.load(transcript_path) as transcript:
+        words = transcript["words"].tolist()
+        video_tokens = [
+            (ms_to_str(start_ms), words[word_id], ms_to_str(end_ms))
+            for start_ms, word_id, end_ms in zip(
+                transcript["starts_ms"].tolist(), transcript["words_ids"].tolist(), transcript["ends_ms"].tolist()
+            )
+        ]
+        time = str(transcript["time"]) or None
+    return video_tokens, time
+
+
+def _vocabulary(folder, video_id):
+    with np.load(_transcript_path(folder, video_id)) as transcript:
+        return transcript["words"].tolist()
+
+
+"""
+Inverted index
+"""
+
+
+def _load_index(folder):
+    index_path = _index_path(folder)
+    if not os.path.exists(index_path):
+        return {"videos": {}, "postings": {}}
+    with gzip.open(index_path, "rt", encoding="utf8") as f:
+        return json.load(f)
+
+
+def update_index(folder):
+    """
+    Add the transcripts saved since the last update to the index, replacing the ones that changed
+    """
+    if not os.path.isdir(folder):
+        return
+
+    index = _load_index(folder)
+    indexed_videos, postings = index["videos"], index["postings"]
+
+    changed_videos = {}
+    for file_name in os.listdir(folder):
+        if not file_name.endswith(".npz") or file_name.endswith(".tmp.npz"):
+            continue
+        video_id = file_name[: -len(".npz")]
+        mtime = os.path.getmtime(os.path.join(folder, file_name))
+        if indexed_videos.get(video_id, None) != mtime:
+            changed_videos[video_id] = mtime
+    if len(changed_videos) == 0:
+        return
+
+    logger.info(f"Index transcripts of {len(changed_videos)} videos")
+    if any(video_id in indexed_videos for video_id in changed_videos):
+        for word in list(postings):
+            postings[word] = [video_id for video_id in postings[word] if video_id not in changed_videos]
+    for video_id, mtime in changed_videos.items():
+        for word in _vocabulary(folder, video_id):
+            postings.setdefault(word, []).append(video_id)
+        indexed_videos[video_id] = mtime
+
+    index_path = _index_path(folder)
+    with gzip.open(f"{index_path}.tmp", "wt", encoding="utf8") as f:
+        json.dump(index, f)
+    os.replace(f"{index_path}.tmp", index_path)
+
+
+def search(folder, pattern, videos_ids=None):
+    """
+    Find the tokens matching the pattern in the indexed transcripts (of the given videos only if set),
+    returning them by video id
+    """
+    postings = _load_index(folder)["postings"]
+    compiled_pattern = regex.compile(pattern)
+
+    # The pattern is only tried on the vocabulary, and only the transcripts of the matching videos are loaded
+    matching_videos_ids = set()
+    for word, posting in postings.items():
+        if compiled_pattern.match(word):
+            matching_videos_ids.update(posting)
+    if videos_ids is not None:
+        matching_videos_ids &= set(videos_ids)
+
+    results = {}
+    for video_id in sorted(matching_videos_ids):
+        transcript = load(folder, video_id)
+        if transcript is not None:
+            results[video_id] = match(transcript[0], pattern)
+    return results
@@ -1,11 +1,14 @@
 import datetime
 import json
 import os
+import queue
+import struct
+import time
 from urllib.request import urlopen
 
 from youtube_dl import YoutubeDL, DownloadError
 
-from utils import logger
+from utils import logger, mp4
 
 """
 Youtube API
@@ -88,41 +91,274 @@ Youtube DL
 """
 
 
+# YoutubeDL instances reused from one download to another, to avoid their setup cost
+_ydl_pool = queue.LifoQueue()
+
+
+def _acquire_ydl(params):
+    try:
+        ydl, default_params = _ydl_pool.get_nowait()
+    except queue.Empty:
+        ydl = YoutubeDL()
+        default_params = dict(ydl.params)
+    ydl.params = {**default_params, **params}
+    return ydl, default_params
+
+
+def _release_ydl(ydl, default_params):
+    _ydl_pool.put((ydl, default_params))
+
+
+def _load_info(file_path, max_age):
+    if max_age <= 0 or not os.path.exists(file_path):
+        return None
+    if time.time() - os.path.getmtime(file_path) > max_age:
+        return None
+    with open(file_path, "r", encoding="utf8") as f:
+        return json.load(f)
+
+
+def _save_info(file_path, info):
+    # Dump aside then move, so that the file is never half written
+    temp_file_path = f"{file_path}.tmp"
+    with open(temp_file_path, "w", encoding="utf8") as f:
+        json.dump(info, f, default=str)
+    os.replace(temp_file_path, file_path)
+
+
+def _load_format(file_path):
+    if not os.path.exists(file_path):
+        return None
+    with open(file_path, "r", encoding="utf8") as f:
+        return json.load(f)
+
+
+def _format_summary(fmt):
+    return {key: fmt.get(key) for key in ["format_id", "ext", "width", "height", "fps", "vcodec", "acodec", "tbr"]}
+
+
+def select_format(formats, resolution, max_fps=None, codecs=None, progressive=False):
+    """
+    Pick the smallest video stream at least as big as the resolution (format: WIDTHxHEIGHT),
+    preferring the given codecs and streams up to max_fps, along with the best audio stream
+    """
+    _, height = map(int, resolution.split("x"))
+    codecs = codecs or []
+
+    def codec_rank(fmt):
+        for i, codec in enumerate(codecs):
+            if (fmt.get("vcodec") or "").startswith(codec):
+                return i
+        return len(codecs)
+
+    videos = [fmt for fmt in formats if fmt.get("vcodec", "none") != "none" and fmt.get("height")]
+    if progressive:
+        # Single file holding both the video and the audio, that can be fetched by ranges
+        videos = [
+            fmt
+            for fmt in videos
+            if fmt.get("acodec", "none") != "none"
+            and fmt.get("ext") == "mp4"
+            and fmt.get("protocol", "").startswith("http")
+        ]
+    if max_fps is not None:
+        videos = [fmt for fmt in videos if (fmt.get("fps") or 0) <= max_fps] or videos
+    if len(videos) == 0:
+        return None
+
+    big_enough_videos = [fmt for fmt in videos if fmt["height"] >= height]
+    if len(big_enough_videos) > 0:
+        video = min(
+            big_enough_videos,
+            key=lambda fmt: (fmt["height"], codec_rank(fmt), fmt.get("fps") or 0, fmt.get("tbr") or 0),
+        )
+    else:
+        video = max(videos, key=lambda fmt: (fmt["height"], -codec_rank(fmt), fmt.get("tbr") or 0))
+
+    if video.get("acodec", "none") != "none":
+        return {"format_id": video["format_id"], "video": _format_summary(video), "audio": None}
+
+    audios = [fmt for fmt in formats if fmt.get("vcodec") == "none" and fmt.get("acodec", "none") != "none"]
+    if len(audios) == 0:
+        return {"format_id": video["format_id"], "video": _format_summary(video), "audio": None}
+
+    # Prefer audio streams that can be merged in an mp4 file without re-encoding
+    audio = max(audios, key=lambda fmt: (fmt.get("ext") == "m4a", fmt.get("abr") or 0))
+    return {
+        "format_id": f"{video['format_id']}+{audio['format_id']}",
+        "video": _format_summary(video),
+        "audio": _format_summary(audio),
+    }
+
+
 class download:
-    def __init__(self, video_id, output_path, subtitles=True, video=True, cleanup=True):
+    def __init__(
+        self,
+        video_id,
+        output_path,
+        subtitles=True,
+        video=True,
+        cleanup=True,
+        windows=None,
+        padding=0,
+        resolution=None,
+        max_fps=None,
+        codecs=None,
+        cache=None,
+        info_max_age=0,
+    ):
         self.video_id = video_id
         self.output_path = output_path
         self.subtitles = subtitles
         self.video = video
         self.cleanup = cleanup
+        # If set, only the parts of the video covering these (start, end) windows are downloaded
+        self.windows = windows
+        self.padding = padding
+        # If set, pick the smallest video stream at least as big as this resolution
+        self.resolution = resolution
+        self.max_fps = max_fps
+        self.codecs = codecs
+        # If set, downloaded files are kept in this cache instead of being cleaned up
+        self.cache = cache
+        # If set, the extracted video information is saved and reused for this amount of seconds
+        self.info_max_age = info_max_age
+
+    def _extract_info(self, ydl, video_url, use_saved_info):
+        info_file_path = os.path.join(self.output_path, f"{self.video_id}.info.json")
+
+        info = _load_info(info_file_path, self.info_max_age) if use_saved_info else None
+        if info is not None:
+            logger.debug("Use saved video information", prefix=f"{self.video_id} >> ")
+            return info, True
+
+        info = ydl.extract_info(video_url, download=False, process=False)
+        if self.info_max_age > 0:
+            os.makedirs(self.output_path, exist_ok=True)
+            _save_info(info_file_path, info)
+        return info, False
+
+    def _download(self, ydl_config, do_download_video, is_partial, use_saved_info=True):
+        video_url = f"http://youtube.com/watch?v={self.video_id}"
+        ydl, default_params = _acquire_ydl(ydl_config)
+        try:
+            info, is_saved_info = self._extract_info(ydl, video_url, use_saved_info)
+
+            try:
+                if do_download_video and self.resolution is not None:
+                    formats = info.get("formats", [])
+                    self.format = select_format(formats, self.resolution, self.max_fps, self.codecs, is_partial)
+                    # Parts can only be fetched from progressive files, which are often smaller than the resolution
+                    _, height = map(int, self.resolution.split("x"))
+                    if is_partial and (self.format is None or self.format["video"]["height"] < height):
+                        logger.info(
+                            "No progressive format is big enough, download whole video file instead",
+                            prefix=f"{self.video_id} >> ",
+                        )
+                        is_partial = False
+                        del ydl.params["skip_download"]
+                        self.format = select_format(formats, self.resolution, self.max_fps, self.codecs)
+                    if self.format is not None:
+                        logger.debug(f"Selected format {self.format['format_id']}", prefix=f"{self.video_id} >> ")
+                        ydl.params["format"] = self.format["format_id"]
+
+                if not is_partial or not self._download_windows(ydl, info):
+                    if is_partial:
+                        logger.info("Download whole video file instead", prefix=f"{self.video_id} >> ")
+                        del ydl.params["skip_download"]
+                    ydl.process_ie_result(info, download=True)
+            except DownloadError:
+                if not is_saved_info:
+                    raise
+                # The urls of the saved information might have expired
+                logger.info("Saved video information is outdated, extract it again", prefix=f"{self.video_id} >> ")
+                self._download(ydl_config, do_download_video, is_partial, use_saved_info=False)
+        finally:
+            _release_ydl(ydl, default_params)
+
+    def _download_windows(self, ydl, info):
+        # The partial file is named differently so that it is never mistaken for a complete download
+        self.video_file_path = os.path.join(self.output_path, f"{self.video_file_name}.partial.mp4")
+        os.makedirs(self.output_path, exist_ok=True)
+
+        info = ydl.process_ie_result(info, download=False)
+        try:
+            mp4.fetch_windows(info["url"], self.video_file_path, self.windows, self.padding)
+            return True
+        except (IOError, KeyError, StopIteration, struct.error) as e:
+            logger.error(f"Unable to download parts of the video: {e}", prefix=f"{self.video_id} >> ")
+            if os.path.exists(self.video_file_path):
+                os.remove(self.video_file_path)
+            self.video_file_path = os.path.join(self.output_path, f"{self.video_file_name}.mp4")
+            return False
 
     def __enter__(self):
-        self.video_file_path = os.path.join(self.output_path, f"{self.video_id}.mp4")
+        # Files of formats selected for different resolutions are kept apart, so that one is never reused for another
+        self.video_file_name = self.video_id if self.resolution is None else f"{self.video_id}.{self.resolution}"
+        self.video_file_path = os.path.join(self.output_path, f"{self.video_file_name}.mp4")
         self.subtitles_file_path = os.path.join(self.output_path, f"{self.video_id}.en.vtt")
+        # The format of the video file is kept along it, so that it is known when the file is reused
+        self.format_file_path = os.path.join(self.output_path, f"{self.video_file_name}.format.json")
+        self.format = None
 
         ydl_config = {
             "outtmpl": self.video_file_path,
+            "merge_output_format": "mp4",
         }
 
-        if self.subtitles:
+        do_download_subtitles = self.subtitles
+        do_download_video = self.video
+        if self.cache is not None:
+            self.cache.pin(self.video_id)
+            # Files already in the cache do not need to be downloaded again
+            if self.subtitles and self.cache.lookup(self.subtitles_file_path):
+                logger.info("Use cached subtitles file", prefix=f"{self.video_id} >> ")
+                do_download_subtitles = False
+            if self.video and self.cache.lookup(self.video_file_path):
+                logger.info("Use cached video file", prefix=f"{self.video_id} >> ")
+                do_download_video = False
+                self.cache.touch(self.format_file_path)
+                self.format = _load_format(self.format_file_path)
+
+        if do_download_subtitles:
             logger.info(f"Download subtitles file", prefix=f"{self.video_id} >> ")
             ydl_config["writesubtitles"] = True
             ydl_config["subtitleslangs"] = ["en"]
             ydl_config["writeautomaticsub"] = True
 
-        if self.video:
+        is_partial = do_download_video and self.windows is not None
+        if is_partial:
+            logger.info("Download parts of the video file", prefix=f"{self.video_id} >> ")
+            # Only a single progressive mp4 file can be fetched by ranges
+            ydl_config["format"] = "best[ext=mp4][protocol^=http]"
+            ydl_config["skip_download"] = True
+        elif do_download_video:
             logger.info("Download video file", prefix=f"{self.video_id} >> ")
         else:
             ydl_config["skip_download"] = True
 
-        video_url = f"http://youtube.com/watch?v={self.video_id}"
-        with YoutubeDL(ydl_config) as ydl:
-            try:
-                ydl.download([video_url])
-            except DownloadError as e:
-                logger.error(f"Unable to download: {e}", prefix=f"{self.video_id} >> ")
-                return None
+        # Everything is already in the cache
+        if not do_download_subtitles and not do_download_video:
+            return self._result()
 
+        try:
+            self._download(ydl_config, do_download_video, is_partial)
+        except DownloadError as e:
+            logger.error(f"Unable to download: {e}", prefix=f"{self.video_id} >> ")
+            return None
+
+        # Partial files are never reused, so their format is not kept
+        if do_download_video and self.format is not None and not self.video_file_path.endswith(".partial.mp4"):
+            _save_info(self.format_file_path, self.format)
+
+        if self.cache is not None:
+            self.cache.touch(self.subtitles_file_path)
+            self.cache.touch(self.video_file_path)
+            self.cache.evict()
+
+        return self._result()
+
+    def _result(self):
         return {
             "subtitles_file": {
                 "path": self.subtitles_file_path,
@@ -131,11 +367,22 @@ class download:
             "video_file": {
                 "path": self.video_file_path,
                 "exists": os.path.exists(self.video_file_path),
+                "format": self.format,
             },
         }
 
     def __exit__(self, exc_type, exc_val, exc_tb):
-        if self.cleanup:
+        if self.cache is not None:
+            self.cache.unpin(self.video_id)
+            # Partial files only hold the parts needed for this download
+            if self.cleanup and self.video_file_path.endswith(".partial.mp4") and os.path.exists(self.video_file_path):
+                try:
+                    logger.info("Remove partial video file", prefix=f"{self.video_id} >> ")
+                    os.remove(self.video_file_path)
+                except OSError:
+                    pass
+            self.cache.evict()
+        elif self.cleanup:
             if os.path.exists(self.subtitles_file_path):
                 try:
                     logger.info("Remove subtitles file", prefix=f"{self.video_id} >> ")
@@ -150,6 +397,12 @@ class download:
                 except OSError:
                     pass
 
+            if os.path.exists(self.format_file_path):
+                try:
+                    os.remove(self.format_file_path)
+                except OSError:
+                    pass
+
             if os.path.exists(f"{self.video_file_path}.part"):
                 try:
                     logger.info("Remove incomplete video file", prefix=f"{self.video_id} >> ")